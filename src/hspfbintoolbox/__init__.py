@@ -1,4 +1,20 @@
-from .hspfbintoolbox import catalog, extract
+from .hspfbintoolbox import (
+    AsyncHbnFile,
+    HbnFile,
+    catalog,
+    diff,
+    ensemble,
+    extract,
+    extract_intervals,
+    index_archive,
+    lookup,
+    nday,
+    query,
+    search,
+    serve,
+    validate,
+    zonemap,
+)
 from .toolbox_utils.src.toolbox_utils.tsutils import about as _about
 
 
@@ -7,4 +23,21 @@ def about():
     _about(__name__)
 
 
-__all__ = ["about", "catalog", "extract"]
+__all__ = [
+    "AsyncHbnFile",
+    "HbnFile",
+    "about",
+    "catalog",
+    "diff",
+    "ensemble",
+    "extract",
+    "extract_intervals",
+    "index_archive",
+    "lookup",
+    "nday",
+    "query",
+    "search",
+    "serve",
+    "validate",
+    "zonemap",
+]
@@ -2,15 +2,41 @@
 hspfbintoolbox to read HSPF binary files.
 """
 
-import datetime
+import ast
+import asyncio
+import calendar
+import concurrent.futures
+import contextlib
+import copy
+import csv
+import fnmatch
+import functools
+import glob
+import http.client
+import http.server
+import io
+import itertools
+import json
+import math
+import mmap
 import os
+import re
+import secrets
+import sqlite3
 import struct
 import sys
-from typing import Literal
+import tempfile
+import threading
+import warnings
+from collections import namedtuple
+from typing import List, Literal, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from cltoolbox import Program
 from cltoolbox.rst_text_formatter import RSTHelpFormatter
+from numpy.lib.stride_tricks import as_strided
+from pandas.tseries.frequencies import to_offset
 
 try:
     from pydantic import validate_call
@@ -19,6 +45,16 @@ except ImportError:
 
 from .toolbox_utils.src.toolbox_utils import tsutils
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
 program = Program("hspfbintoolbox", 0.0)
 
 code2intervalmap = {5: "yearly", 4: "monthly", 3: "daily", 2: "bivl"}
@@ -34,43 +70,1215 @@ else:
 _LOCAL_DOCSTRINGS = {
     "hbnfilename": r"""hbnfilename: str
         The HSPF binary output file.  This file must have been created from
-        a completed model run."""
+        a completed model run.""",
+    "label_file": r"""label_file: str
+        [optional, default is None]
+
+        A file of labels, in addition to any given as arguments, for when
+        there are too many labels for the command line.  Each line is one
+        label in the same 'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE' format,
+        so a CSV file with those four columns also works.  Blank lines,
+        lines starting with '#', and a header line starting with
+        'OPERATIONTYPE' are skipped.  Use '-' to read the labels from
+        stdin.""",
+    "memory_budget": r"""memory_budget: str
+        [optional, default is None]
+
+        The most memory to use for the returned data, as a number of bytes
+        or with a unit, for example '16GB'.  The size of the result is known
+        before the values are read, and if it is larger than the budget the
+        values are written to a temporary memory mapped file that backs the
+        returned DataFrame.  The values are then read from the binary file
+        and copied a slice at a time, so the working memory also stays
+        within the budget.  The temporary file is in the directory given by
+        the TMPDIR environment variable and is removed when the DataFrame is
+        deleted.  The default of None always keeps the data in memory.""",
 }
 
 
-def tuple_match(a, b):
-    """Part of partial ordered matching.
-    See http://stackoverflow.com/a/4559604
+def _freq_from_dates(intervalcode, ndates):
+    """Return the pandas frequency for records of 'intervalcode'.
+
+    The yearly, monthly, and daily levels have a fixed frequency.  The
+    sub-daily 'bivl' level is defined in the UCI file, so the step is taken
+    as the smallest difference between the sorted record timestamps.
+    """
+    if intervalcode != 2:
+        return code2freqmap[intervalcode]
+    if len(ndates) < 2:
+        return to_offset(pd.Timedelta(hours=1))
+    return to_offset(pd.Timedelta(np.diff(ndates).min()))
+
+
+def _read_label_file(label_file):
+    """Return the labels in 'label_file', see the 'label_file' docstring."""
+    if label_file is None:
+        return []
+    labels = []
+    with contextlib.ExitStack() as stack:
+        if label_file == "-":
+            lines = sys.stdin
+        else:
+            lines = stack.enter_context(open(label_file, newline=""))
+        for row in csv.reader(lines):
+            row = [i.strip() for i in row]
+            if not any(row) or row[0].startswith("#"):
+                continue
+            if row[0].upper() == "OPERATIONTYPE":
+                continue
+            labels.append(row)
+    return labels
+
+
+def _read_weights_file(weights_file):
+    """Return the weights in 'weights_file' as a dict of (OPERATIONTYPE, ID)
+    to a list of (AGGREGATE, WEIGHT), see the 'extract' docstring."""
+    weights = {}
+    with open(weights_file, newline="") as lines:
+        for linenum, row in enumerate(csv.reader(lines), 1):
+            row = [i.strip() for i in row]
+            if not any(row) or row[0].startswith("#"):
+                continue
+            if row[0].upper() == "OPERATIONTYPE":
+                continue
+            try:
+                optype, lue, weight, aggregate = row
+                key = (optype.upper(), int(lue))
+                weights.setdefault(key, []).append((aggregate, float(weight)))
+            except ValueError as exc:
+                raise ValueError(
+                    tsutils.error_wrapper(
+                        f"""
+                        Line {linenum} of the weights file '{weights_file}'
+                        must be 'OPERATIONTYPE,ID,WEIGHT,AGGREGATE' with an
+                        integer ID and a number for the WEIGHT instead of
+                        {row}.
+                        """
+                    )
+                ) from exc
+    return weights
+
+
+def _label_pattern(field, flags=0):
+    """Return the compiled pattern if the label 'field' is a pattern.
+
+    A field starting with 're:' is a regular expression and a field with
+    any of the glob characters '*?[' is a glob.  Both have to match the
+    whole name.  Returns None for plain names.
     """
-    return len(a) == len(b) and all(
-        i is None or j is None or i == j for i, j in zip(a, b)
+    if not isinstance(field, str):
+        return None
+    if field.startswith("re:"):
+        pattern = field[3:]
+    elif any(i in field for i in "*?["):
+        pattern = fnmatch.translate(field)
+    else:
+        return None
+    try:
+        return re.compile(pattern, flags)
+    except re.error as err:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The label pattern '{field}' is not valid: {err}.
+                """
+            )
+        ) from err
+
+
+def _label_vocabulary(hbn):
+    """Return the sets of operation types, groups, and variable names."""
+    blocks = hbn.blocks()
+    return (
+        {optype.decode("ascii") for optype, _, _, _ in blocks},
+        {group.decode("ascii") for _, _, group, _ in blocks},
+        {name for names in hbn.vnames.values() for name in names},
     )
 
 
-def tuple_combine(a, b):
-    """Part of partial ordered matching.
-    See http://stackoverflow.com/a/4559604
+def _expand_label_pattern(field, names):
+    """Return the names matched by 'field', or just 'field' if not a pattern."""
+    if isinstance(field, re.Pattern):
+        return sorted(name for name in names if field.fullmatch(name))
+    return [field]
+
+
+def _match_labelsets(labelsets, key):
+    """Return the (label number, ID) pairs of 'labelsets' matching 'key'.
+
+    The 'key' is (optype, lue, group, variable, level) as found in the file,
+    and 'labelsets' is built by '_build_labelsets'.
     """
-    return tuple(i is None and j or i for i, j in zip(a, b))
+    optype, lue, group, vname, _ = key
+    hits = []
+    for setkey in itertools.product((optype, None), (group, None), (vname, None)):
+        luesets = labelsets.get(setkey)
+        if luesets is None:
+            continue
+        for luenum in (lue, None):
+            hits.extend((labelnum, luenum) for labelnum in luesets.get(luenum, ()))
+    return hits
 
 
-def tuple_search(findme, haystack):
-    """Partial ordered matching with 'None' as wildcard
-    See http://stackoverflow.com/a/4559604
+def _scan_chunk(buf, pos, end, offsets, lengths):
+    """Walk the record boundaries of 'buf' starting at byte 'pos'.
+
+    Stores the offset and length (from the record length bitfield) of up to
+    len(offsets) records.  Returns the number of records found and the
+    position of the next record.  Stops early at a record with an unexpected
+    record type, a length too short for its leader, or a length past the
+    end, see 'HbnFile._resync'.
+
+    This is written so that it can be run on a mmap by the Python
+    interpreter or compiled by numba and run on a uint8 array.
     """
-    return [
-        (i, tuple_combine(findme, h))
-        for i, h in enumerate(haystack)
-        if tuple_match(findme, h)
-    ]
+    count = 0
+    maxcount = len(offsets)
+    while count < maxcount and pos + 28 <= end:
+        # record length bitfield, which doesn't include the four bytes of the
+        # bitfield itself
+        reclen = (
+            (int(buf[pos]) >> 2)
+            + int(buf[pos + 1]) * 64
+            + int(buf[pos + 2]) * 16384
+            + int(buf[pos + 3]) * 4194304
+        )
+        rectype = (
+            int(buf[pos + 4])
+            + int(buf[pos + 5]) * 256
+            + int(buf[pos + 6]) * 65536
+            + int(buf[pos + 7]) * 16777216
+        )
+        if (
+            (rectype != 0 and rectype != 1)
+            or reclen < 24
+            or (rectype == 1 and reclen < 56)
+            or pos + 4 + reclen > end
+        ):
+            # there was a problem with unexpected record type or length, a
+            # header leader is 24 bytes and a data record has at least one
+            # value after its 52 byte leader
+            break
+        offsets[count] = pos
+        lengths[count] = reclen
+        count += 1
 
+        # skip to the end of the variable-length back pointer
+        reccnt = (reclen + 4) * 4 + 1
+        if reccnt >= 65536:
+            pos += reclen + 7
+        elif reccnt >= 256:
+            pos += reclen + 6
+        else:
+            pos += reclen + 5
+    return count, pos
 
-def _get_data(binfilename, interval="daily", labels=None, catalog_only=True):
-    """Underlying function to read from the binary file.  Used by
-    'extract', 'catalog'.
+
+if numba is not None:
+    _scan_chunk_jit = numba.njit(cache=True, nogil=True)(_scan_chunk)
+else:
+    _scan_chunk_jit = None
+
+
+def _back_pointer_size(reclen):
+    """Return the number of bytes of the back pointer after a record."""
+    backptr = (reclen + 4) * 4 + 1
+    return 3 if backptr >= 65536 else 2 if backptr >= 256 else 1
+
+
+def _gather(u8, offsets, nbytes):
+    """Return the 'nbytes' bytes at each of the 'offsets' as rows of an array."""
+    return u8[offsets[:, None] + np.arange(nbytes)]
+
+
+def _gather_u4(u8, offsets):
+    """Return the little-endian 4 byte unsigned integers at 'offsets'."""
+    return _gather(u8, offsets, 4).view("<u4")[:, 0]
+
+
+def _gather_s8(u8, offsets):
+    """Return the stripped 8 byte names at 'offsets' as an object array."""
+    raw = _gather(u8, offsets, 8).view("<u8")[:, 0]
+    uniq, inverse = np.unique(raw, return_inverse=True)
+    names = np.array([i.tobytes().rstrip(b"\x00").strip() for i in uniq], dtype=object)
+    return names[inverse.reshape(-1)]
+
+
+def _gather_reclen(u8, offsets):
+    """Return the record lengths from the bitfields at 'offsets'."""
+    bitfield = _gather(u8, offsets, 4).astype(np.int64)
+    return (
+        (bitfield[:, 0] >> 2)
+        + bitfield[:, 1] * 64
+        + bitfield[:, 2] * 16384
+        + bitfield[:, 3] * 4194304
+    )
+
+
+def _gather_dates(u8, offsets, level):
+    """Return the dates of the data records at 'offsets'.
+
+    The data record leader is followed by seven words, (unused, level, year,
+    month, day, hour, minute).  Only the 'bivl' records use the hour and
+    minute.
+    """
+    year = _gather_u4(u8, offsets + 36).astype(np.int64)
+    month = _gather_u4(u8, offsets + 40).astype(np.int64)
+    day = _gather_u4(u8, offsets + 44).astype(np.int64)
+    minutes = _gather_u4(u8, offsets + 48).astype(np.int64) * 60
+    minutes += _gather_u4(u8, offsets + 52)
+    minutes[level != 2] = 0
+    return ((year - 1970) * 12 + month - 1).astype("M8[M]").astype("M8[m]") + (
+        (day - 1) * 1440 + minutes
+    ).astype("m8[m]")
+
+
+def _file_time(year, month, day, hour, minute):
+    """Return an integer that orders record times as HSPF writes them."""
+    return (((year * 13 + month) * 32 + day) * 25 + hour) * 60 + minute
+
+
+def _gather_file_times(u8, offsets, level):
+    """Return the '_file_time' of the data records at 'offsets'.
+
+    The records other than 'bivl' are written at hour 24 of their last day,
+    after the 'bivl' records of that day.
+    """
+    year, month, day, hour, minute = (
+        _gather_u4(u8, offsets + i).astype(np.int64) for i in range(36, 56, 4)
+    )
+    hour[level != 2] = 24
+    minute[level != 2] = 0
+    return _file_time(year, month, day, hour, minute)
+
+
+_Layout = namedtuple(
+    "_Layout",
+    [
+        "start",
+        "cycle_bytes",
+        "ncycles",
+        "keys",
+        "offsets",
+        "lengths",
+        "headers",
+        "leaders",
+    ],
+)
+
+
+_OPTYPES = (b"PERLND", b"IMPLND", b"RCHRES", b"BMPRAC")
+
+
+class HbnFile:
+    """Memory mapped reader for an HSPF binary output file.
+
+    The record boundaries are found on first use, using a numba compiled
+    scanner if numba is installed.  Each record is then described by an
+    entry in the arrays 'offset', 'length', 'rectype', 'optype', 'lue',
+    'group', 'level', 'dates', and 'numvals'.  Header records have a level of
+    0 and a 'dates' entry of NaT.
+
+    HSPF writes the same sequence of data records at every output time step,
+    so when the file has a single output interval the byte layout is usually
+    periodic.  The 'layout' attribute describes the repeating cycle if one is
+    found, and then the offset of any record can be computed directly with
+    'record_offset' and the record boundaries are not scanned.
+
+    Parameters
+    ----------
+    hbnfilename: str
+        The HSPF binary output file.
+    use_numba: bool
+        [optional, default is True]
+
+        Use the numba compiled scanner if numba is installed.
+    use_layout: bool
+        [optional, default is True]
+
+        Look for a periodic layout of the data records.
+    """
+
+    _chunk = 1_000_000
+    _fields = (
+        "offset",
+        "length",
+        "rectype",
+        "optype",
+        "lue",
+        "group",
+        "level",
+        "dates",
+        "numvals",
+    )
+
+    def __init__(self, hbnfilename, use_numba=True, use_layout=True):
+        self.filename = hbnfilename
+        with open(hbnfilename, "rb") as binfp:
+            # read first byte - must be hex FD (decimal 253) for valid file.
+            magicbyte = binfp.read(1)
+            if magicbyte != b"\xfd":
+                # not a valid HSPF binary file
+                raise ValueError(
+                    tsutils.error_wrapper(
+                        f"""
+                        {hbnfilename} is not a valid HSPF binary output file
+                        (.hbn),  The first byte must be FD hexadecimal, but it
+                        was {magicbyte}.
+                        """
+                    )
+                )
+            self.buffer = mmap.mmap(binfp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.u8 = np.frombuffer(self.buffer, dtype=np.uint8)
+        self._use_numba = use_numba and _scan_chunk_jit is not None
+        self._use_layout = use_layout
+        self._blocks = None
+        self._skipped = {}
+        self._series_keys = {}
+        self._shared = False
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # The record arrays, the header names, and the layout are only found
+        # when first used.  The lock lets threads share one HbnFile.
+        if name not in self._fields and name not in ("vnames", "layout"):
+            raise AttributeError(name)
+        with self._lock:
+            if name in self.__dict__:
+                pass
+            elif name in self._fields:
+                self._scan()
+            elif name == "vnames":
+                self._read_headers()
+            else:
+                self.layout = self._detect_layout() if self._use_layout else None
+        return self.__dict__[name]
+
+    def _scan_records(self, pos, maxcount):
+        """Return the offsets and lengths of up to 'maxcount' records."""
+        offsets = np.empty(maxcount, dtype=np.int64)
+        lengths = np.empty(maxcount, dtype=np.int64)
+        end = len(self.u8)
+        count = 0
+        while count < maxcount and pos < end:
+            if self._use_numba:
+                found, pos = _scan_chunk_jit(
+                    self.u8, pos, end, offsets[count:], lengths[count:]
+                )
+            else:
+                found, pos = _scan_chunk(
+                    self.buffer, pos, end, offsets[count:], lengths[count:]
+                )
+            count += found
+            if count < maxcount and pos < end:
+                # corrupt or truncated, so skip to the next good record
+                resync = self._resync(pos + 1)
+                self._skipped[pos] = resync
+                pos = resync
+        return offsets[:count], lengths[:count], pos
+
+    def _resync(self, pos):
+        """Return the start of the next plausible record after 'pos'.
+
+        Rather than trying every byte, the buffer is searched for the
+        operation type names that are part of every record leader.  A
+        candidate is accepted if the record type is 0 or 1, the record fits
+        in the file, and the back pointer after the record agrees with the
+        record length.  Returns the length of the file if there isn't one.
+
+        The buffer is searched in growing windows so that an operation type
+        that is not in the file is not searched for to the end of the file.
+        """
+        found = dict.fromkeys(_OPTYPES, -1)
+        searched = pos + 8
+        window = 65536
+        while searched < len(self.u8):
+            end = min(searched + window, len(self.u8))
+            for optype, i in found.items():
+                if i < 0:
+                    # overlap the last window for a name across the boundary
+                    start = max(pos + 8, searched - len(optype) + 1)
+                    found[optype] = self.buffer.find(optype, start, end)
+            searched = end
+            window *= 2
+            while True:
+                candidates = [i for i in found.values() if i >= 0]
+                if not candidates:
+                    break
+                candidate = min(candidates)
+                if self._is_record(candidate - 8):
+                    return candidate - 8
+                for optype, i in found.items():
+                    if i == candidate:
+                        found[optype] = self.buffer.find(optype, candidate + 1, end)
+        return len(self.u8)
+
+    def _is_record(self, pos):
+        """Test if 'pos' is the start of a complete, consistent record."""
+        u8 = self.u8
+        if pos < 1 or pos + 28 > len(u8):
+            return False
+        reclen = int(_gather_reclen(u8, np.array([pos]))[0])
+        rectype = int(_gather_u4(u8, np.array([pos + 4]))[0])
+        if rectype not in (0, 1) or reclen < (56 if rectype == 1 else 24):
+            return False
+
+        # variable-length back pointer, low order byte last
+        nbytes = _back_pointer_size(reclen)
+        tail = pos + 4 + reclen
+        if tail + nbytes > len(u8):
+            return False
+        backptr = int.from_bytes(bytes(u8[tail : tail + nbytes]), "big")
+        return backptr >> 2 == reclen + 4
+
+    def _record_before(self, pos):
+        """Return the offset and length of the record that ends at 'pos'.
+
+        The back pointer does not record its own size, so each of the
+        possible sizes is tried against the record leader it points to.
+        Returns None if none of them give a consistent record.
+        """
+        for nbytes in (1, 2, 3):
+            backptr = int.from_bytes(bytes(self.u8[pos - nbytes : pos]), "big")
+            reclen = (backptr >> 2) - 4
+            start = pos - nbytes - reclen - 4
+            if (
+                reclen >= 24
+                and _back_pointer_size(reclen) == nbytes
+                and self._is_record(start)
+                and int(_gather_reclen(self.u8, np.array([start]))[0]) == reclen
+            ):
+                return start, reclen
+        return None
+
+    def _file_time(self, start):
+        """Return the record type, level, and time of the record at 'start'.
+
+        The time is an integer that orders the records the way HSPF writes
+        them, see '_gather_file_times'.
+        """
+        rectype, _, level, year, month, day, hour, minute = struct.unpack_from(
+            "<I20x7I", self.buffer, start + 4
+        )
+        if level != 2:
+            hour, minute = 24, 0
+        return rectype, level, _file_time(year, month, day, hour, minute)
+
+    def _leading_records(self):
+        """Return the offsets and lengths up to and including the first data
+        record, and the index of the first data record or None."""
+        count = 256
+        while True:
+            offsets, lengths, _ = self._scan_records(1, count)
+            (data,) = np.nonzero(_gather_u4(self.u8, offsets + 4) == 1)
+            if len(data):
+                return offsets[: data[0] + 1], lengths[: data[0] + 1], data[0]
+            if len(offsets) < count:
+                return offsets, lengths, None
+            count *= 4
+
+    def _find_headers(self, needed):
+        """Return the offsets and lengths of the header records for the
+        'needed' 20 byte (optype, lue, group) leader keys."""
+        needed = set(needed)
+        offsets = []
+        lengths = []
+        pos = 1
+        while needed and pos < len(self.u8):
+            chunk, chunklengths, pos = self._scan_records(pos, 4096)
+            if len(chunk) == 0:
+                break
+            for i in np.nonzero(_gather_u4(self.u8, chunk + 4) == 0)[0]:
+                offsets.append(int(chunk[i]))
+                lengths.append(int(chunklengths[i]))
+                needed.discard(bytes(self.buffer[chunk[i] + 8 : chunk[i] + 28]))
+        return offsets, lengths
+
+    def _older_records_ok(self, pos, stop, known, before):
+        """Walk backwards from 'pos' and test the file is in time order.
+
+        Every record before 'pos' must have a time no later than 'before', and
+        the walk goes on until each of the 'known' leader keys has an older
+        record or 'stop' is reached.  Where the records of each operation are
+        written in chunks of time steps the time goes backwards between
+        chunks, which is found before every operation has an older record.
+        """
+        known = set(known)
+        newer = before
+        while pos > stop and known:
+            found = self._record_before(pos)
+            if found is None:
+                return False
+            pos = found[0]
+            rectype, _, time = self._file_time(pos)
+            if rectype != 1:
+                continue
+            if time > newer:
+                return False
+            newer = time
+            known.discard(bytes(self.buffer[pos + 8 : pos + 28]))
+        return True
+
+    def tail(self, last_n, level):
+        """Return an HbnFile of the last 'last_n' time steps of 'level'.
+
+        The records are read backwards from the end of the file using the
+        back pointers until 'last_n' dates of 'level' have been collected and
+        every operation and group seen, including those with a header before
+        the first data record, has a record older than those dates.  The
+        header records for the collected records are then read from the start
+        of the file.  Only the ends of the file are read, however large it
+        is.
+
+        Returns None if the file cannot be read this way, which is when the
+        records are not in chronological order or the back pointers are not
+        consistent.  The returned HbnFile shares the memory map.
+        """
+        offsets, lengths, first = self._leading_records()
+        if first is None:
+            return self.subset(offsets, lengths)
+        known = {bytes(self.buffer[i + 8 : i + 28]) for i in offsets[:first]}
+        first = int(offsets[first])
+        older = set()
+
+        window = set()
+        oldest = None
+        newer = None
+        collected = []
+        pos = len(self.u8)
+        while pos > first:
+            found = self._record_before(pos)
+            if found is None:
+                return None
+            start, reclen = found
+            pos = start
+            rectype, reclevel, time = self._file_time(start)
+            if rectype != 1:
+                # a header after the first data record, read again below
+                continue
+            if newer is not None and time > newer:
+                return None
+            newer = time
+
+            # where the records of each operation are written in chunks of
+            # time steps the time goes backwards between chunks, which is
+            # caught above before every operation has an older record
+            key = bytes(self.buffer[start + 8 : start + 28])
+            known.add(key)
+            if len(window) == last_n and time < oldest:
+                older.add(key)
+                if len(older) == len(known):
+                    break
+            elif reclevel == level:
+                window.add(time)
+                oldest = time
+                collected.append((start, reclen, key))
+
+        hoffsets, hlengths = self._find_headers(key for _, _, key in collected)
+        collected.reverse()
+        return self.subset(
+            np.array(hoffsets + [i for i, _, _ in collected], dtype=np.int64),
+            np.array(hlengths + [i for _, i, _ in collected], dtype=np.int64),
+        )
+
+    def seek_date(self, date):
+        """Return the offset of the first data record at or after 'date'.
+
+        The file is bisected by byte offset, and at each step the next record
+        is found with '_resync' and its date read, so only a few records are
+        read however large the file is.  As a margin for the different ways
+        the intervals are dated the offset is of the first record written for
+        the day before 'date'.  This only makes sense for a file in
+        chronological order, so returns None if the dates read while
+        bisecting are not in order.
+        """
+        day = pd.Timestamp(date).normalize() - pd.Timedelta(days=1)
+        target = _file_time(day.year, day.month, day.day, 24, 0)
+        offsets, _, first = self._leading_records()
+        if first is None:
+            return len(self.u8)
+        low = int(offsets[first])
+        high = len(self.u8)
+        probes = []
+        while high - low > 65536:
+            middle = (low + high) // 2
+            offsets, _, _ = self._scan_records(self._resync(middle), 64)
+            (data,) = np.nonzero(_gather_u4(self.u8, offsets + 4) == 1)
+            if len(data) == 0 or offsets[data[0]] >= high:
+                high = middle
+                continue
+            probe = int(offsets[data[0]])
+            time = self._file_time(probe)[2]
+            probes.append((probe, time))
+            if time < target:
+                low = probe
+            else:
+                # there are no data records between 'middle' and 'probe'
+                high = middle
+        probes.sort()
+        if any(i[1] > j[1] for i, j in zip(probes[:-1], probes[1:])):
+            return None
+
+        pos = low
+        while pos < len(self.u8):
+            chunk, _, pos = self._scan_records(pos, 4096)
+            if len(chunk) == 0:
+                break
+            (data,) = np.nonzero(_gather_u4(self.u8, chunk + 4) == 1)
+            level = _gather_u4(self.u8, chunk[data] + 32)
+            times = _gather_file_times(self.u8, chunk[data], level)
+            (after,) = np.nonzero(times >= target)
+            if len(after):
+                return int(chunk[data[after[0]]])
+        return len(self.u8)
+
+    def since(self, start_date):
+        """Return an HbnFile of the records from 'start_date' to the end.
+
+        Uses 'seek_date' to find the first record, then checks that the rest
+        of the file is in chronological order and, like 'tail', that the
+        records before it are older.  Returns None if the file is not in
+        chronological order.  The returned HbnFile shares the memory map.
+        """
+        pos = self.seek_date(start_date)
+        if pos is None:
+            return None
+        parts = []
+        scan = pos
+        while scan < len(self.u8):
+            offsets, lengths, scan = self._scan_records(scan, self._chunk)
+            if len(offsets) == 0:
+                break
+            parts.append((offsets, lengths))
+        if not parts:
+            return None
+        offsets = np.concatenate([i for i, _ in parts])
+        lengths = np.concatenate([i for _, i in parts])
+        isdata = _gather_u4(self.u8, offsets + 4) == 1
+        level = _gather_u4(self.u8, offsets[isdata] + 32)
+        times = _gather_file_times(self.u8, offsets[isdata], level)
+        if len(times) == 0 or np.any(np.diff(times) < 0):
+            return None
+        keys = {bytes(i) for i in _gather(self.u8, offsets[isdata] + 8, 20)}
+        if not self._older_records_ok(pos, 1, keys, times[0]):
+            return None
+        hoffsets, hlengths = self._find_headers(keys)
+        return self.subset(
+            np.concatenate([np.array(hoffsets, dtype=np.int64), offsets[isdata]]),
+            np.concatenate([np.array(hlengths, dtype=np.int64), lengths[isdata]]),
+        )
+
+    def bivl_step(self):
+        """Return the pandas frequency of the 'bivl' records of the file.
+
+        The step is the difference between the dates of the first two
+        'bivl' records of the same operation and group, so only the start of
+        the file is read and the step is the same for an HbnFile returned by
+        'tail' or 'since', whatever records it has.  One hour if the file
+        has fewer than two such records, as in '_freq_from_dates'.
+        """
+        first = {}
+        pos = 1
+        while pos < len(self.u8):
+            offsets, _, pos = self._scan_records(pos, 4096)
+            if len(offsets) == 0:
+                break
+            offsets = offsets[_gather_u4(self.u8, offsets + 4) == 1]
+            offsets = offsets[_gather_u4(self.u8, offsets + 32) == 2]
+            if len(offsets) == 0:
+                continue
+            dates = _gather_dates(
+                self.u8, offsets, np.full(len(offsets), 2, dtype=np.uint32)
+            )
+            for offset, date in zip(offsets, dates):
+                key = bytes(self.buffer[offset + 8 : offset + 28])
+                if key in first and date > first[key]:
+                    return to_offset(pd.Timedelta(date - first[key]))
+                first.setdefault(key, date)
+        return to_offset(pd.Timedelta(hours=1))
+
+    def subset(self, offsets, lengths):
+        """Return an HbnFile of only the records at 'offsets'.
+
+        The new HbnFile shares the memory map, and closing it leaves this
+        HbnFile open.
+        """
+        sub = copy.copy(self)
+        for name in self._fields + ("vnames", "layout"):
+            sub.__dict__.pop(name, None)
+        sub.layout = None
+        sub._blocks = None
+        sub._skipped = {}
+        sub._series_keys = {}
+        sub._lock = threading.RLock()
+        sub._shared = True
+        sub._set_records([sub._decode_leaders(offsets, lengths)])
+        return sub
+
+    @property
+    def skipped(self):
+        """The (start, end) byte ranges skipped as corrupt or truncated."""
+        self.load()
+        return sorted(self._skipped.items())
+
+    def load(self, headers=False):
+        """Find the records now rather than when first used.
+
+        With 'headers' the header directory 'vnames' is also decoded.
+        Returns the HbnFile.
+        """
+        with self._lock:
+            if "offset" not in self.__dict__:
+                self._scan()
+            if headers and "vnames" not in self.__dict__:
+                self._read_headers()
+        return self
+
+    def _iter_offsets(self):
+        """Yield the offsets and lengths of all records in chunks.
+
+        The records computed from the layout are checked a chunk at a time,
+        and if one doesn't match its place in the cycle the layout is
+        dropped and the records are scanned from the start of the chunk.
+        """
+        layout = self.layout
+        pos = 1
+        if layout is not None:
+            yield layout.headers
+            ncycles = max(1, self._chunk // len(layout.offsets))
+            for first in range(0, layout.ncycles, ncycles):
+                starts = layout.start + layout.cycle_bytes * np.arange(
+                    first, min(first + ncycles, layout.ncycles), dtype=np.int64
+                )
+                offsets = (starts[:, None] + layout.offsets).reshape(-1)
+                lengths = np.tile(layout.lengths, len(starts))
+                if not self._layout_matches(layout, offsets, lengths):
+                    self.layout = None
+                    pos = int(starts[0])
+                    break
+                yield offsets, lengths
+            else:
+                return
+
+        while True:
+            offsets, lengths, pos = self._scan_records(pos, self._chunk)
+            if len(offsets) == 0:
+                break
+            yield offsets, lengths
+            if len(offsets) < self._chunk:
+                break
+
+    def _scan(self):
+        """Find all records and decode the record leaders."""
+        self._set_records(
+            [
+                self._decode_leaders(offsets, lengths)
+                for offsets, lengths in self._iter_offsets()
+            ]
+        )
+
+        if self._skipped:
+            ranges = ", ".join(f"{i}-{j}" for i, j in sorted(self._skipped.items()))
+            sys.stderr.write(
+                tsutils.error_wrapper(
+                    f"""
+                    Warning: Skipped the corrupt or truncated byte ranges
+                    {ranges} of {self.filename}.
+                    """
+                )
+            )
+
+    def _layout_matches(self, layout, offsets, lengths):
+        """Return whether the records at the 'offsets' and 'lengths' computed
+        from 'layout' are data records with the key and length of their
+        place in the cycle."""
+        return bool(
+            np.all(_gather_u4(self.u8, offsets + 4) == 1)
+            and np.array_equal(_gather_reclen(self.u8, offsets), lengths)
+            and np.array_equal(
+                _gather(self.u8, offsets + 8, 28),
+                np.tile(layout.leaders, (len(offsets) // len(layout.leaders), 1)),
+            )
+        )
+
+    def _decode_leaders(self, offsets, lengths):
+        """Return the record arrays for the records at 'offsets'."""
+        count = len(offsets)
+        rectype = _gather_u4(self.u8, offsets + 4)
+        optype = _gather_s8(self.u8, offsets + 8)
+        lue = _gather_u4(self.u8, offsets + 16)
+        group = _gather_s8(self.u8, offsets + 20)
+        isdata = rectype == 1
+        level = np.zeros(count, dtype=np.uint32)
+        level[isdata] = _gather_u4(self.u8, offsets[isdata] + 32)
+        dates = np.full(count, np.datetime64("NaT"), dtype="M8[m]")
+        dates[isdata] = _gather_dates(self.u8, offsets[isdata], level[isdata])
+        return offsets, lengths, rectype, optype, lue, group, level, dates
+
+    def _set_records(self, parts):
+        """Set the record arrays from the '_decode_leaders' of each chunk."""
+        for index, name in enumerate(self._fields[:-1]):
+            if parts:
+                setattr(self, name, np.concatenate([part[index] for part in parts]))
+            else:
+                setattr(self, name, np.empty(0, dtype=np.int64))
+
+        # number of float values in each data record
+        self.numvals = (self.length - 52) // 4
+
+    def _detect_layout(self, maxcount=2**20):
+        """Return the periodic layout of the data records, or None.
+
+        The beginning of the file is scanned until the key of the first data
+        record repeats.  The records in between are a candidate cycle, which
+        must be repeated exactly by the next cycle, must evenly divide the
+        rest of the file, and must match the first and last record leader of
+        cycles sampled across the file with increasing dates.  Every record
+        is checked against the cycle when the records are found, see
+        '_iter_offsets'.
+        """
+        count = 256
+        while True:
+            offsets, lengths, _ = self._scan_records(1, count)
+            rectype = _gather_u4(self.u8, offsets + 4)
+            (data,) = np.nonzero(rectype == 1)
+            if len(data):
+                first = data[0]
+                # optype, lue, group, unused, level
+                keys = _gather(self.u8, offsets[first:] + 8, 28)
+                (repeat,) = np.nonzero(np.all(keys[1:] == keys[0], axis=1))
+                if len(repeat) and len(keys) >= 2 * (repeat[0] + 1):
+                    break
+            if len(offsets) < count or count >= maxcount:
+                return None
+            count *= 4
+
+        period = repeat[0] + 1
+        if (
+            not np.all(rectype[first : first + 2 * period] == 1)
+            or not np.array_equal(keys[:period], keys[period : 2 * period])
+            or not np.array_equal(
+                lengths[first : first + period],
+                lengths[first + period : first + 2 * period],
+            )
+        ):
+            return None
+
+        start = int(offsets[first])
+        cycle_bytes = int(offsets[first + period]) - start
+        if (len(self.u8) - start) % cycle_bytes:
+            return None
+        ncycles = (len(self.u8) - start) // cycle_bytes
+        reloffsets = offsets[first : first + period] - start
+        cyclelengths = lengths[first : first + period]
+
+        # verify at sampled cycles
+        sample = np.unique(np.linspace(0, ncycles - 1, 17).astype(np.int64))
+        ends = [0, period - 1]
+        soffsets = (start + sample[:, None] * cycle_bytes + reloffsets[ends]).reshape(
+            -1
+        )
+        slevel = _gather_u4(self.u8, soffsets + 32)
+        sdates = _gather_dates(self.u8, soffsets[::2], slevel[::2])
+        if (
+            not np.array_equal(
+                _gather_reclen(self.u8, soffsets),
+                np.tile(cyclelengths[ends], len(sample)),
+            )
+            or not np.all(_gather_u4(self.u8, soffsets + 4) == 1)
+            or not np.array_equal(
+                _gather(self.u8, soffsets + 8, 28),
+                np.tile(keys[ends], (len(sample), 1)),
+            )
+            or not np.all(np.diff(sdates) > np.timedelta64(0, "m"))
+        ):
+            return None
+
+        coffsets = offsets[first : first + period]
+        level = _gather_u4(self.u8, coffsets + 32)
+        cyclekeys = list(
+            zip(
+                _gather_s8(self.u8, coffsets + 8),
+                _gather_u4(self.u8, coffsets + 16).tolist(),
+                _gather_s8(self.u8, coffsets + 20),
+                level.tolist(),
+            )
+        )
+        return _Layout(
+            start,
+            cycle_bytes,
+            ncycles,
+            {key: index for index, key in enumerate(cyclekeys)},
+            reloffsets,
+            cyclelengths,
+            (offsets[:first], lengths[:first]),
+            keys[:period],
+        )
+
+    def record_offset(self, key, step):
+        """Return the offset of the data record of 'key' at time 'step'.
+
+        The 'key' is (optype, lue, group, level) and 'step' counts the output
+        time steps from 0.  Computed directly from the layout, so only
+        available for files with a periodic layout, otherwise returns None.
+        """
+        layout = self.layout
+        if layout is None or key not in layout.keys or not 0 <= step < layout.ncycles:
+            return None
+        return int(
+            layout.start + step * layout.cycle_bytes + layout.offsets[layout.keys[key]]
+        )
+
+    def _read_headers(self):
+        """Collect the variable names for each operation and group.
+
+        The header directory 'vnames' is keyed by (optype, lue, group) since
+        different operation types can use the same ID and group, for
+        example PERLND 101 ATEMP and IMPLND 101 ATEMP.  The names are
+        decoded once into interned str.
+        """
+        isheader = self.rectype == 0
+        self.vnames = self._header_names(self.offset[isheader], self.length[isheader])
+
+    def _header_names(self, offsets, lengths):
+        """Return the header directory of the header records at 'offsets'."""
+        vnames = {}
+        for start, reclen, key in zip(
+            offsets.tolist(),
+            lengths.tolist(),
+            zip(
+                _gather_s8(self.u8, offsets + 8),
+                _gather_u4(self.u8, offsets + 16).tolist(),
+                _gather_s8(self.u8, offsets + 20),
+            ),
+        ):
+            record = self.buffer[start + 28 : start + 4 + reclen]
+            names = []
+
+            # loop through rest of record
+            pos = 0
+            while pos < len(record):
+                # single 4B word for length of next variable name
+                (length,) = struct.unpack_from("I", record, pos)
+
+                # add variable name to the list for this operation
+                names.append(
+                    sys.intern(record[pos + 4 : pos + 4 + length].decode("ascii"))
+                )
+
+                # update how far along the record we are
+                pos += length + 4
+
+            # a repeated header for the same operation and group adds nothing
+            if vnames.get(key) != names:
+                vnames.setdefault(key, []).extend(names)
+        return vnames
+
+    def series_keys(self, block):
+        """Return the time-series keys for the values of 'block'.
+
+        The 'block' is a key of 'blocks'.  The keys are the (optype, lue,
+        group, variable, level) tuples of str used by '_get_data', built once
+        for each block so that no decoding is done while reading the data.
+        """
+        keys = self._series_keys.get(block)
+        if keys is None:
+            optype, lue, group, level = block
+            prefix = (
+                sys.intern(optype.decode("ascii")),
+                lue,
+                sys.intern(group.decode("ascii")),
+            )
+            keys = tuple(
+                prefix + (name, level)
+                for name in self.vnames.get((optype, lue, group), ())
+            )
+            self._series_keys[block] = keys
+        return keys
+
+    def blocks(self):
+        """Return the data records of each (optype, lue, group, level) block.
+
+        The record numbers of each block are in file order, and the blocks
+        are in the order of their first record in the file.
+        """
+        with self._lock:
+            if self._blocks is None:
+                self._blocks = self._find_blocks()
+        return self._blocks
+
+    def _find_blocks(self):
+        """Group the data records into blocks, see 'blocks'."""
+        isdata = np.nonzero(self.rectype == 1)[0]
+        _, optcode = np.unique(self.optype[isdata], return_inverse=True)
+        groups, grpcode = np.unique(self.group[isdata], return_inverse=True)
+        combined = optcode.reshape(-1).astype(np.int64) * len(groups)
+        combined += grpcode.reshape(-1)
+        combined = (combined * 2**32 + self.lue[isdata]) * 8 + self.level[isdata]
+        _, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        recnos = np.split(
+            isdata[np.argsort(inverse, kind="stable")],
+            np.cumsum(np.bincount(inverse))[:-1],
+        )
+        blocks = {}
+        for block in np.argsort(first):
+            recno = isdata[first[block]]
+            key = (
+                self.optype[recno],
+                int(self.lue[recno]),
+                self.group[recno],
+                int(self.level[recno]),
+            )
+            blocks[key] = recnos[block]
+        return blocks
+
+    def column(self, recnos, col, gather=True):
+        """Return value number 'col' from each of the data records 'recnos'.
+
+        Within a block every data record has the same layout, so where the
+        records are also evenly spaced in the file the values of one variable
+        are at a fixed stride.  A single regular run of records is returned as
+        a read-only strided view of the memory map.  Otherwise the values are
+        gathered into a new array in one vectorized step, since building a
+        view for each of many short runs is much slower.  With 'gather' False
+        a '_GatheredColumn' is returned instead, which gathers the values
+        when it is indexed.
+        """
+        offsets = self.offset[recnos] + 56 + 4 * col
+        if len(offsets) == 0:
+            return np.empty(0, dtype="<f4")
+        strides = np.diff(offsets)
+        if len(strides) and np.any(strides != strides[0]):
+            if not gather:
+                return _GatheredColumn(self, recnos, col)
+            return _gather(self.u8, offsets, 4).view("<f4").reshape(-1)
+        return as_strided(
+            self.u8[offsets[0] : offsets[0] + 4].view("<f4"),
+            shape=(len(offsets),),
+            strides=(int(strides[0]) if len(strides) else 4,),
+            writeable=False,
+        )
+
+    def values(self, recno):
+        """Return the float values of data record 'recno'."""
+        return np.frombuffer(
+            self.buffer,
+            dtype="<f4",
+            count=int(self.numvals[recno]),
+            offset=int(self.offset[recno]) + 56,
+        )
+
+    def close(self):
+        """Release the memory map of the file.
+
+        Arrays returned by 'column' may be views of the memory map.  While
+        any of them are alive the memory map cannot be closed, so it is left
+        open and released when the last of them is garbage collected.
+        """
+        self.u8 = None
+        self._blocks = None
+        if self._shared:
+            return
+        try:
+            self.buffer.close()
+        except BufferError:
+            # still exported to views returned by 'column', see the docstring
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _GatheredColumn:
+    """Value number 'col' of the data records 'recnos' of an open HbnFile.
+
+    Stands in for the array from 'HbnFile.column' where the records are not
+    evenly spaced, so the values are gathered from the memory map only for
+    the records selected by indexing, or all of them by np.asarray.
+    """
+
+    def __init__(self, hbn, recnos, col):
+        self.hbn = hbn
+        self.recnos = recnos
+        self.col = col
+
+    def __len__(self):
+        return len(self.recnos)
+
+    def __getitem__(self, rows):
+        return self.hbn.column(self.recnos[rows], self.col)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.hbn.column(self.recnos, self.col), dtype=dtype)
+
+
+def _data_recnos(hbn):
+    """Return the record numbers of the data records of 'hbn'."""
+    return np.nonzero(hbn.rectype == 1)[0]
+
+
+def _decode_records(hbn, recnos, cancel=None):
+    """Decode the data records 'recnos' of 'hbn'."""
+    ndates = hbn.dates[recnos].astype("M8[us]").astype(object)
+    records = []
+    for recno, ndate in zip(recnos, ndates):
+        if cancel is not None and cancel.is_set():
+            raise concurrent.futures.CancelledError()
+        key = (hbn.optype[recno], int(hbn.lue[recno]), hbn.group[recno])
+        values = hbn.values(recno).tolist()
+        records.append(
+            (
+                *key,
+                int(hbn.level[recno]),
+                ndate,
+                hbn.vnames[key][: len(values)],
+                values,
+            )
+        )
+    return records
+
+
+def _open_hbnfile(binfilename):
+    """Return a context manager for 'binfilename', a file name or HbnFile.
+
+    An open HbnFile is left open at the end of the context.
+    """
+    if isinstance(binfilename, HbnFile):
+        return contextlib.nullcontext(binfilename)
+    return HbnFile(binfilename)
+
+
+def _parse_memory_budget(memory_budget):
+    """Return the number of bytes in 'memory_budget', for example "16GB"."""
+    if memory_budget is None or isinstance(memory_budget, int):
+        return memory_budget
+    match = re.fullmatch(
+        r"\s*([0-9.]+)\s*([KMGT]?)I?B?\s*", str(memory_budget), re.IGNORECASE
+    )
+    if match is None:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The memory budget must be a number of bytes with an optional
+                unit of KB, MB, GB, or TB, instead of '{memory_budget}'.
+                """
+            )
+        )
+    power = " KMGT".index(match.group(2).upper() or " ")
+    return int(float(match.group(1)) * 1024**power)
+
+
+def _parse_labels(labels):
+    """Check the labels and split each into the IDs and the other fields.
+
+    Returns the labels as lists of four fields, the list of IDs to match for
+    each label, and the (optype, group, variable) of each label where None
+    is the wild card and a field can be a compiled pattern.
     """
-    if labels is None:
-        labels = [",,,"]
     testem = {
         "PERLND": [
             "ATEMP",
@@ -107,14 +1315,8 @@ def _get_data(binfilename, interval="daily", labels=None, catalog_only=True):
         "": [""],
     }
 
-    collect_dict = {}
-    lablist = []
-
-    # Normalize interval code
-    try:
-        intervalcode = interval2codemap[interval.lower()]
-    except AttributeError:
-        intervalcode = None
+    labelids = []
+    labelfields = []
 
     # convert label tuples to lists
     labels = list(labels)
@@ -145,8 +1347,8 @@ def _get_data(binfilename, interval="daily", labels=None, catalog_only=True):
         # first word must be a valid operation type or None
         if words[0] is not None:
             # force uppercase before comparison
-            words[0] = words[0].upper()
-            if words[0] not in testem:
+            words[0] = _label_pattern(words[0], re.IGNORECASE) or words[0].upper()
+            if isinstance(words[0], str) and words[0] not in testem:
                 raise ValueError(
                     tsutils.error_wrapper(
                         f"""
@@ -160,11 +1362,10 @@ def _get_data(binfilename, interval="daily", labels=None, catalog_only=True):
         # second word must be integer 1-999 or None or range to parse
         if words[1] is not None:
             try:
-                words[1] = int(words[1])
-                luelist = [words[1]]
+                luelist = [int(words[1])]
             except ValueError:
                 luelist = tsutils.range_to_numlist(words[1])
-            for luenum in luelist:
+            for luenum in (min(luelist), max(luelist)):
                 if luenum < 1 or luenum > 999:
                     raise ValueError(
                         tsutils.error_wrapper(
@@ -179,8 +1380,12 @@ def _get_data(binfilename, interval="daily", labels=None, catalog_only=True):
 
         # third word must be a valid group name or None
         if words[2] is not None:
-            words[2] = words[2].upper()
-            if (words[0] is not None) and (words[2] not in testem[words[0]]):
+            words[2] = _label_pattern(words[2], re.IGNORECASE) or words[2].upper()
+            if (
+                isinstance(words[0], str)
+                and isinstance(words[2], str)
+                and words[2] not in testem[words[0]]
+            ):
                 raise ValueError(
                     tsutils.error_wrapper(
                         f"""
@@ -194,166 +1399,162 @@ def _get_data(binfilename, interval="daily", labels=None, catalog_only=True):
         # fourth word is currently not checked - assumed to be a variable name
         # if not, it will simply never be found in the file, so ok
         # but no warning for the user - add check?
+        if words[3] is not None:
+            words[3] = _label_pattern(words[3]) or words[3]
 
-        # add interval code as fifth word in list
-        words.append(intervalcode)
+        labelids.append(luelist)
+        labelfields.append((words[0], words[2], words[3]))
+    return labels, labelids, labelfields
 
-        # add to new list of checked and expanded lists
-        for luenum in luelist:
-            words[1] = luenum
-            lablist.append(list(words))
 
-    # Now read through the binary file and collect the data matching the labels
-    with open(binfilename, "rb") as binfp:
-        labeltest = set()
-        vnames = {}
-        ndates = set()
-        # read first byte - must be hex FD (decimal 253) for valid file.
-        magicbyte = binfp.read(1)
-        if magicbyte != b"\xfd":
-            # not a valid HSPF binary file
-            raise ValueError(
-                tsutils.error_wrapper(
-                    f"""
-                    {binfilename} is not a valid HSPF binary output file
-                    (.hbn),  The first byte must be FD hexadecimal, but it was
-                    {magicbyte}.
-                    """
-                )
+def _build_labelsets(labelids, labelfields, vocabulary):
+    """Return the label sets of the parsed labels for '_match_labelsets'.
+
+    The labels are kept as sets keyed by (optype, group, variable), each
+    holding the IDs to match, so the cost of matching a time-series does
+    not grow with the number of labels.  None is the wild card.  Patterns
+    are replaced by the names in the 'vocabulary' sets of operation types,
+    groups, and variable names that they match, so the time-series are
+    still matched by dict lookups.
+    """
+    labelsets = {}
+    for labelnum, fields in enumerate(labelfields):
+        for setkey in itertools.product(
+            *(
+                _expand_label_pattern(field, names)
+                for field, names in zip(fields, vocabulary)
             )
+        ):
+            luesets = labelsets.setdefault(setkey, {})
+            for luenum in labelids[labelnum]:
+                luesets.setdefault(luenum, []).append(labelnum)
+    return labelsets
 
-        # loop through each record
-        while True:
-            # reinitialize counter for record length - used to compute skip at
-            # end
-            recpos = 0
 
-            # read first four bytes to get record length bitfield
-            try:
-                reclen1, reclen2, reclen3, reclen = struct.unpack("4B", binfp.read(4))
-                recpos += 4
-            except struct.error:
-                # End of file.
-                break
+def _no_match_error(labels):
+    """Return the error for the parsed 'labels' matching no time-series."""
+    return ValueError(
+        tsutils.error_wrapper(
+            f"""
+            The label specifications below matched no records in the binary
+            file.
 
-            # get record leader - next 24 bytes
-            rectype, optype, lue, group = struct.unpack("I8sI8s", binfp.read(24))
-            recpos += 24
+            {[",".join("" if i is None else str(i) for i in label) for label in labels]}
+            """
+        )
+    )
 
-            # clean up
-            rectype = int(rectype)
-            lue = int(lue)
-            optype = optype.strip()
-            group = group.strip()
 
-            if rectype == 0:
-                # header record - collect variable names for this
-                # operation and group
+def _add_level_dates(ndates, level, dates):
+    """Add the 'dates' of a block to 'ndates' unless already there.
 
-                # parse reclen bitfield to get actual remaining length
-                # the " - 24 " subtracts the 24 bytes already read
-                reclen1 = int(reclen1 / 4)
-                reclen2 = reclen2 * 64 + reclen1
-                reclen3 = reclen3 * 16384 + reclen2
-                reclen = reclen * 4194304 + reclen3 - 24
+    The date arrays of each level are kept in buckets by length and first
+    and last date, so the dates of a block are only compared to the arrays
+    that can be equal to them.
+    """
+    bucket = ndates.setdefault(level, {}).setdefault(
+        (len(dates), dates[0], dates[-1]), []
+    )
+    if not any(np.array_equal(dates, known) for known in bucket):
+        bucket.append(dates)
 
-                # loop through rest of record
-                slen = 0
-                while slen < reclen:
-                    # read single 4B word for length of next variable name
-                    length = struct.unpack("I", binfp.read(4))[0]
 
-                    # read the variable name
-                    variable_name = struct.unpack(f"{length}s", binfp.read(length))[0]
-
-                    # add variable name to the set for this operation
-                    # why a set instead of a list? There should never be
-                    # a duplicate anyway
-                    vnames.setdefault((lue, group), []).append(variable_name)
+def _level_dates(ndates):
+    """Return the sorted unique dates of each level in 'ndates'."""
+    return {
+        level: np.unique(np.concatenate([i for j in buckets.values() for i in j]))
+        for level, buckets in ndates.items()
+    }
 
-                    # update how far along the record we are
-                    slen += length + 4
-                    recpos += length + 4
 
-            elif rectype == 1:
-                # Data record
+# The most IDs listed in the warning for IDs that matched no records.
+_WARNING_IDS = 20
 
-                # record should contain a value for each variable name for this
-                # operation and group
-                numvals = len(vnames[(lue, group)])
 
-                (_, level, year, month, day, hour, minute) = struct.unpack(
-                    "7I", binfp.read(28)
-                )
-                recpos += 28
+def _get_data(
+    binfilename,
+    interval="daily",
+    labels=None,
+    catalog_only=True,
+    cancel=None,
+    stderr=None,
+):
+    """Underlying function to read from the binary file.  Used by
+    'extract', 'extract_intervals', 'catalog'.
 
-                vals = struct.unpack(f"{numvals}f", binfp.read(4 * numvals))
-                recpos += 4 * numvals
+    The 'binfilename' can also be an open HbnFile, and then the extracted
+    values are float32 views of the file, or a '_GatheredColumn' where the
+    records are not evenly spaced.  The 'interval' can be a
+    single interval name, a list of interval names to collect in one pass
+    through the file, or None for all intervals.  If the threading.Event
+    'cancel' is set while reading, concurrent.futures.CancelledError is
+    raised.  The warnings for labels that matched nothing are written to
+    'stderr', sys.stderr if it is None.
+    """
+    if labels is None:
+        labels = [",,,"]
+    labels, labelids, labelfields = _parse_labels(labels)
 
-                delta = datetime.timedelta(hours=0)
-                if interval == "bivl":
-                    delta = datetime.timedelta(hours=hour) + datetime.timedelta(
-                        minutes=minute
-                    )
+    collect_dict = {}
 
-                ndate = datetime.datetime(year, month, day) + delta
+    # Normalize interval codes
+    if interval is None:
+        intervalcodes = None
+    elif isinstance(interval, str):
+        intervalcodes = {interval2codemap[interval.lower()]}
+    else:
+        intervalcodes = {interval2codemap[i.lower()] for i in interval}
 
-                #  Go through labels to see if these values need to be
-                #  collected
-                for i, vname in enumerate(vnames[(lue, group)]):
-                    tmpkey = (
-                        optype.decode("ascii"),
-                        lue,
-                        group.decode("ascii"),
-                        vname.decode("ascii"),
-                        level,
-                    )
+    # Now read through the binary file and collect the data matching the labels
+    matched = set()
+    ndates = {}
+    with _open_hbnfile(binfilename) as hbn:
+        labelsets = _build_labelsets(labelids, labelfields, _label_vocabulary(hbn))
 
-                    for lbl in lablist:
-                        res = tuple_search(tmpkey, [lbl])
-                        if not res:
-                            continue
-                        labeltest.add(tuple(lbl))
-                        nres = res[0][1]
-                        ndates.add(ndate)
-                        if catalog_only is False:
-                            if intervalcode == level:
-                                collect_dict.setdefault(nres, []).append(vals[i])
-                        else:
-                            collect_dict[nres] = level
-            else:
-                # there was a problem with unexpected record length
-                # back up almost all the way and try again
-                binfp.seek(-31, 1)
-
-            # calculate and skip to the end of the variable-length back pointer
-            reccnt = recpos * 4 + 1
-            if reccnt >= 256**2:
-                skbytes = 3
-            elif reccnt >= 256:
-                skbytes = 2
-            else:
-                skbytes = 1
-            binfp.read(skbytes)
+        for block, recnos in hbn.blocks().items():
+            if cancel is not None and cancel.is_set():
+                raise concurrent.futures.CancelledError()
+            level = block[3]
+            #  Go through labels to see if the values of this block need to
+            #  be collected
+            if intervalcodes is not None and level not in intervalcodes:
+                continue
+            tmpkeys = hbn.series_keys(block)[: int(hbn.numvals[recnos[0]])]
+            dates = hbn.dates[recnos]
+            block_matched = False
+            for i, tmpkey in enumerate(tmpkeys):
+                hits = _match_labelsets(labelsets, tmpkey)
+                if not hits:
+                    continue
+                matched.update(hits)
+                block_matched = True
+                if catalog_only is False:
+                    # only the values of this variable are read, and for an
+                    # open HbnFile as a view or when they are used
+                    values = hbn.column(recnos, i, gather=hbn is not binfilename)
+                    if hbn is not binfilename:
+                        values = np.array(values)
+                    collect_dict[tmpkey] = (dates, values)
+                else:
+                    collect_dict[tmpkey] = level
+            if block_matched:
+                _add_level_dates(ndates, level, dates)
 
     if not collect_dict:
-        raise ValueError(
-            tsutils.error_wrapper(
-                f"""
-                The label specifications below matched no records in the binary
-                file.
+        raise _no_match_error(labels)
 
-                {lablist}
-                """
-            )
-        )
-
-    ndates = sorted(list(ndates))
+    ndates = _level_dates(ndates)
 
     if catalog_only is False:
-        for lbl in lablist:
-            if tuple(lbl) not in labeltest:
-                sys.stderr.write(
+        if stderr is None:
+            stderr = sys.stderr
+        for labelnum, luelist in enumerate(labelids):
+            missing = [i for i in luelist if (labelnum, i) not in matched]
+            if not missing:
+                continue
+            lbl = ",".join("" if i is None else str(i) for i in labels[labelnum])
+            if len(missing) == len(luelist):
+                stderr.write(
                     tsutils.error_wrapper(
                         f"""
                         Warning: The label '{lbl}' matched no records in the
@@ -361,12 +1562,26 @@ def _get_data(binfilename, interval="daily", labels=None, catalog_only=True):
                         """
                     )
                 )
+            else:
+                # only the first of many IDs, as from a long label file
+                ids = str(missing[:_WARNING_IDS])
+                if len(missing) > _WARNING_IDS:
+                    ids += f" and {len(missing) - _WARNING_IDS} more"
+                stderr.write(
+                    tsutils.error_wrapper(
+                        f"""
+                        Warning: The IDs {ids} of the label '{lbl}' matched no
+                        records in the binary file.
+                        """
+                    )
+                )
     else:
         for key in collect_dict:
-            delta = ndates[1] - ndates[0] if key[4] == 2 else code2freqmap[key[4]]
+            dates = ndates[key[4]]
+            delta = _freq_from_dates(key[4], dates)
             collect_dict[key] = (
-                pd.Period(ndates[0], freq=delta),
-                pd.Period(ndates[-1], freq=delta),
+                pd.Period(dates[0], freq=delta),
+                pd.Period(dates[-1], freq=delta),
             )
 
     return ndates, collect_dict
@@ -380,6 +1595,11 @@ def extract(
     start_date=None,
     end_date=None,
     sort_columns: bool = False,
+    label_file: Optional[str] = None,
+    memory_budget: Optional[Union[int, str]] = None,
+    last_n: Optional[int] = None,
+    weights_file: Optional[str] = None,
+    expr: Optional[Union[str, List[str]]] = None,
 ):
     r"""Prints out data to the screen from a HSPF binary output file.
 
@@ -412,6 +1632,17 @@ def extract(
         Note that there are spaces ONLY between label specifications not within
         the labels themselves.
 
+        The OPERATIONTYPE, VARIABLEGROUP, and VARIABLE can also be patterns
+        that match the whole name.  A glob uses '*', '?', and '[...]', and a
+        field starting with 're:' is a regular expression.  To get every
+        variable ending with 'O' for all PERLNDs:
+
+        'PERLND,,,*O'
+
+        or with a regular expression:
+
+        'PERLND,,,re:.*O'
+
         OPERATIONTYE can be PERLND, IMPLND, RCHRES, and BMPRAC.
 
         ID is the operation type identification number specified in the UCI
@@ -466,7 +1697,47 @@ def extract(
         [optional, default is False]
 
         If set to False will maintain the columns order of the labels.  If set
-        to True will sort all columns by their columns names."""
+        to True will sort all columns by their columns names.
+
+    ${label_file}
+
+    ${memory_budget}
+
+    last_n: int
+        [optional, default is None]
+
+        Only return the last 'last_n' time steps.  The file is read
+        backwards from the end, so checking the final state of a long run
+        only reads the end of the file.  Combined with 'start_date' or
+        'end_date' this is the last 'last_n' time steps in the date range,
+        which needs the whole file to be read.  The command line option is
+        '--tail'.
+
+    weights_file: str
+        [optional, default is None]
+
+        A CSV file of 'OPERATIONTYPE,ID,WEIGHT,AGGREGATE' lines to return
+        area-weighted sums instead of the time-series of each operation.
+        For example, with the area of each land segment as the WEIGHT and
+        the watershed as the AGGREGATE, the 'PERLND,,,SURO' and
+        'IMPLND,,,SURO' labels return one 'SURO' column for each watershed
+        named like 'AGGREGATE_SURO'.  An operation can be in more than one
+        AGGREGATE, and the time-series of operations that are not in the
+        file are not returned.  Blank lines, lines starting with '#', and a
+        header line starting with 'OPERATIONTYPE' are skipped.
+
+    expr: str or list
+        [optional, default is None]
+
+        Derived variables to return instead of the extracted time-series,
+        as 'NAME=EXPRESSION' strings, or one string separated by ';'.  For
+        example, with the 'PERLND,,PWATER,' label, the expression
+        'TOTAL=SURO+IFWO+AGWO' returns a 'PERLND_101_TOTAL' column for each
+        PERLND that has the three variables.  The EXPRESSION can use the
+        variable names, numbers, arithmetic and comparison operators, and
+        the functions abs, sqrt, exp, log, log10, and where.  It is
+        evaluated with numexpr if it is installed.  The derived columns can
+        be aggregated with 'weights_file'."""
     interval = interval.lower()
     if interval not in ["bivl", "daily", "monthly", "yearly"]:
         raise ValueError(
@@ -478,30 +1749,663 @@ def extract(
             )
         )
 
-    index, data = _get_data(hbnfilename, interval, labels, catalog_only=False)
+    return _extract(
+        hbnfilename,
+        interval,
+        labels + tuple(_read_label_file(label_file)),
+        start_date=start_date,
+        end_date=end_date,
+        sort_columns=sort_columns,
+        memory_budget=memory_budget,
+        last_n=last_n,
+        weights=None if weights_file is None else _read_weights_file(weights_file),
+        expressions=None if expr is None else _parse_expressions(expr),
+    )
+
+
+def _extract(
+    hbnfilename,
+    interval,
+    labels,
+    start_date=None,
+    end_date=None,
+    sort_columns=False,
+    cancel=None,
+    memory_budget=None,
+    last_n=None,
+    weights=None,
+    expressions=None,
+    stderr=None,
+):
+    """Extract from a file name or an open HbnFile, see 'extract'.
+
+    The 'weights' are a dict of (OPERATIONTYPE, ID) to a list of
+    (AGGREGATE, WEIGHT) from '_read_weights_file', and the 'expressions'
+    are from '_parse_expressions'.  The warnings are written to 'stderr',
+    see '_get_data'.
+    """
+    if last_n is not None and last_n < 1:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The "last_n" argument must be 1 or more instead of {last_n}.
+                """
+            )
+        )
+    with _open_hbnfile(hbnfilename) as hbn:
+        source = hbn
+        freq = None
+        if last_n is not None and start_date is None and end_date is None:
+            source = hbn.tail(last_n, interval2codemap[interval]) or hbn
+        elif start_date is not None and "offset" not in hbn.__dict__:
+            # only read the records from 'start_date' to the end of the file,
+            # unless all of the records have already been found
+            source = hbn.since(start_date) or hbn
+        if source is not hbn and interval == "bivl":
+            # the records read may have too few dates to find the step from
+            freq = hbn.bivl_step()
+        ndates, data = _get_data(
+            source,
+            interval,
+            labels,
+            catalog_only=False,
+            cancel=cancel,
+            stderr=stderr,
+        )
+        if expressions is not None:
+            data = _derived_data(data, expressions)
+        result = _frame_from_data(
+            ndates.get(interval2codemap[interval], []),
+            data,
+            interval2codemap[interval],
+            start_date=start_date,
+            end_date=end_date,
+            sort_columns=sort_columns,
+            memory_budget=_parse_memory_budget(memory_budget),
+            weights=weights,
+            freq=freq,
+        )
+        # release the views of the file before it is closed
+        del data
+    if last_n is not None:
+        result = result.iloc[-last_n:]
+    return result
+
+
+@validate_call
+def extract_intervals(
+    hbnfilename: str,
+    intervals: List[Literal["yearly", "monthly", "daily", "bivl"]],
+    *labels,
+    start_date=None,
+    end_date=None,
+    sort_columns: bool = False,
+    label_file: Optional[str] = None,
+    memory_budget: Optional[Union[int, str]] = None,
+):
+    r"""Returns data for several intervals from one pass through the file.
+
+    Parameters
+    ----------
+    ${hbnfilename}
+
+    intervals : list
+        List of any of 'yearly', 'monthly', 'daily', or 'bivl'.  See the
+        'interval' argument of 'extract'.
+
+    labels : str
+        The remaining arguments uniquely identify a time-series in the
+        binary file.  The format is 'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE'.
+        See 'extract' for a full description.
+
+    ${start_date}
+
+    ${end_date}
+
+    sort_columns:
+        [optional, default is False]
+
+        If set to False will maintain the columns order of the labels.  If set
+        to True will sort all columns by their columns names.
+
+    ${label_file}
+
+    ${memory_budget}
+
+    Returns
+    -------
+    dict
+        A DataFrame for each of the requested intervals, keyed by the
+        interval name."""
+    labels = labels + tuple(_read_label_file(label_file))
+    memory_budget = _parse_memory_budget(memory_budget)
+    results = {}
+    with HbnFile(hbnfilename) as hbn:
+        ndates, data = _get_data(hbn, intervals, labels, catalog_only=False)
+        for interval in intervals:
+            intervalcode = interval2codemap[interval]
+            results[interval] = _frame_from_data(
+                ndates.get(intervalcode, []),
+                {key: val for key, val in data.items() if key[4] == intervalcode},
+                intervalcode,
+                start_date=start_date,
+                end_date=end_date,
+                sort_columns=sort_columns,
+                memory_budget=memory_budget,
+            )
+        # release the views of the file before it is closed
+        del data
+    return results
+
+
+# the functions that can be used in 'expr', which are also numexpr functions
+_EXPR_FUNCTIONS = {
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "where": np.where,
+}
+
+_EXPR_NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Compare,
+    ast.Call,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.Pow,
+    ast.USub,
+    ast.UAdd,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+    ast.Eq,
+    ast.NotEq,
+)
+
+
+def _parse_expressions(expr):
+    """Return a list of (name, expression, code, variables) for each
+    'NAME=EXPRESSION' in 'expr', see the 'extract' docstring."""
+    if isinstance(expr, str):
+        expr = expr.split(";")
+    parsed = []
+    for item in expr:
+        if not item.strip():
+            continue
+        name, _, expression = item.partition("=")
+        name, expression = name.strip(), expression.strip()
+        try:
+            if not name.isidentifier() or not expression:
+                raise SyntaxError
+            tree = ast.parse(expression, mode="eval")
+            for node in ast.walk(tree):
+                if not isinstance(node, _EXPR_NODES) or (
+                    isinstance(node, ast.Call)
+                    and (
+                        not isinstance(node.func, ast.Name)
+                        or node.func.id not in _EXPR_FUNCTIONS
+                        or node.keywords
+                    )
+                ):
+                    raise SyntaxError
+                if isinstance(node, ast.Constant) and not isinstance(
+                    node.value, (int, float)
+                ):
+                    raise SyntaxError
+        except SyntaxError as exc:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The expression '{item}' must be 'NAME=EXPRESSION' where
+                    the EXPRESSION only uses variable names, numbers,
+                    arithmetic and comparison operators, and the functions
+                    {sorted(_EXPR_FUNCTIONS)}.
+                    """
+                )
+            ) from exc
+        functions = {
+            node.func.id for node in ast.walk(tree) if isinstance(node, ast.Call)
+        }
+        variables = sorted(
+            {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+            - functions
+        )
+        if not variables:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The expression '{item}' must use at least one variable.
+                    """
+                )
+            )
+        parsed.append((name, expression, compile(tree, "<expr>", "eval"), variables))
+    return parsed
+
+
+def _derived_data(data, expressions):
+    """Return the time-series of the 'expressions' from the extracted 'data'.
+
+    The expressions are evaluated for each operation and interval that has
+    all of the variables, with numexpr if it is installed, and only the
+    derived time-series are returned.
+    """
+    operations = {}
+    for key, (dates, values) in data.items():
+        variables = operations.setdefault((key[0], key[1], key[4]), {})
+        # the first group with the variable name is used
+        variables.setdefault(key[3], (key[2], dates, values))
+    derived = {}
+    for (optype, lue, level), variables in operations.items():
+        for name, expression, code, names in expressions:
+            if any(i not in variables for i in names):
+                continue
+            dates = variables[names[0]][1]
+            if any(not np.array_equal(variables[i][1], dates) for i in names):
+                continue
+            local = {i: np.asarray(variables[i][2], dtype=np.float64) for i in names}
+            with np.errstate(all="ignore"):
+                if numexpr is not None:
+                    values = numexpr.evaluate(expression, local_dict=local)
+                else:
+                    values = eval(code, {"__builtins__": {}, **_EXPR_FUNCTIONS}, local)
+            values = np.broadcast_to(np.asarray(values, dtype=np.float64), dates.shape)
+            group = variables[names[0]][0]
+            derived[(optype, lue, group, name, level)] = (dates, values)
+    if not derived:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                None of the extracted operations have all of the variables
+                of the expressions {[i[0] + "=" + i[1] for i in expressions]}.
+                """
+            )
+        )
+    return derived
+
+
+def _frame_from_data(
+    index,
+    data,
+    intervalcode,
+    start_date=None,
+    end_date=None,
+    sort_columns=False,
+    memory_budget=None,
+    weights=None,
+    freq=None,
+):
+    """Build the DataFrame returned by 'extract' for a single interval.
+
+    The interval is known from the request, so the PeriodIndex is built
+    directly, including any missing time steps, rather than inferring the
+    frequency from the index.  The values are copied one column at a time
+    into a single array, which is a temporary memory mapped file if it
+    would be larger than 'memory_budget' bytes.  The columns are then
+    copied a slice of time steps at a time, so the temporary arrays, and
+    the values gathered for a '_GatheredColumn', also stay within the
+    budget.  With 'weights' each column is instead added, times its
+    weight, to the columns of its aggregates.  The 'freq' of the
+    PeriodIndex is found from 'index' if it is not given.
+    """
+    if freq is None:
+        freq = _freq_from_dates(intervalcode, index)
     skeys = list(data.keys())
     if sort_columns:
         skeys.sort(key=lambda tup: tup[1:])
-    columns = [f"{i[0]}_{i[1]}_{i[3]}".replace(" ", "-") for i in skeys]
-    result = pd.DataFrame(
-        pd.concat(
-            [pd.Series(data[i], index=index) for i in skeys], sort=False, axis=1
-        ).reindex(pd.Index(index))
-    )
-    result.columns = columns
-    result = tsutils.asbestfreq(result)
-    result = tsutils.common_kwds(result, start_date=start_date, end_date=end_date)
-    if interval == "bivl":
-        result.index = result.index.to_period(result.index[1] - result.index[0])
+    if weights is None:
+        columns = [f"{i[0]}_{i[1]}_{i[3]}".replace(" ", "-") for i in skeys]
+        # the output column and weight of each key
+        targets = [[(col, None)] for col in range(len(skeys))]
     else:
-        result.index = result.index.to_period()
-    result.index.name = "Datetime"
+        columns = []
+        targets = []
+        for key in skeys:
+            targets.append([])
+            for aggregate, weight in weights.get((key[0], key[1]), []):
+                column = f"{aggregate}_{key[3]}".replace(" ", "-")
+                if column not in columns:
+                    columns.append(column)
+                targets[-1].append((columns.index(column), weight))
+        if not columns:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    """
+                    None of the operations of the extracted time-series are
+                    in the weights file.
+                    """
+                )
+            )
+        if sort_columns:
+            order = sorted(range(len(columns)), key=columns.__getitem__)
+            position = np.argsort(order)
+            columns = [columns[i] for i in order]
+            targets = [[(position[i], w) for i, w in j] for j in targets]
+
+    index = pd.DatetimeIndex(index)
+    selected = np.arange(len(index))[index.slice_indexer(start_date, end_date)]
+    periods = index[selected].to_period(freq)
+    if len(periods) > 0:
+        periods = pd.period_range(periods[0], periods[-1], freq=freq)
+    # the output row of each date in 'index', or -1 if not selected
+    rows = np.full(len(index), -1, dtype=np.int64)
+    rows[selected] = periods.get_indexer(index[selected].to_period(freq))
+
+    shape = (len(periods), len(columns))
+    step = None
+    if memory_budget is not None and 8 * shape[0] * shape[1] > memory_budget:
+        with tempfile.TemporaryFile() as spill:
+            # column major so that each column is written sequentially
+            values = np.memmap(spill, dtype=np.float64, shape=shape, order="F")
+        # about 64 bytes of temporary arrays for each time step copied
+        step = max(1, memory_budget // 64)
+    else:
+        values = np.empty(shape, dtype=np.float64, order="F")
+    values[:] = np.nan
 
+    for key, keytargets in zip(skeys, targets):
+        if not keytargets:
+            continue
+        dates, column = data[key]
+        for start in range(0, len(dates), step or max(1, len(dates))):
+            part = slice(start, None if step is None else start + step)
+            if len(dates) == len(index):
+                outrows = rows[part]
+            else:
+                outrows = rows[index.searchsorted(dates[part])]
+            keep = outrows >= 0
+            outrows = outrows[keep]
+            part_values = column[part][keep]
+            for col, weight in keytargets:
+                if weight is None:
+                    values[outrows, col] = part_values
+                else:
+                    # the time steps without values stay NaN
+                    total = values[outrows, col]
+                    values[outrows, col] = np.where(
+                        np.isnan(total), 0, total
+                    ) + weight * part_values.astype(np.float64)
+
+    result = pd.DataFrame(values, index=periods, copy=False)
+    result.columns = columns
+    result.index.name = "Datetime"
     return result
 
 
+def _record_dates(level, dates):
+    """Return the dates of the 'level' records for the time steps of 'dates'.
+
+    These are the dates that '_gather_dates' gives the records, which for
+    the daily, monthly, and yearly levels is the start of the last day of
+    the time step.
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(list(dates)))
+    if level != 2:
+        dates = dates.to_period(code2freqmap[level]).end_time.normalize()
+    return dates.values.astype("M8[m]")
+
+
+def _record_file_time(level, date):
+    """Return the '_file_time' of a 'level' record with the '_record_date'."""
+    date = pd.Timestamp(date)
+    if level != 2 or (date.hour == 0 and date.minute == 0):
+        if level == 2:
+            date -= pd.Timedelta(days=1)
+        return _file_time(date.year, date.month, date.day, 24, 0)
+    return _file_time(date.year, date.month, date.day, date.hour, date.minute)
+
+
+def _lookup_layout(hbn, block, date):
+    """Return the offset of the record of 'block' at 'date' from the
+    periodic layout, or None."""
+    first = hbn.record_offset(block, 0)
+    if first is None:
+        return None
+    level = block[3]
+    start = _gather_dates(hbn.u8, np.array([first]), level)[0]
+    if level == 2:
+        second = hbn.record_offset(block, 1)
+        if second is None:
+            return None
+        delta = _gather_dates(hbn.u8, np.array([second]), level)[0] - start
+        step, remainder = divmod(date - start, delta)
+        if remainder:
+            return None
+    else:
+        freq = code2freqmap[level]
+        step = pd.Period(date, freq=freq).ordinal - pd.Period(start, freq=freq).ordinal
+    offset = hbn.record_offset(block, int(step))
+    if offset is None or _gather_dates(hbn.u8, np.array([offset]), level)[0] != date:
+        return None
+    return offset
+
+
+def _lookup_bisect(hbn, blocks, level, date):
+    """Return the offsets of the records of 'blocks' at 'date' found with
+    'seek_date', with None for those not found.
+
+    The records are read from the offset found by 'seek_date' until the
+    time passes 'date'.  A record can be missed if the file is not in
+    chronological order, but a record that is found is the one asked for.
+    """
+    found = dict.fromkeys(blocks)
+    pos = hbn.seek_date(date)
+    if pos is None:
+        return found
+    wanted = {block[:3]: block for block in blocks}
+    target = _record_file_time(level, date)
+    while pos < len(hbn.u8):
+        offsets, _, pos = hbn._scan_records(pos, 4096)
+        if len(offsets) == 0:
+            break
+        offsets = offsets[_gather_u4(hbn.u8, offsets + 4) == 1]
+        levels = _gather_u4(hbn.u8, offsets + 32)
+        times = _gather_file_times(hbn.u8, offsets, levels)
+        (here,) = np.nonzero((levels == level) & (times == target))
+        for i in here:
+            start = int(offsets[i])
+            key = (
+                bytes(hbn.buffer[start + 8 : start + 16]).strip(),
+                int(_gather_u4(hbn.u8, offsets[i : i + 1] + 16)[0]),
+                bytes(hbn.buffer[start + 20 : start + 28]).strip(),
+            )
+            if key in wanted:
+                found[wanted[key]] = start
+        if len(times) and times[-1] > target:
+            break
+    return found
+
+
+@validate_call
+def lookup(hbnfilename: str, observations: List[tuple]):
+    """Reads the values of time-series at scattered dates.
+
+    Only the record of each observation is found and only its value is read,
+    so calibration targets at a few thousand dates can be read from a
+    large file without extracting whole time-series.  The record offsets
+    are found from the record index if it has been built, from the
+    periodic layout of the file if it has one, or by bisecting the file by
+    date, in that order, and the values are read in the order of their
+    offsets in the file.
+
+    Parameters
+    ----------
+    ${hbnfilename}
+
+    observations: list
+        A list of (label, interval, date) tuples.  The label is in the same
+        'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE' format as 'extract' and
+        can match several time-series.  The interval is one of "yearly",
+        "monthly", "daily", or "bivl", and the date is anything in the time
+        step, for example '2000-06' for the monthly value of June 2000.
+
+    Returns
+    -------
+    DataFrame
+        One row for each time-series matched by each observation, in the
+        order of the observations, with the value or NaN if the time-series
+        has no record at the date."""
+    with HbnFile(hbnfilename) as hbn:
+        return _lookup(hbn, observations)
+
+
+def _lookup(hbn, observations):
+    """Look up the 'observations' in an open HbnFile, see 'lookup'."""
+    indexed = "offset" in hbn.__dict__
+    vnames = None
+    if not indexed:
+        # the header records at the start of the file are enough unless a
+        # label only matches a later header
+        if hbn.layout is not None:
+            vnames = hbn._header_names(*hbn.layout.headers)
+        else:
+            offsets, lengths, first = hbn._leading_records()
+            if first is not None:
+                vnames = hbn._header_names(offsets[:first], lengths[:first])
+
+    rows = []
+    matched = {}
+    leveldates = {}
+    for label, interval, date in observations:
+        if interval not in interval2codemap:
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The interval of each observation must be one of "bivl",
+                    "daily", "monthly", or "yearly" instead of "{interval}".
+                    """
+                )
+            )
+        level = interval2codemap[interval]
+        labelkey = (label if isinstance(label, str) else tuple(label), level)
+        leveldates.setdefault(level, []).append(date)
+        if labelkey in matched:
+            rows.append((matched[labelkey], level))
+            continue
+        _, labelids, labelfields = _parse_labels([label])
+        for everything in (False, True):
+            names = hbn.vnames if everything else vnames
+            if names is None:
+                continue
+            vocabulary = (
+                {optype.decode("ascii") for optype, _, _ in names},
+                {group.decode("ascii") for _, _, group in names},
+                {name for i in names.values() for name in i},
+            )
+            labelsets = _build_labelsets(labelids, labelfields, vocabulary)
+            matches = []
+            for (optype, lue, group), i in names.items():
+                for col, name in enumerate(i):
+                    key = (
+                        optype.decode("ascii"),
+                        lue,
+                        group.decode("ascii"),
+                        name,
+                        level,
+                    )
+                    if _match_labelsets(labelsets, key):
+                        matches.append(((optype, lue, group, level), col, key))
+            if matches:
+                break
+        if not matches:
+            lbl = label if isinstance(label, str) else ",".join(map(str, label))
+            raise ValueError(
+                tsutils.error_wrapper(
+                    f"""
+                    The label '{lbl}' matched no time-series in the binary
+                    file.
+                    """
+                )
+            )
+        matched[labelkey] = matches
+        rows.append((matches, level))
+
+    # one row for each time-series matched by each observation
+    leveldates = {
+        level: iter(_record_dates(level, dates)) for level, dates in leveldates.items()
+    }
+    expanded = []
+    for matches, level in rows:
+        recdate = next(leveldates[level])
+        expanded.extend((block, col, key, recdate) for block, col, key in matches)
+    rows = expanded
+
+    # find the record offsets
+    offsets = {}
+    pending = {(block, recdate) for block, _, _, recdate in rows}
+    if not indexed and hbn.layout is not None:
+        for block, recdate in pending:
+            offsets[(block, recdate)] = _lookup_layout(hbn, block, recdate)
+        pending = {i for i in pending if offsets[i] is None}
+    bydate = {}
+    for block, recdate in pending:
+        bydate.setdefault((block[3], recdate), []).append(block)
+    # each date costs a few reads of 64 KB, so for many dates it is faster
+    # to build the record index
+    if not indexed and 0 < len(bydate) <= max(16, len(hbn.u8) // 2**18):
+        for (level, recdate), blocks in bydate.items():
+            for block, offset in _lookup_bisect(hbn, blocks, level, recdate).items():
+                offsets[(block, recdate)] = offset
+        pending = {i for i in pending if offsets[i] is None}
+    if pending:
+        blocks = hbn.blocks()
+        dates = {}
+        for block, recdate in pending:
+            recnos = blocks.get(block, np.empty(0, dtype=np.int64))
+            if block not in dates:
+                dates[block] = hbn.dates[recnos]
+            i = np.searchsorted(dates[block], recdate)
+            if i < len(recnos) and dates[block][i] == recdate:
+                offsets[(block, recdate)] = int(hbn.offset[recnos[i]])
+
+    # read the values in file order
+    positions = np.array(
+        [
+            -1
+            if offsets.get((block, recdate)) is None
+            else offsets[(block, recdate)] + 56 + 4 * col
+            for block, col, _, recdate in rows
+        ],
+        dtype=np.int64,
+    )
+    values = np.full(len(rows), np.nan)
+    (found,) = np.nonzero(positions >= 0)
+    order = found[np.argsort(positions[found], kind="stable")]
+    values[order] = _gather(hbn.u8, positions[order], 4).view("<f4")[:, 0]
+
+    return pd.DataFrame(
+        [
+            key[:4]
+            + (
+                code2intervalmap[key[4]],
+                pd.Period(recdate, freq=code2freqmap[key[4]] or "min"),
+                value,
+            )
+            for (_, _, key, recdate), value in zip(rows, values)
+        ],
+        columns=[
+            "OPERATIONTYPE",
+            "ID",
+            "GROUP",
+            "VARIABLE",
+            "INTERVAL",
+            "DATE",
+            "VALUE",
+        ],
+    )
+
+
 @validate_call
-def catalog(hbnfilename: str):
+def catalog(hbnfilename: str, as_frame: bool = False):
     """
     Prints out a catalog of data sets in the binary file.
 
@@ -511,41 +2415,2237 @@ def catalog(hbnfilename: str):
     Parameters
     ----------
     ${hbnfilename}
+
+    as_frame: bool
+        [optional, default is False]
+
+        If True return a DataFrame with a row for each time-series and the
+        OPERATIONTYPE, ID, GROUP, VARIABLE, LEVEL, START, END, and INTERVAL
+        columns, where the names and the START and END periods are
+        categorical strings.  It is built a block of time-series at a time,
+        so is much faster than the default list of tuples for files with
+        many time-series.
+
     ${tablefmt}
     ${header}
 
     """
-    # PERLND  905  PWATER  SURS  5  1951  2001  yearly
-    # PERLND  905  PWATER  TAET  5  1951  2001  yearly
-    catlog = _get_data(hbnfilename, None, [",,,"], catalog_only=True)[1]
-    catkeys = sorted(catlog.keys())
-    return [cat + catlog[cat] + (code2intervalmap[cat[-1]],) for cat in catkeys]
+    if as_frame:
+        return _catalog_frame(hbnfilename)[0]
+    return _catalog(hbnfilename)
 
 
-@program.command()
-def about():
-    """Display version number and system information."""
-    tsutils.about(__name__)
+def _catalog_frame(hbnfilename, cancel=None):
+    """Catalog a file name or an open HbnFile as a DataFrame, see 'catalog'.
 
+    Also returns a dict of each interval code to its first and last
+    pd.Period.
+    """
+    columns = {"OPERATIONTYPE": [], "ID": [], "GROUP": [], "VARIABLE": [], "LEVEL": []}
+    ndates = {}
+    with _open_hbnfile(hbnfilename) as hbn:
+        for block, recnos in hbn.blocks().items():
+            if cancel is not None and cancel.is_set():
+                raise concurrent.futures.CancelledError()
+            keys = hbn.series_keys(block)[: int(hbn.numvals[recnos[0]])]
+            if not keys:
+                continue
+            for name, values in zip(columns, zip(*keys)):
+                columns[name].extend(values)
+            _add_level_dates(ndates, block[3], hbn.dates[recnos])
+    if not columns["ID"]:
+        raise ValueError(
+            tsutils.error_wrapper(
+                """
+                The label specifications below matched no records in the binary
+                file.
 
-def main():
-    if not os.path.exists("debug_hspfbintoolbox"):
-        sys.tracebacklimit = 0
+                [',,,']
+                """
+            )
+        )
 
-    import cltoolbox
+    # the first and last period of all of the time-series of each interval,
+    # from the scan of every record that is needed to find the time-series,
+    # so reading the end of the file with 'HbnFile.tail' would save nothing
+    periods = {}
+    for level, dates in _level_dates(ndates).items():
+        freq = _freq_from_dates(level, dates)
+        periods[level] = (
+            pd.Period(dates[0], freq=freq),
+            pd.Period(dates[-1], freq=freq),
+        )
 
-    from .toolbox_utils.src.toolbox_utils import tsutils
+    ids = np.array(columns["ID"], dtype=np.int64)
+    levels = np.array(columns["LEVEL"], dtype=np.int64)
+    names = {
+        i: pd.Categorical(columns[i]) for i in ("OPERATIONTYPE", "GROUP", "VARIABLE")
+    }
+    order = np.lexsort(
+        (
+            levels,
+            names["VARIABLE"].codes,
+            names["GROUP"].codes,
+            ids,
+            names["OPERATIONTYPE"].codes,
+        )
+    )
+    levels = levels[order]
+    result = pd.DataFrame(
+        {
+            "OPERATIONTYPE": names["OPERATIONTYPE"][order],
+            "ID": ids[order],
+            "GROUP": names["GROUP"][order],
+            "VARIABLE": names["VARIABLE"][order],
+            "LEVEL": levels,
+        }
+    )
+    for column, position in (("START", 0), ("END", 1)):
+        result[column] = pd.Categorical(
+            [str(periods[i][position]) for i in levels.tolist()]
+        )
+    result["INTERVAL"] = pd.Categorical([code2intervalmap[i] for i in levels.tolist()])
+    return result, periods
 
-    @cltoolbox.command("about", formatter_class=RSTHelpFormatter)
-    @tsutils.copy_doc(about)
-    def about_cli():
-        """docstring replaced by tsutils.copy_doc"""
-        import pprint
 
-        pprint.pprint(tsutils.about(__name__))
+def _catalog(hbnfilename, cancel=None):
+    """Catalog a file name or an open HbnFile, see 'catalog'."""
+    # PERLND  905  PWATER  SURS  5  1951  2001  yearly
+    # PERLND  905  PWATER  TAET  5  1951  2001  yearly
+    frame, periods = _catalog_frame(hbnfilename, cancel=cancel)
+    return [
+        (optype, lue, group, variable, level) + periods[level] + (interval,)
+        for optype, lue, group, variable, level, interval in zip(
+            *(
+                frame[i].tolist()
+                for i in (
+                    "OPERATIONTYPE",
+                    "ID",
+                    "GROUP",
+                    "VARIABLE",
+                    "LEVEL",
+                    "INTERVAL",
+                )
+            )
+        )
+    ]
 
-    @cltoolbox.command("extract", formatter_class=RSTHelpFormatter)
-    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+
+# the column separator and whether the columns are padded and underlined
+_TABLE_FORMATS = {
+    "csv": (",", True, False),
+    "tsv": ("\t", True, False),
+    "csv_nos": (",", False, False),
+    # tsutils.printiso only removes the padding around commas
+    "tsv_nos": ("\t", True, False),
+    "plain": ("  ", True, False),
+    "simple": ("  ", True, True),
+}
+
+
+def _write_table(columns, headers, tablefmt, chunk=65536):
+    """Write a table in the same layout as tsutils.printiso.
+
+    The 'columns' are a list of (values, numeric), where numeric columns
+    are right aligned, and the 'tablefmt' is one of _TABLE_FORMATS.  The
+    table is written 'chunk' rows at a time to stdout.
+    """
+    sep, padded, underline = _TABLE_FORMATS[tablefmt]
+    cells = []
+    lines = [[], []]
+    for header, (values, numeric) in zip(headers, columns):
+        values = np.asarray(values).astype(str)
+        width = 0
+        if padded:
+            width = max(len(header) + 2, int(np.char.str_len(values).max(initial=0)))
+        align = np.char.rjust if numeric else np.char.ljust
+        cells.append((values, width, align))
+        lines[0].append(header.rjust(width) if numeric else header.ljust(width))
+        lines[1].append("-" * width)
+    lines = lines if underline else lines[:1]
+    sys.stdout.write("".join(sep.join(i).rstrip() + "\n" for i in lines))
+    nrows = len(cells[0][0]) if cells else 0
+    for start in range(0, nrows, chunk):
+        rows = zip(
+            *(
+                align(values[start : start + chunk], width).tolist()
+                for values, width, align in cells
+            )
+        )
+        sys.stdout.write("".join(sep.join(i).rstrip() + "\n" for i in rows))
+
+
+def _diff_segments(hbn, chunk=65536):
+    """Yield the data records of 'hbn' a chunk at a time for 'diff'.
+
+    For each block in a chunk the block, the tuple of variable names, the
+    dates, and the float32 values with a row for each record are yielded.
+    """
+    for block, names, records, lengths in _stream_records(hbn, chunk):
+        ncols = min(len(names), (int(lengths.min()) - 52) // 4)
+        yield (
+            block,
+            tuple(names[:ncols]),
+            _gather_dates(hbn.u8, records, block[3]),
+            _gather(hbn.u8, records + 56, 4 * ncols).view("<f4"),
+        )
+
+
+def _diff_stat(stats, block, name):
+    """Return the running statistics of a time-series for 'diff'."""
+    optype, lue, group, level = block
+    # [count, missing, max abs, max rel, sum of squares, first date]
+    return stats.setdefault(
+        (optype.decode("ascii"), lue, group.decode("ascii"), name, level),
+        [0, 0, 0.0, 0.0, 0.0, None],
+    )
+
+
+def _diff_missing(stats, block, names, count):
+    """Count 'count' values of each of 'names' as missing from a file."""
+    for name in names:
+        _diff_stat(stats, block, name)[1] += count
+
+
+def _diff_block(stats, block, dates, base, cand, tolerance, stop_on_first):
+    """Accumulate the differences between the matched records of a block.
+
+    The 'base' and 'cand' are the (names, values) of the two files with a
+    row of values for each of the 'dates'.  Returns True if any value
+    differs by more than 'tolerance'.  With 'stop_on_first' only the records
+    up to the first such difference are counted.
+    """
+    (bnames, bvalues), (cnames, cvalues) = base, cand
+    ccols = {name: i for i, name in enumerate(cnames)}
+    common = [(i, ccols[name]) for i, name in enumerate(bnames) if name in ccols]
+    bvalues = bvalues[:, [i for i, _ in common]].astype(np.float64)
+    adiff = np.abs(cvalues[:, [i for _, i in common]].astype(np.float64) - bvalues)
+    over = adiff > tolerance
+    exceeded = bool(over.any())
+    if exceeded and stop_on_first:
+        rows = int(np.nonzero(over.any(axis=1))[0][0]) + 1
+        dates = dates[:rows]
+        bvalues, adiff, over = bvalues[:rows], adiff[:rows], over[:rows]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rdiff = np.where(
+            bvalues != 0, adiff / np.abs(bvalues), np.where(adiff > 0, np.inf, 0.0)
+        )
+    # NaN values are left out of the maximums but not the sum of squares
+    max_abs = np.fmax.reduce(adiff, axis=0, initial=0.0).tolist()
+    max_rel = np.fmax.reduce(rdiff, axis=0, initial=0.0).tolist()
+    sumsq = (adiff * adiff).sum(axis=0).tolist()
+    first = np.where(over.any(axis=0), over.argmax(axis=0), -1).tolist()
+    for col, (i, _) in enumerate(common):
+        stat = _diff_stat(stats, block, bnames[i])
+        stat[0] += len(dates)
+        stat[2] = max(stat[2], max_abs[col])
+        stat[3] = max(stat[3], max_rel[col])
+        stat[4] += sumsq[col]
+        if first[col] >= 0 and (stat[5] is None or dates[first[col]] < stat[5]):
+            stat[5] = dates[first[col]]
+    _diff_missing(stats, block, set(bnames).symmetric_difference(cnames), len(dates))
+    return exceeded
+
+
+@validate_call
+def diff(
+    hbnfilename: str,
+    candidate_hbnfilename: str,
+    tolerance: float = 0.0,
+    stop_on_first: bool = False,
+):
+    r"""Compares the time-series in two HSPF binary output files.
+
+    The two files are read together a chunk of records at a time, the
+    records are matched by operation type, ID, variable group, interval, and
+    date, and the values of the matched records of each block are compared
+    together.  Only the records not yet matched and the running statistics
+    for each time-series are kept in memory, so very large files can be
+    compared.
+
+    Parameters
+    ----------
+    ${hbnfilename}
+
+    candidate_hbnfilename: str
+        The HSPF binary output file to compare against 'hbnfilename'.
+
+    tolerance: float
+        [optional, default is 0.0]
+
+        Absolute differences less than or equal to 'tolerance' are not
+        counted when finding the first date of difference.
+
+    stop_on_first: bool
+        [optional, default is False]
+
+        Stop reading the files at the first value that differs by more than
+        'tolerance'.  The statistics then only cover the records compared up
+        to that point, which are the records of the blocks compared before
+        it in the same chunk and the records of its block up to its date.
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        One row for each time-series with the count of compared values,
+        the count of values missing from either file, the maximum absolute
+        difference, the maximum relative difference (relative to the value in
+        'hbnfilename'), the root mean square error, and the first date where
+        the difference is greater than 'tolerance'."""
+    stats = {}
+    # the (names, dates, values) of each block not yet matched in each file
+    pending = ({}, {})
+    with HbnFile(hbnfilename) as base, HbnFile(candidate_hbnfilename) as cand:
+        for segments in itertools.zip_longest(
+            _diff_segments(base), _diff_segments(cand)
+        ):
+            exceeded = False
+            for side, segment in enumerate(segments):
+                if segment is None:
+                    continue
+                block, names, dates, values = segment
+                held = pending[side].pop(block, None)
+                if held is not None and held[0] == names:
+                    dates = np.concatenate((held[1], dates))
+                    values = np.concatenate((held[2], values))
+                elif held is not None:
+                    # the header was extended, so the held records are
+                    # counted as missing
+                    _diff_missing(stats, block, held[0], len(held[1]))
+
+                # Files written by the same model setup will have the records
+                # in the same order, so the records are only kept until the
+                # matching records are read from the other file.
+                other = pending[1 - side].pop(block, None)
+                if other is None:
+                    pending[side][block] = (names, dates, values)
+                    continue
+                common, mine, theirs = np.intersect1d(
+                    dates, other[1], return_indices=True
+                )
+                this = (names, values[mine])
+                that = (other[0], other[2][theirs])
+                base_values, cand_values = (this, that) if side == 0 else (that, this)
+                exceeded = (
+                    _diff_block(
+                        stats,
+                        block,
+                        common,
+                        base_values,
+                        cand_values,
+                        tolerance,
+                        stop_on_first,
+                    )
+                    or exceeded
+                )
+                for held_side, held_names, held_dates, held_values, used in (
+                    (side, names, dates, values, mine),
+                    (1 - side, other[0], other[1], other[2], theirs),
+                ):
+                    keep = np.ones(len(held_dates), dtype=bool)
+                    keep[used] = False
+                    if keep.any():
+                        pending[held_side][block] = (
+                            held_names,
+                            held_dates[keep],
+                            held_values[keep],
+                        )
+                if exceeded and stop_on_first:
+                    break
+            if exceeded and stop_on_first:
+                break
+
+    for side_pending in pending:
+        for block, (names, dates, _) in side_pending.items():
+            _diff_missing(stats, block, names, len(dates))
+
+    rows = []
+    for key in sorted(stats):
+        count, missing, max_abs, max_rel, sumsq, first_date = stats[key]
+        rmse = math.sqrt(sumsq / count) if count else math.nan
+        if count == 0:
+            max_abs = max_rel = math.nan
+        rows.append(
+            key[:4]
+            + (code2intervalmap[key[4]], count, missing, max_abs, max_rel, rmse)
+            + (None if first_date is None else first_date.astype("M8[us]").item(),)
+        )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "OPERATIONTYPE",
+            "ID",
+            "GROUP",
+            "VARIABLE",
+            "INTERVAL",
+            "COUNT",
+            "MISSING",
+            "MAX_ABS_DIFF",
+            "MAX_REL_DIFF",
+            "RMSE",
+            "FIRST_DIFF_DATE",
+        ],
+    )
+
+
+def _series_matcher(labels, level):
+    """Match the 'labels' to the time-series of 'level' as a file is read.
+
+    Returns the parsed labels, the list of matched '_get_data' keys, and a
+    function for '_stream_blocks' that is called with each new block and
+    its variable names and returns the (series number, variable name) of
+    the matched variables.  Each new time-series gets the next series
+    number, so the time-series are matched from the header records in the
+    same pass that reads the values.
+    """
+    labels, labelids, labelfields = _parse_labels(labels)
+    keys = []
+    numbers = {}
+
+    def match(block, names):
+        optype, lue, group, blocklevel = block
+        if blocklevel != level:
+            return []
+        optype = optype.decode("ascii")
+        group = group.decode("ascii")
+        labelsets = _build_labelsets(
+            labelids, labelfields, ({optype}, {group}, set(names))
+        )
+        matched = []
+        for name in names:
+            key = (optype, lue, group, name, level)
+            if not _match_labelsets(labelsets, key):
+                continue
+            if key not in numbers:
+                numbers[key] = len(keys)
+                keys.append(key)
+            matched.append((numbers[key], name))
+        return matched
+
+    return labels, keys, match
+
+
+def _stream_records(hbn, chunk=65536):
+    """Yield the data records of 'hbn' as the file is read.
+
+    The records are read 'chunk' at a time without building the record
+    index.  For each (optype, lue, group, level) block in a chunk the block,
+    the variable names from the header records read so far, and the offsets
+    and lengths of the records of the block are yielded, with the blocks in
+    the order of their first record.
+    """
+    vnames = {}
+    blockids = {}
+    pos = 1
+    while pos < len(hbn.u8):
+        offsets, lengths, pos = hbn._scan_records(pos, chunk)
+        if len(offsets) == 0:
+            break
+        rectype = _gather_u4(hbn.u8, offsets + 4)
+        isheader = rectype == 0
+        if isheader.any():
+            for key, names in hbn._header_names(
+                offsets[isheader], lengths[isheader]
+            ).items():
+                if vnames.get(key) != names:
+                    vnames.setdefault(key, []).extend(names)
+        isdata = rectype == 1
+        data = offsets[isdata]
+        lengths = lengths[isdata]
+        ids = np.ascontiguousarray(_series_id(hbn.u8, data)).view("V24")[:, 0]
+        uniq, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        ends = np.cumsum(np.bincount(inverse, minlength=len(uniq)))
+        for index in np.argsort(first).tolist():
+            uid = uniq[index].tobytes()
+            block = blockids.get(uid)
+            if block is None:
+                block = blockids[uid] = (
+                    uid[:8].rstrip(b"\x00").strip(),
+                    int.from_bytes(uid[8:12], "little"),
+                    uid[12:20].rstrip(b"\x00").strip(),
+                    int.from_bytes(uid[20:24], "little"),
+                )
+            records = order[(ends[index - 1] if index else 0) : ends[index]]
+            yield block, vnames.get(block[:3], []), data[records], lengths[records]
+
+
+def _stream_blocks(hbn, match, chunk=65536):
+    """Yield the values of the matched time-series as the file is read.
+
+    The 'match' function from '_series_matcher' is called with each block
+    from '_stream_records' and its variable names the first time a data
+    record of the block is read.  For each block with matched time-series
+    in a chunk the block, the dates, and a dict of series number to values
+    are yielded.
+    """
+    matches = {}
+    for block, names, records, _ in _stream_records(hbn, chunk):
+        matched = matches.get(block)
+        if matched is None:
+            matched = matches[block] = match(block, names)
+        if not matched:
+            continue
+        yield (
+            block,
+            _gather_dates(hbn.u8, records, block[3]),
+            {
+                series: _gather(hbn.u8, records + 56 + 4 * names.index(name), 4)
+                .view("<f4")[:, 0]
+                .astype(np.float64)
+                for series, name in matched
+                if name in names
+            },
+        )
+
+
+def _ensemble_statistics(values, statistics, percentiles):
+    """Return the statistics across the files of the (dates, files, series)
+    'values' as a list of (dates, series) arrays."""
+    functions = {
+        "mean": np.nanmean,
+        "std": functools.partial(np.nanstd, ddof=1),
+        "min": np.nanmin,
+        "max": np.nanmax,
+    }
+    with warnings.catch_warnings():
+        # all NaN or a single file
+        warnings.simplefilter("ignore", RuntimeWarning)
+        result = [functions[i](values, axis=1) for i in statistics]
+    if percentiles:
+        # np.nanpercentile loops over the time steps and time-series, so the
+        # linear interpolation is done here on the values sorted with the
+        # NaNs last
+        values = np.sort(values, axis=1)
+        count = (~np.isnan(values)).sum(axis=1)
+        for percentile in percentiles:
+            position = percentile / 100 * np.maximum(count - 1, 0)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+            low = np.take_along_axis(values, lower[:, None], axis=1)[:, 0]
+            high = np.take_along_axis(values, upper[:, None], axis=1)[:, 0]
+            result.append(
+                np.where(count > 0, low + (high - low) * (position - lower), np.nan)
+            )
+    return result
+
+
+def _ensemble_rounds(hbns, match, keys, statistics, percentiles, stream=True):
+    """Read the files together and return a list of (dates, statistics).
+
+    The 'match' function and the 'keys' list are from '_series_matcher'
+    and shared by the files.  With 'stream' the statistics of the time steps
+    that every file has read past are calculated after each round of
+    reading, and if the dates of a time-series in a file are not increasing
+    None is returned.
+    """
+    end = np.datetime64("2262-01-01", "m")
+    blocknums = {}
+    # the last date read of each block of each file
+    seen = np.empty((len(hbns), 0), dtype="M8[m]")
+    # the last time step with statistics
+    flushed = None
+    # the (dates, file number, series numbers, values) not yet used
+    pending = []
+    parts = []
+    members = [_stream_blocks(hbn, match) for hbn in hbns]
+    while any(i is not None for i in members):
+        for filenum, member in enumerate(members):
+            if member is None:
+                continue
+            try:
+                block, dates, columns = next(member)
+            except StopIteration:
+                members[filenum] = None
+                seen[filenum] = end
+                continue
+            if block not in blocknums:
+                if stream and flushed is not None and (dates[:1] <= flushed).any():
+                    # the new block has time steps that are done
+                    return None
+                blocknums[block] = len(blocknums)
+                column = np.where(
+                    [i is None for i in members], end, np.datetime64("NaT", "m")
+                )
+                seen = np.column_stack((seen, column))
+            last = seen[filenum, blocknums[block]]
+            if stream and (
+                (dates[:1] <= last).any() or (np.diff(dates) <= np.timedelta64(0)).any()
+            ):
+                return None
+            if len(dates) and columns:
+                pending.append(
+                    (
+                        dates.astype("M8[m]"),
+                        filenum,
+                        list(columns),
+                        np.column_stack(list(columns.values())),
+                    )
+                )
+                seen[filenum, blocknums[block]] = dates.max()
+
+        if stream or all(i is None for i in members):
+            # the time steps that every file has read past
+            watermark = seen.min() if seen.size else np.datetime64("NaT")
+            if np.isnat(watermark) or not pending:
+                continue
+            ready = np.unique(
+                np.concatenate([i[0][i[0] <= watermark] for i in pending])
+            )
+            if not len(ready):
+                continue
+            values = np.full((len(ready), len(hbns), len(keys)), np.nan)
+            remaining = []
+            for dates, filenum, series, block_values in pending:
+                mask = dates <= watermark
+                rows = np.searchsorted(ready, dates[mask])
+                values[rows[:, None], filenum, series] = block_values[mask]
+                if not mask.all():
+                    remaining.append(
+                        (dates[~mask], filenum, series, block_values[~mask])
+                    )
+            pending = remaining
+            flushed = ready[-1]
+            parts.append((ready, _ensemble_statistics(values, statistics, percentiles)))
+    return parts
+
+
+@validate_call
+def ensemble(
+    hbnfilenames: Union[str, List[str]],
+    interval: Literal["yearly", "monthly", "daily", "bivl"],
+    *labels,
+    statistics: Tuple[Literal["mean", "std", "min", "max"], ...] = (
+        "mean",
+        "std",
+        "min",
+        "max",
+    ),
+    percentiles: Tuple[float, ...] = (5, 50, 95),
+    start_date=None,
+    end_date=None,
+    label_file: Optional[str] = None,
+):
+    """Statistics at each time step across an ensemble of binary files.
+
+    The files of an ensemble of model runs, for example from varying the
+    parameters, are read together a chunk of records at a time, and the
+    statistics across the files are calculated for each time step once all
+    of the files have been read past it.  Only the values of the time steps
+    between the slowest and the fastest file are kept in memory, so the
+    memory used depends on the number of files and time-series, not on the
+    length of the time-series.  If the records of a file are not in date
+    order all of the time steps are kept until the files have been read.
+    The percentiles are exact.
+
+    Parameters
+    ----------
+    hbnfilenames: str or list
+        The HSPF binary output files of the ensemble, as a list or as a
+        glob pattern, for example ``runs/*.hbn``.  The time-series are
+        matched to the labels in each file as it is read.
+
+    interval: str
+        One of "yearly", "monthly", "daily", or "bivl".
+
+    labels: str
+        The time-series in the same 'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE'
+        format as 'extract'.
+
+    statistics: list
+        [optional, default is ("mean", "std", "min", "max")]
+
+        The statistics to calculate across the files at each time step, any
+        of "mean", "std", "min", and "max".  The standard deviation is the
+        sample standard deviation.  Files without the time-series or the
+        time step are ignored.
+
+    percentiles: list
+        [optional, default is (5, 50, 95)]
+
+        The percentiles from 0 to 100 to calculate across the files at each
+        time step.
+
+    ${start_date}
+
+    ${end_date}
+
+    ${label_file}
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        One column for each statistic of each time-series, named like the
+        'extract' columns with the statistic added, for example
+        'RCHRES_1_RO_mean' and 'RCHRES_1_RO_p95'."""
+    if isinstance(hbnfilenames, str):
+        hbnfilenames = sorted(glob.glob(hbnfilenames)) or [hbnfilenames]
+    if any(not 0 <= i <= 100 for i in percentiles):
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The percentiles must be from 0 to 100 instead of
+                {percentiles}.
+                """
+            )
+        )
+    labels = labels + tuple(_read_label_file(label_file))
+    level = interval2codemap[interval]
+
+    with contextlib.ExitStack() as stack:
+        hbns = [stack.enter_context(HbnFile(i)) for i in hbnfilenames]
+        parsed, keys, match = _series_matcher(labels, level)
+        parts = _ensemble_rounds(hbns, match, keys, statistics, percentiles)
+        if parts is None:
+            # the records are not in date order, so all of the time steps
+            # are kept until the files have been read
+            parts = _ensemble_rounds(
+                hbns, match, keys, statistics, percentiles, stream=False
+            )
+    if not keys:
+        raise _no_match_error(parsed)
+
+    dates = np.concatenate([i for i, _ in parts]) if parts else np.empty(0, "M8[m]")
+    names = list(statistics) + [f"p{i:g}" for i in percentiles]
+    columns = [
+        f"{i[0]}_{i[1]}_{i[3]}_{name}".replace(" ", "-") for i in keys for name in names
+    ]
+    values = np.empty((len(dates), len(keys) * len(names)))
+    for stat in range(len(names)):
+        # the time-series matched after a part was calculated are NaN in it
+        values[:, stat :: len(names)] = (
+            np.concatenate(
+                [
+                    np.pad(
+                        i[stat],
+                        ((0, 0), (0, len(keys) - i[stat].shape[1])),
+                        constant_values=np.nan,
+                    )
+                    for _, i in parts
+                ]
+            )
+            if parts
+            else np.empty((0, len(keys)))
+        )
+    index = pd.DatetimeIndex(dates)
+    result = pd.DataFrame(values, index=index, columns=columns)
+    result = result.iloc[index.slice_indexer(start_date, end_date)]
+    result.index = result.index.to_period(_freq_from_dates(level, dates))
+    result.index.name = "Datetime"
+    return result
+
+
+def _nday_update(state, series, dates, values, window, start_month):
+    """Add the next 'values' of a time-series to the n-day statistics.
+
+    The 'state' of each series is the last 'window' - 1 values and a dict
+    of year to the (minimum, maximum) of the 'window' time step means
+    ending in that year.  The year of a date is the year in which it ends
+    when the years start in 'start_month'.
+    """
+    tail, years = state.setdefault(series, (np.empty(0), {}))
+    values = np.concatenate((tail, values.astype(np.float64)))
+    state[series] = (values[len(values) - window + 1 :], years)
+    if len(values) < window:
+        return
+    total = np.concatenate(([0.0], np.cumsum(values)))
+    means = (total[window:] - total[:-window]) / window
+    dates = dates[len(dates) - len(means) :]
+    months = dates.astype("M8[M]").astype(np.int64)
+    year = months // 12 + 1970
+    if start_month > 1:
+        year = year + (months % 12 + 1 >= start_month)
+    uniq, starts = np.unique(year, return_index=True)
+    for index, lowest, highest in zip(
+        uniq.tolist(),
+        np.minimum.reduceat(means, starts).tolist(),
+        np.maximum.reduceat(means, starts).tolist(),
+    ):
+        if index in years:
+            lowest = min(lowest, years[index][0])
+            highest = max(highest, years[index][1])
+        years[index] = (lowest, highest)
+
+
+@validate_call
+def nday(
+    hbnfilename: str,
+    *labels,
+    window: int = 7,
+    interval: Literal["monthly", "daily", "bivl"] = "daily",
+    statistics: Tuple[Literal["min", "max"], ...] = ("min",),
+    start_month: int = 1,
+    label_file: Optional[str] = None,
+):
+    """Yearly n-day minimum and maximum means, for example for 7Q10.
+
+    The mean of each 'window' consecutive time steps is calculated as the
+    records are read, keeping only the last 'window' values of each
+    time-series, and the minimum and maximum of the means ending in each
+    year are returned.  The yearly minimum 7 day mean daily flow of a reach
+    is the series used to estimate the 7Q10 low flow.
+
+    Parameters
+    ----------
+    ${hbnfilename}
+
+    labels: str
+        The time-series in the same 'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE'
+        format as 'extract', for example 'RCHRES,,HYDR,RO'.
+
+    window: int
+        [optional, default is 7]
+
+        The number of time steps in each mean.
+
+    interval: str
+        [optional, default is "daily"]
+
+        One of "monthly", "daily", or "bivl".
+
+    statistics: list
+        [optional, default is ("min",)]
+
+        Any of "min" and "max".
+
+    start_month: int
+        [optional, default is 1]
+
+        The first month of the year.  For example 4 for the climatic year
+        used for low flows, starting in April, or 10 for the water year.
+        The year is named by the calendar year it ends in.
+
+    ${label_file}
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        One column for each statistic of each time-series, named like the
+        'extract' columns with the statistic and window added, for example
+        'RCHRES_1_RO_min7'."""
+    if window < 1 or not 1 <= start_month <= 12:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The "window" must be 1 or more and the "start_month" from 1 to
+                12 instead of {window} and {start_month}.
+                """
+            )
+        )
+    labels = labels + tuple(_read_label_file(label_file))
+    state = {}
+    with HbnFile(hbnfilename) as hbn:
+        parsed, keys, match = _series_matcher(labels, interval2codemap[interval])
+        last = {}
+        for block, dates, columns in _stream_blocks(hbn, match):
+            if (dates[:1] <= last.get(block, dates[:1] - 1)).any() or (
+                np.diff(dates) <= np.timedelta64(0)
+            ).any():
+                break
+            if len(dates):
+                last[block] = dates[-1]
+            for series, values in columns.items():
+                _nday_update(state, series, dates, values, window, start_month)
+        else:
+            last = None
+        if not keys:
+            raise _no_match_error(parsed)
+        if last is not None:
+            # the records are not in date order, so the time-series are read
+            # and sorted
+            state = {}
+            data = _get_data(hbn, interval, labels, catalog_only=False)[1]
+            keys = list(data)
+            for series, key in enumerate(keys):
+                dates, values = data[key]
+                order = np.argsort(dates, kind="stable")
+                _nday_update(
+                    state, series, dates[order], values[order], window, start_month
+                )
+            del data
+
+    years = sorted({year for series in state.values() for year in series[1]})
+    columns = {}
+    for series, key in enumerate(keys):
+        byyear = state.get(series, (None, {}))[1]
+        for statistic in statistics:
+            column = f"{key[0]}_{key[1]}_{key[3]}_{statistic}{window}"
+            columns[column.replace(" ", "-")] = [
+                byyear[i][statistic == "max"] if i in byyear else np.nan for i in years
+            ]
+    # the year ends in the month before 'start_month'
+    month = calendar.month_abbr[(start_month + 10) % 12 + 1].upper()
+    result = pd.DataFrame(
+        columns,
+        index=pd.PeriodIndex(
+            [str(i) for i in years], freq=f"{code2freqmap[5]}-{month}"
+        ),
+        dtype=np.float64,
+    )
+    result.index.name = "Datetime"
+    return result
+
+
+def _back_pointers_ok(u8, offsets, lengths):
+    """Test the back pointer after each record against its length."""
+    expected = (lengths + 4) * 4
+    nbytes = np.where(expected >= 65536, 3, np.where(expected >= 256, 2, 1))
+    tails = offsets + 4 + lengths
+    inside = tails + nbytes <= len(u8)
+    found = np.zeros(len(offsets), dtype=np.int64)
+    for i in range(3):
+        # big-endian, so shift in one byte at a time
+        use = inside & (nbytes > i)
+        found[use] = found[use] * 256 + u8[tails[use] + i]
+    return inside & (found >> 2 == lengths + 4)
+
+
+def _validate_headers(hbn):
+    """Yield the problems with the header records of 'hbn'."""
+    for recno in np.nonzero(hbn.rectype == 0)[0]:
+        pos = int(hbn.offset[recno]) + 28
+        end = int(hbn.offset[recno]) + 4 + int(hbn.length[recno])
+        while pos < end:
+            (length,) = struct.unpack("I", hbn.buffer[pos : pos + 4])
+            if length == 0 or pos + 4 + length > end:
+                break
+            pos += length + 4
+        if pos != end:
+            yield (
+                int(hbn.offset[recno]),
+                "length",
+                "The variable names do not fill the header record.",
+            )
+
+
+def _error_line(err):
+    """Return the message of 'err' on one line, without the border that
+    tsutils.error_wrapper adds."""
+    return " ".join(str(err).replace("\n*", "\n").split()) or repr(err)
+
+
+@validate_call
+def validate(hbnfilename: str):
+    """Checks the structure of a HSPF binary output file.
+
+    Looks for a valid first byte, records that are corrupt or truncated,
+    record lengths that do not match the contents, back pointers that do not
+    match the record length, data records without an earlier header record,
+    dates that are not increasing within a time-series, and missing time
+    steps.  The file is read once with vectorized checks so that large files
+    can be checked at close to disk speed.
+
+    The command line version exits with a status of 1 if any problems are
+    found.
+
+    Parameters
+    ----------
+    ${hbnfilename}
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        One row for each problem with the byte offset, the name of the
+        check, and a description.  The DataFrame is empty if there are no
+        problems."""
+    issues = []
+    try:
+        hbn = HbnFile(hbnfilename, use_layout=False)
+    except ValueError as err:
+        issues.append((0, "magic", _error_line(err)))
+    else:
+        with hbn:
+            for start, end in hbn.skipped:
+                issues.append(
+                    (start, "skipped", f"Corrupt or truncated bytes up to {end}.")
+                )
+
+            # lengths
+            isdata = hbn.rectype == 1
+            short = hbn.length < 24
+            short[isdata] = hbn.length[isdata] < 56
+            for recno in np.nonzero(short)[0]:
+                issues.append(
+                    (int(hbn.offset[recno]), "length", "The record is too short.")
+                )
+            for recno in np.nonzero(isdata & ((hbn.length - 52) % 4 != 0))[0]:
+                issues.append(
+                    (
+                        int(hbn.offset[recno]),
+                        "length",
+                        "The data record length is not a whole number of values.",
+                    )
+                )
+            issues.extend(_validate_headers(hbn))
+
+            for recno in np.nonzero(~_back_pointers_ok(hbn.u8, hbn.offset, hbn.length))[
+                0
+            ]:
+                issues.append(
+                    (
+                        int(hbn.offset[recno]),
+                        "back pointer",
+                        "The back pointer does not match the record length.",
+                    )
+                )
+
+            # headers must come before the data
+            first_header = {}
+            for recno in np.nonzero(hbn.rectype == 0)[0]:
+                key = (hbn.optype[recno], int(hbn.lue[recno]), hbn.group[recno])
+                first_header.setdefault(key, recno)
+
+            bivl = np.unique(hbn.dates[hbn.level == 2])
+            bivl_step = np.diff(bivl).min() if len(bivl) > 1 else None
+            for (optype, lue, group, level), recnos in hbn.blocks().items():
+                name = f"{optype.decode('ascii')} {lue} {group.decode('ascii')}"
+                header = first_header.get((optype, lue, group))
+                if header is None or header > recnos[0]:
+                    issues.append(
+                        (
+                            int(hbn.offset[recnos[0]]),
+                            "header",
+                            f"The data for {name} comes before its header record.",
+                        )
+                    )
+                if hbn.numvals[recnos].max() > len(
+                    hbn.vnames.get((optype, lue, group), [])
+                ):
+                    issues.append(
+                        (
+                            int(hbn.offset[recnos[0]]),
+                            "header",
+                            f"The data for {name} has more values than names.",
+                        )
+                    )
+
+                dates = hbn.dates[recnos]
+                steps = np.diff(dates)
+                (bad,) = np.nonzero(steps <= np.timedelta64(0, "m"))
+                if len(bad):
+                    issues.append(
+                        (
+                            int(hbn.offset[recnos[bad[0] + 1]]),
+                            "dates",
+                            (
+                                f"The {code2intervalmap[level]} dates for {name} "
+                                f"are not increasing at {dates[bad[0] + 1]}."
+                            ),
+                        )
+                    )
+                    continue
+                if level == 2:
+                    if bivl_step is None:
+                        continue
+                    missing = steps // bivl_step - 1
+                else:
+                    periods = pd.DatetimeIndex(dates).to_period(code2freqmap[level])
+                    missing = np.diff(periods.asi8) - 1
+                (gaps,) = np.nonzero(missing)
+                if len(gaps):
+                    issues.append(
+                        (
+                            int(hbn.offset[recnos[gaps[0] + 1]]),
+                            "missing",
+                            (
+                                f"The {code2intervalmap[level]} data for {name} "
+                                f"is missing {int(missing[gaps].sum())} time "
+                                f"steps, the first before {dates[gaps[0] + 1]}."
+                            ),
+                        )
+                    )
+
+    issues.sort(key=lambda issue: issue[0])
+    return pd.DataFrame(issues, columns=["OFFSET", "CHECK", "MESSAGE"])
+
+
+# The number of time steps in each chunk of the zone maps by default.
+_ZONE_CHUNK_SIZE = 365
+
+
+def _zone_map_file(hbnfilename):
+    """Return the name of the zone map file kept next to 'hbnfilename'."""
+    return f"{hbnfilename}.zonemap.npz"
+
+
+def _build_zone_maps(hbn, chunk_size):
+    """Return the zone maps of the time-series in 'hbn' as a dict of arrays.
+
+    Each time-series is split into chunks of 'chunk_size' time steps, and
+    for each chunk the count of finite values and their minimum, maximum,
+    and sum are kept along with the range of time steps, the offsets of the
+    first and last records, and the dates.
+    """
+    series = []
+    chunks = {
+        name: []
+        for name in (
+            "series",
+            "start",
+            "stop",
+            "first_offset",
+            "last_offset",
+            "start_date",
+            "end_date",
+            "count",
+            "minimum",
+            "maximum",
+            "sum",
+        )
+    }
+    for block, recnos in hbn.blocks().items():
+        dates = hbn.dates[recnos]
+        freq = code2freqmap[block[3]] or _freq_from_dates(block[3], dates).freqstr
+        starts = np.arange(0, len(recnos), chunk_size)
+        stops = np.append(starts[1:], len(recnos))
+        for col, key in enumerate(
+            hbn.series_keys(block)[: int(hbn.numvals[recnos[0]])]
+        ):
+            values = hbn.column(recnos, col)
+            finite = np.isfinite(values)
+            chunks["series"].append(np.full(len(starts), len(series)))
+            chunks["start"].append(starts)
+            chunks["stop"].append(stops)
+            chunks["first_offset"].append(hbn.offset[recnos[starts]])
+            chunks["last_offset"].append(hbn.offset[recnos[stops - 1]])
+            chunks["start_date"].append(dates[starts])
+            chunks["end_date"].append(dates[stops - 1])
+            chunks["count"].append(np.add.reduceat(finite, starts))
+            chunks["minimum"].append(
+                np.minimum.reduceat(np.where(finite, values, np.inf), starts)
+            )
+            chunks["maximum"].append(
+                np.maximum.reduceat(np.where(finite, values, -np.inf), starts)
+            )
+            chunks["sum"].append(
+                np.add.reduceat(np.where(finite, values, 0), starts, dtype=np.float64)
+            )
+            series.append(key + (col, freq))
+            del values
+
+    stat = os.stat(hbn.filename)
+    zones = {
+        name: np.concatenate(parts) if parts else np.empty(0)
+        for name, parts in chunks.items()
+    }
+    zones["series"] = zones["series"].astype(np.int64)
+    for name, values in zip(
+        ("optype", "lue", "group", "variable", "level", "column", "freq"),
+        zip(*series) if series else [[]] * 7,
+    ):
+        zones[name] = np.array(values)
+    zones["chunk_size"] = np.array(chunk_size)
+    zones["source"] = np.array([stat.st_size, stat.st_mtime_ns])
+    return zones
+
+
+def _series_id(u8, offsets):
+    """Return the operation type, ID, group, and level bytes of the data
+    records at 'offsets', which are the same for the records of a block."""
+    return np.concatenate(
+        (_gather(u8, offsets + 8, 20), _gather(u8, offsets + 32, 4)), axis=1
+    )
+
+
+def _zone_record_index(hbn, ranges):
+    """Return the offsets of the data records in the byte 'ranges' by block.
+
+    Each range is the offsets of the first and last records of a chunk.
+    Overlapping ranges are merged so that each record leader is read once,
+    and the returned dict maps the '_series_id' bytes of each block to the
+    sorted offsets of its records.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    parts = []
+    for first, last in merged:
+        pos = first
+        while pos <= last:
+            offsets, _, pos = hbn._scan_records(pos, 65536)
+            if len(offsets) == 0:
+                break
+            parts.append(offsets[offsets <= last])
+    if not parts:
+        return {}
+    offsets = np.concatenate(parts)
+    offsets = offsets[_gather_u4(hbn.u8, offsets + 4) == 1]
+    ids = np.ascontiguousarray(_series_id(hbn.u8, offsets)).view("V24")[:, 0]
+    uniq, inverse = np.unique(ids, return_inverse=True)
+    order = np.argsort(inverse.reshape(-1), kind="stable")
+    bounds = np.searchsorted(inverse.reshape(-1)[order], np.arange(len(uniq) + 1))
+    return {
+        uniq[i].tobytes(): offsets[order[bounds[i] : bounds[i + 1]]]
+        for i in range(len(uniq))
+    }
+
+
+def _load_zone_maps(hbn):
+    """Return the zone maps saved for 'hbn', or None if there are none or
+    the file has changed since they were written."""
+    try:
+        with np.load(_zone_map_file(hbn.filename)) as npz:
+            zones = dict(npz)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(hbn.filename)
+    if zones["source"].tolist() != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    return zones
+
+
+@validate_call
+def zonemap(hbnfilename: str, chunk_size: int = _ZONE_CHUNK_SIZE):
+    """Writes zone maps of the time-series in a HSPF binary output file.
+
+    Each time-series is split into chunks of 'chunk_size' time steps, and
+    the count of values and their minimum, maximum, and sum in each chunk
+    are written to a file next to the binary file with '.zonemap.npz'
+    added to the name.  The 'query' command uses the zone maps to skip the
+    chunks that cannot match a predicate, so only the values of the chunks
+    that might match are read.  The zone maps are ignored if the binary
+    file is changed after they are written.
+
+    Parameters
+    ----------
+    ${hbnfilename}
+
+    chunk_size: int
+        [optional, default is 365]
+
+        The number of time steps in each chunk.  Smaller chunks skip more of
+        the values that cannot match, but make a larger zone map file.
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        One row for each chunk of each time-series with the dates of the
+        first and last time steps, the count of values, and the minimum,
+        maximum, and sum of the values."""
+    if chunk_size < 1:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The "chunk_size" argument must be 1 or more instead of
+                {chunk_size}.
+                """
+            )
+        )
+    with HbnFile(hbnfilename) as hbn:
+        zones = _build_zone_maps(hbn, chunk_size)
+    filename = _zone_map_file(hbnfilename)
+    with open(f"{filename}.tmp", "wb") as fpo:
+        np.savez(fpo, **zones)
+    os.replace(f"{filename}.tmp", filename)
+
+    series = zones["series"]
+    return pd.DataFrame(
+        {
+            "OPERATIONTYPE": zones["optype"][series],
+            "ID": zones["lue"][series],
+            "GROUP": zones["group"][series],
+            "VARIABLE": zones["variable"][series],
+            "INTERVAL": [code2intervalmap[i] for i in zones["level"][series]],
+            "START_DATE": zones["start_date"],
+            "END_DATE": zones["end_date"],
+            "COUNT": zones["count"],
+            "MINIMUM": zones["minimum"],
+            "MAXIMUM": zones["maximum"],
+            "SUM": zones["sum"],
+        }
+    )
+
+
+# For each comparison the test of the values, whether a chunk with the
+# minimum and maximum might have a matching value, and whether all of the
+# values in the chunk must match.
+_PREDICATES = {
+    ">": (np.greater, lambda lo, hi, x: hi > x, lambda lo, hi, x: lo > x),
+    ">=": (np.greater_equal, lambda lo, hi, x: hi >= x, lambda lo, hi, x: lo >= x),
+    "<": (np.less, lambda lo, hi, x: lo < x, lambda lo, hi, x: hi < x),
+    "<=": (np.less_equal, lambda lo, hi, x: lo <= x, lambda lo, hi, x: hi <= x),
+    "==": (
+        np.equal,
+        lambda lo, hi, x: (lo <= x) & (hi >= x),
+        lambda lo, hi, x: (lo == x) & (hi == x),
+    ),
+    "!=": (
+        np.not_equal,
+        lambda lo, hi, x: (lo != x) | (hi != x),
+        lambda lo, hi, x: (hi < x) | (lo > x),
+    ),
+}
+
+
+def _parse_predicate(predicate):
+    """Return the comparison and the number of a predicate like '>100'."""
+    match = re.fullmatch(r"\s*(>=|<=|==|!=|>|<)\s*(\S+)\s*", predicate)
+    try:
+        return match.group(1), float(match.group(2))
+    except (AttributeError, ValueError):
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The predicate must be one of '>', '>=', '<', '<=', '==', or
+                '!=' followed by a number, for example '>100', instead of
+                '{predicate}'.
+                """
+            )
+        ) from None
+
+
+def _query_values(hbn, labelsets, interval, test, threshold):
+    """Return whether any time-series matched 'labelsets' and the 'query'
+    rows found by testing every value of the matched time-series."""
+    selected = False
+    rows = []
+    for block, recnos in hbn.blocks().items():
+        if interval is not None and block[3] != interval2codemap[interval]:
+            continue
+        freq = None
+        for col, key in enumerate(
+            hbn.series_keys(block)[: int(hbn.numvals[recnos[0]])]
+        ):
+            if not _match_labelsets(labelsets, key):
+                continue
+            selected = True
+            (hits,) = np.nonzero(test(hbn.column(recnos, col), threshold))
+            if not len(hits):
+                continue
+            if freq is None:
+                freq = code2freqmap[block[3]] or _freq_from_dates(
+                    block[3], hbn.dates[recnos]
+                )
+            dates = hbn.dates[recnos[hits[[0, -1]]]]
+            rows.append(
+                key[:4]
+                + (code2intervalmap[key[4]], len(hits))
+                + (pd.Period(dates[0], freq=freq), pd.Period(dates[-1], freq=freq))
+            )
+    return selected, rows
+
+
+def _query_zones(hbn, zones, labelsets, interval, test, threshold, possible, certain):
+    """Return whether any time-series matched 'labelsets' and the 'query'
+    rows found with the zone maps, reading only the chunks that might match
+    without every value matching."""
+    # the zone maps are used in place of the record index of the file,
+    # so only the records of the chunks that might match are read
+    bounds = np.searchsorted(zones["series"], np.arange(len(zones["lue"]) + 1))
+    selected = []
+    for index, key in enumerate(
+        zip(
+            zones["optype"].tolist(),
+            zones["lue"].tolist(),
+            zones["group"].tolist(),
+            zones["variable"].tolist(),
+            zones["level"].tolist(),
+        )
+    ):
+        if interval is not None and key[4] != interval2codemap[interval]:
+            continue
+        if not _match_labelsets(labelsets, key):
+            continue
+        chunk = np.arange(bounds[index], bounds[index + 1])
+        lo = zones["minimum"][chunk]
+        hi = zones["maximum"][chunk]
+        count = zones["count"][chunk]
+        length = zones["stop"][chunk] - zones["start"][chunk]
+        maybe = (count > 0) & possible(lo, hi, threshold)
+        every = maybe & (count == length) & certain(lo, hi, threshold)
+        selected.append((index, key, chunk[maybe], every[maybe]))
+
+    index = _zone_record_index(
+        hbn,
+        (
+            (zones["first_offset"][i], zones["last_offset"][i])
+            for _, _, chunks, every in selected
+            for i in chunks[~every]
+        ),
+    )
+    rows = []
+    for series, key, chunks, every in selected:
+        matches = 0
+        dates = []
+        for i, sure in zip(chunks, every):
+            if sure:
+                matches += int(zones["stop"][i] - zones["start"][i])
+                dates.extend((zones["start_date"][i], zones["end_date"][i]))
+                continue
+            first = int(zones["first_offset"][i])
+            offsets = index[_series_id(hbn.u8, np.array([first])).tobytes()]
+            offsets = offsets[
+                np.searchsorted(offsets, first) : np.searchsorted(
+                    offsets, zones["last_offset"][i], side="right"
+                )
+            ]
+            values = _gather(
+                hbn.u8, offsets + 56 + 4 * int(zones["column"][series]), 4
+            ).view("<f4")[:, 0]
+            (hits,) = np.nonzero(test(values, threshold))
+            if len(hits):
+                matches += len(hits)
+                dates.extend(_gather_dates(hbn.u8, offsets[hits[[0, -1]]], key[4]))
+        if matches:
+            freq = zones["freq"][series]
+            rows.append(
+                key[:4]
+                + (code2intervalmap[key[4]], matches)
+                + (pd.Period(dates[0], freq=freq), pd.Period(dates[-1], freq=freq))
+            )
+    return bool(selected), rows
+
+
+@validate_call
+def query(
+    hbnfilename: str,
+    predicate: str,
+    *labels,
+    interval: Optional[Literal["yearly", "monthly", "daily", "bivl"]] = None,
+    label_file: Optional[str] = None,
+):
+    """Finds the time-series with values that match a predicate.
+
+    For example the predicate '>100' finds the time-series with any value
+    greater than 100 and '!=0' the time-series with any value that is not
+    zero.  If a zone map file written by the 'zonemap' command is up to
+    date, the chunks that cannot match are skipped and the chunks where
+    every value must match are counted from the zone maps, so only the
+    values of the other chunks are read.  Otherwise all of the values of
+    the matched time-series are read.
+
+    Parameters
+    ----------
+    ${hbnfilename}
+
+    predicate: str
+        One of '>', '>=', '<', '<=', '==', or '!=' followed by a number.
+
+    labels: str
+        [optional, default is all time-series]
+
+        The time-series to test, in the same
+        'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE' format as 'extract'.
+
+    interval: str
+        [optional, default is all intervals]
+
+        Only test the time-series of one of "yearly", "monthly", "daily",
+        or "bivl".
+
+    ${label_file}
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        One row for each time-series with a value that matches the
+        predicate, with the count of matching values and the first and last
+        dates of matching values."""
+    comparison, threshold = _parse_predicate(predicate)
+    test, possible, certain = _PREDICATES[comparison]
+    labels, labelids, labelfields = _parse_labels(
+        (labels + tuple(_read_label_file(label_file))) or [",,,"]
+    )
+
+    with HbnFile(hbnfilename) as hbn:
+        zones = _load_zone_maps(hbn)
+        if zones is None:
+            labelsets = _build_labelsets(labelids, labelfields, _label_vocabulary(hbn))
+            selected, rows = _query_values(hbn, labelsets, interval, test, threshold)
+        else:
+            vocabulary = [
+                set(zones[i].tolist()) for i in ("optype", "group", "variable")
+            ]
+            labelsets = _build_labelsets(labelids, labelfields, vocabulary)
+            selected, rows = _query_zones(
+                hbn, zones, labelsets, interval, test, threshold, possible, certain
+            )
+
+    if not selected:
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The label specifications below matched no time-series in the
+                binary file.
+
+                {[",".join("" if i is None else str(i) for i in label) for label in labels]}
+                """
+            )
+        )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "OPERATIONTYPE",
+            "ID",
+            "GROUP",
+            "VARIABLE",
+            "INTERVAL",
+            "COUNT",
+            "FIRST_DATE",
+            "LAST_DATE",
+        ],
+    )
+
+
+# the time-series of each file are the IDs of their keys, which are shared by
+# all of the files, and the periods are the same for all of the time-series of
+# an interval in a file
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS keys (
+    id INTEGER PRIMARY KEY,
+    optype TEXT NOT NULL,
+    lue INTEGER NOT NULL,
+    grp TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    UNIQUE (lue, optype, grp, variable, level)
+);
+CREATE INDEX IF NOT EXISTS keys_variable ON keys (variable);
+CREATE TABLE IF NOT EXISTS series (
+    key INTEGER NOT NULL,
+    file INTEGER NOT NULL,
+    PRIMARY KEY (key, file)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS series_file ON series (file);
+CREATE TABLE IF NOT EXISTS periods (
+    file INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    PRIMARY KEY (file, level)
+) WITHOUT ROWID;
+"""
+
+
+def _archive_database(database):
+    """Return a connection to the archive index 'database', creating the
+    tables if needed."""
+    connection = sqlite3.connect(database)
+    connection.executescript(_ARCHIVE_SCHEMA)
+    return connection
+
+
+def _index_file(path):
+    """Return the (optype, lue, group, variable, level) keys and the
+    (level, start, end) periods of the binary file 'path' for the archive
+    index, or the error if it cannot be read."""
+    stat = os.stat(path)
+    try:
+        frame, periods = _catalog_frame(path)
+    except (OSError, ValueError, IndexError, struct.error) as err:
+        return path, stat.st_size, stat.st_mtime_ns, [], [], _error_line(err)
+    keys = list(
+        zip(
+            *(
+                frame[i].tolist()
+                for i in ("OPERATIONTYPE", "ID", "GROUP", "VARIABLE", "LEVEL")
+            )
+        )
+    )
+    periods = [(level, str(start), str(end)) for level, (start, end) in periods.items()]
+    return path, stat.st_size, stat.st_mtime_ns, keys, periods, None
+
+
+@validate_call
+def index_archive(
+    directory: str,
+    database: Optional[str] = None,
+    pattern: str = "*.hbn",
+    workers: Optional[int] = None,
+):
+    """Catalogs every binary file in a directory tree into a database.
+
+    The catalog of each file matching 'pattern' in 'directory' and its
+    subdirectories is stored in a SQLite database with the size and
+    modification time of the file.  When run again only the new and
+    changed files are read, and the files that are gone are removed, so
+    the database can be kept up to date with an archive of model runs.
+    The files are read in parallel.  Use 'search' to find time-series in
+    the database.
+
+    Parameters
+    ----------
+    directory: str
+        The top directory of the archive.
+
+    database: str
+        [optional, default is 'hspfbintoolbox_index.sqlite' in 'directory']
+
+        The SQLite database file, which is created if it does not exist.
+
+    pattern: str
+        [optional, default is '*.hbn']
+
+        The glob that the names of the binary files match.
+
+    workers: int
+        [optional, default is the number of processors]
+
+        The number of processes that read the files.
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        The PATH, STATUS, and number of SERIES of each file that was
+        "added", "updated", "removed", or "failed" to be read, where the
+        error is recorded in the database and the file is not read again
+        until it changes."""
+    directory = os.path.realpath(directory)
+    if database is None:
+        database = os.path.join(directory, "hspfbintoolbox_index.sqlite")
+    paths = {}
+    for root, _, filenames in os.walk(directory):
+        for filename in fnmatch.filter(filenames, pattern):
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            paths[path] = (stat.st_size, stat.st_mtime_ns)
+
+    rows = []
+    with contextlib.closing(_archive_database(database)) as connection:
+        known = {
+            path: (fileid, (size, mtime_ns))
+            for fileid, path, size, mtime_ns in connection.execute(
+                "SELECT id, path, size, mtime_ns FROM files WHERE path >= ? AND path < ?",
+                (directory + os.sep, directory + chr(ord(os.sep) + 1)),
+            )
+        }
+        keyids = {
+            key[1:]: key[0]
+            for key in connection.execute(
+                "SELECT id, optype, lue, grp, variable, level FROM keys"
+            )
+        }
+        with connection:
+            for path in sorted(set(known) - set(paths)):
+                fileid = known[path][0]
+                for table in ("series", "periods"):
+                    connection.execute(f"DELETE FROM {table} WHERE file = ?", (fileid,))
+                connection.execute("DELETE FROM files WHERE id = ?", (fileid,))
+                rows.append((path, "removed", 0))
+
+        changed = sorted(
+            path
+            for path, source in paths.items()
+            if known.get(path, (0, None))[1] != source
+        )
+        if workers == 1 or len(changed) < 2:
+            executor = contextlib.nullcontext()
+            results = map(_index_file, changed)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(_index_file, changed, chunksize=8)
+        with executor:
+            for count, result in enumerate(results, 1):
+                path, size, mtime_ns, keys, periods, error = result
+                if path in known:
+                    fileid = known[path][0]
+                    for table in ("series", "periods"):
+                        connection.execute(
+                            f"DELETE FROM {table} WHERE file = ?", (fileid,)
+                        )
+                    connection.execute(
+                        "UPDATE files SET size = ?, mtime_ns = ?, error = ? WHERE id = ?",
+                        (size, mtime_ns, error, fileid),
+                    )
+                else:
+                    fileid = connection.execute(
+                        "INSERT INTO files (path, size, mtime_ns, error) VALUES (?, ?, ?, ?)",
+                        (path, size, mtime_ns, error),
+                    ).lastrowid
+                for key in keys:
+                    if key not in keyids:
+                        keyids[key] = connection.execute(
+                            "INSERT INTO keys (optype, lue, grp, variable, level) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            key,
+                        ).lastrowid
+                connection.executemany(
+                    "INSERT INTO series VALUES (?, ?)",
+                    ((keyids[key], fileid) for key in keys),
+                )
+                connection.executemany(
+                    "INSERT INTO periods VALUES (?, ?, ?, ?)",
+                    ((fileid,) + period for period in periods),
+                )
+                if error is not None:
+                    status = "failed"
+                else:
+                    status = "updated" if path in known else "added"
+                rows.append((path, status, len(keys)))
+                if count % 100 == 0:
+                    connection.commit()
+        connection.commit()
+    return pd.DataFrame(rows, columns=["PATH", "STATUS", "SERIES"])
+
+
+@validate_call
+def search(
+    database: str,
+    *labels,
+    interval: Optional[Literal["yearly", "monthly", "daily", "bivl"]] = None,
+    label_file: Optional[str] = None,
+):
+    """Finds the time-series in a database written by 'index_archive'.
+
+    The labels are matched using the indexes of the database, so the files
+    of a large archive that have a time-series are found without reading
+    any of the files.
+
+    Parameters
+    ----------
+    database: str
+        The SQLite database written by 'index_archive'.
+
+    labels: str
+        [optional, default is all time-series]
+
+        The time-series to find, in the same
+        'OPERATIONTYPE,ID,VARIABLEGROUP,VARIABLE' format as 'extract',
+        including the ID ranges and the name patterns.
+
+    interval: str
+        [optional, default is all intervals]
+
+        Only find the time-series of one of "yearly", "monthly", "daily",
+        or "bivl".
+
+    ${label_file}
+
+    ${tablefmt}
+
+    Returns
+    -------
+    DataFrame
+        The PATH of the file, and the OPERATIONTYPE, ID, GROUP, VARIABLE,
+        INTERVAL, START, and END of each matching time-series."""
+    if not os.path.exists(database):
+        raise ValueError(
+            tsutils.error_wrapper(
+                f"""
+                The database '{database}' does not exist.  Create it with
+                'index_archive'.
+                """
+            )
+        )
+    labels, labelids, labelfields = _parse_labels(
+        (labels + tuple(_read_label_file(label_file))) or [",,,"]
+    )
+    with contextlib.closing(_archive_database(database)) as connection:
+        vocabulary = [None, None, None]
+        clauses = []
+        parameters = []
+        for luelist, fields in zip(labelids, labelfields):
+            conditions = []
+            for column, (num, field) in zip(
+                ("optype", "grp", "variable"), enumerate(fields)
+            ):
+                if field is None:
+                    continue
+                if isinstance(field, re.Pattern) and vocabulary[num] is None:
+                    vocabulary[num] = {
+                        i
+                        for (i,) in connection.execute(
+                            f"SELECT DISTINCT {column} FROM keys"
+                        )
+                    }
+                names = _expand_label_pattern(field, vocabulary[num])
+                conditions.append(f"{column} IN ({', '.join('?' * len(names))})")
+                parameters.extend(names)
+            if None not in luelist:
+                conditions.append(f"lue IN ({', '.join('?' * len(luelist))})")
+                parameters.extend(luelist)
+            clauses.append(" AND ".join(conditions) or "1")
+        where = " OR ".join(f"({i})" for i in clauses)
+        if interval is not None:
+            where = f"({where}) AND keys.level = ?"
+            parameters.append(interval2codemap[interval])
+        rows = connection.execute(
+            "SELECT path, optype, lue, grp, variable, keys.level, start_date, "
+            "end_date FROM keys JOIN series ON series.key = keys.id "
+            "JOIN files ON files.id = series.file "
+            "JOIN periods ON periods.file = series.file AND periods.level = keys.level "
+            f"WHERE {where} ORDER BY path, optype, lue, grp, variable, keys.level",
+            parameters,
+        ).fetchall()
+    return pd.DataFrame(
+        [row[:5] + (code2intervalmap[row[5]],) + row[6:] for row in rows],
+        columns=[
+            "PATH",
+            "OPERATIONTYPE",
+            "ID",
+            "GROUP",
+            "VARIABLE",
+            "INTERVAL",
+            "START",
+            "END",
+        ],
+    )
+
+
+_hbnfile_cache = {}
+_hbnfile_cache_lock = threading.Lock()
+
+
+def _acquire_hbnfile(hbnfilename):
+    """Return a shared HbnFile for 'hbnfilename'.
+
+    Every call must be paired with '_release_hbnfile'.  The file is shared
+    as long as it has the same size and modification time.
+    """
+    stat = os.stat(hbnfilename)
+    key = (os.path.realpath(hbnfilename), stat.st_size, stat.st_mtime_ns)
+    with _hbnfile_cache_lock:
+        if key not in _hbnfile_cache:
+            _hbnfile_cache[key] = [HbnFile(hbnfilename), 0]
+        _hbnfile_cache[key][1] += 1
+        return _hbnfile_cache[key][0]
+
+
+def _release_hbnfile(hbn):
+    """Release an HbnFile from '_acquire_hbnfile'."""
+    with _hbnfile_cache_lock:
+        for key, entry in list(_hbnfile_cache.items()):
+            if entry[0] is hbn:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _hbnfile_cache[key]
+                    hbn.close()
+                return
+
+
+_async_executor = None
+
+
+def _default_async_executor():
+    """Return the bounded thread pool shared by all AsyncHbnFile."""
+    global _async_executor
+    with _hbnfile_cache_lock:
+        if _async_executor is None:
+            _async_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(4, os.cpu_count() or 1),
+                thread_name_prefix="hspfbintoolbox",
+            )
+    return _async_executor
+
+
+class AsyncHbnFile:
+    """Asyncio interface to an HSPF binary output file.
+
+    The file is opened, and the decoding is done, in an executor so that the
+    event loop is not blocked.  All AsyncHbnFile instances for the same file
+    share one HbnFile, so the headers and record arrays are only parsed
+    once.
+
+    Use as::
+
+        async with AsyncHbnFile("test.hbn") as hbn:
+            result = await hbn.extract("daily", "RCHRES,1,HYDR,RO")
+            async for chunk in hbn.iter_records():
+                ...
+
+    Cancelling a task awaiting 'extract' or 'catalog' stops the decoding
+    at the next block of records.
+
+    Parameters
+    ----------
+    hbnfilename: str
+        The HSPF binary output file.
+    executor: concurrent.futures.Executor
+        [optional, default is a shared pool of up to 4 threads]
+
+        Executor that runs 'extract' and 'catalog'.  With a
+        concurrent.futures.ProcessPoolExecutor each call reads the file in
+        the worker process, and a call can only be cancelled before it
+        starts.  The file is always opened, and 'iter_records' decoded, in
+        the shared thread pool.
+    """
+
+    def __init__(self, hbnfilename, executor=None):
+        self.filename = hbnfilename
+        self._threads = _default_async_executor()
+        self._executor = executor or self._threads
+        self._processes = isinstance(
+            self._executor, concurrent.futures.ProcessPoolExecutor
+        )
+        self._hbn = None
+
+    async def _run(self, func, *args, executor=None, **kwds):
+        """Run 'func' in the executor, setting 'cancel' if cancelled."""
+        executor = executor or self._threads
+        cancel = threading.Event()
+        if executor is self._threads:
+            kwds["cancel"] = cancel
+        future = asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(func, *args, **kwds)
+        )
+        try:
+            return await future
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+
+    async def __aenter__(self):
+        self._hbn = await asyncio.get_running_loop().run_in_executor(
+            self._threads, self._open
+        )
+        return self
+
+    def _open(self):
+        hbn = _acquire_hbnfile(self.filename)
+        try:
+            # parse the header directory once for every user of the file
+            hbn.load(headers=True)
+        except Exception:
+            _release_hbnfile(hbn)
+            raise
+        return hbn
+
+    async def __aexit__(self, *args):
+        if self._hbn is not None:
+            _release_hbnfile(self._hbn)
+            self._hbn = None
+
+    async def extract(
+        self, interval, *labels, start_date=None, end_date=None, sort_columns=False
+    ):
+        """Return the time-series matching 'labels', see 'extract'."""
+        if self._processes:
+            return await self._run(
+                extract,
+                self.filename,
+                interval,
+                *labels,
+                start_date=start_date,
+                end_date=end_date,
+                sort_columns=sort_columns,
+                executor=self._executor,
+            )
+        return await self._run(
+            _extract,
+            self._hbn,
+            interval.lower(),
+            labels,
+            start_date=start_date,
+            end_date=end_date,
+            sort_columns=sort_columns,
+            executor=self._executor,
+        )
+
+    async def catalog(self):
+        """Return the catalog of the file, see 'catalog'."""
+        if self._processes:
+            return await self._run(catalog, self.filename, executor=self._executor)
+        return await self._run(_catalog, self._hbn, executor=self._executor)
+
+    async def iter_records(self, chunk_size=10000):
+        """Asynchronously iterate over the data records in chunks.
+
+        Each chunk is a list of up to 'chunk_size' tuples of (optype, lue,
+        group, level, date, names, values) in file order, decoded in the
+        executor.
+        """
+        # finding the records cannot be interrupted, so there is no 'cancel'
+        recnos = await asyncio.get_running_loop().run_in_executor(
+            self._threads, _data_recnos, self._hbn
+        )
+        for start in range(0, len(recnos), chunk_size):
+            yield await self._run(
+                _decode_records, self._hbn, recnos[start : start + chunk_size]
+            )
+
+
+def _server_state_file():
+    """Return the file that records the address of the running server.
+
+    The file is in a directory of the user, $XDG_RUNTIME_DIR or
+    ~/.cache/hspfbintoolbox, rather than the shared temporary directory
+    where another user could write it first.
+    """
+    state_file = os.environ.get("HSPFBINTOOLBOX_SERVER_FILE")
+    if state_file:
+        return state_file
+    directory = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "hspfbintoolbox"
+    )
+    return os.path.join(directory, "hspfbintoolbox-server.json")
+
+
+def _read_server_state(state_file):
+    """Return the contents of the server 'state_file'.
+
+    Raises ValueError if the file is not owned by the user or can be read
+    by others, since the server it names would be sent the requests.
+    """
+    with open(state_file) as fpi:
+        stat = os.fstat(fpi.fileno())
+        if hasattr(os, "getuid") and (
+            stat.st_uid != os.getuid() or stat.st_mode & 0o777 != 0o600
+        ):
+            raise ValueError(f"The server file {state_file} is not private.")
+        return json.load(fpi)
+
+
+class _ServerHandler(http.server.BaseHTTPRequestHandler):
+    """Answer the JSON requests forwarded by the command line client."""
+
+    def do_POST(self):
+        token = self.headers.get("X-Hspfbintoolbox-Token", "")
+        if not secrets.compare_digest(token.encode(), self.server.token.encode()):
+            self.send_error(403)
+            return
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        try:
+            response = self.server.run(self.path.strip("/"), request)
+            status = 200
+        except Exception as err:
+            response = {"error": str(err)}
+            status = 400
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    """Local server that keeps an HbnFile open for each file requested."""
+
+    daemon_threads = True
+
+    def __init__(self, address, token):
+        super().__init__(address, _ServerHandler)
+        self.token = token
+        self.files = {}
+        self.files_lock = threading.Lock()
+
+    def hbnfile(self, hbnfilename):
+        """Return the open HbnFile, reopening it if the file has changed."""
+        stat = os.stat(hbnfilename)
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self.files_lock:
+            if hbnfilename in self.files and self.files[hbnfilename][0] != key:
+                _release_hbnfile(self.files.pop(hbnfilename)[1])
+            if hbnfilename not in self.files:
+                self.files[hbnfilename] = (key, _acquire_hbnfile(hbnfilename))
+            return self.files[hbnfilename][1]
+
+    def run(self, command, request):
+        if command == "extract":
+            interval = request["interval"].lower()
+            if interval not in interval2codemap:
+                raise ValueError(
+                    tsutils.error_wrapper(
+                        f"""
+                        The "interval" argument must be one of "bivl",
+                        "daily", "monthly", or "yearly".  You supplied
+                        "{interval}".
+                        """
+                    )
+                )
+            # the warnings are returned for the client to write
+            stderr = io.StringIO()
+            result = _extract(
+                self.hbnfile(request["hbnfilename"]),
+                interval,
+                request["labels"],
+                start_date=request["start_date"],
+                end_date=request["end_date"],
+                sort_columns=request["sort_columns"],
+                stderr=stderr,
+            )
+            return {
+                "columns": list(result.columns),
+                "index": [str(i) for i in result.index],
+                "freq": result.index.freqstr,
+                "data": result.to_numpy().tolist(),
+                "warnings": stderr.getvalue(),
+            }
+        if command == "catalog":
+            return [
+                list(row[:5]) + [str(row[5]), str(row[6]), row[5].freqstr, row[7]]
+                for row in _catalog(self.hbnfile(request["hbnfilename"]))
+            ]
+        if command == "ping":
+            return {}
+        if command == "shutdown":
+            threading.Thread(target=self.shutdown).start()
+            return {}
+        raise ValueError(f"Unknown command '{command}'.")
+
+    def server_close(self):
+        super().server_close()
+        with self.files_lock:
+            for _, hbn in self.files.values():
+                _release_hbnfile(hbn)
+            self.files = {}
+
+
+# Seconds to wait for the server to answer a ping before reading the file
+# directly.
+_SERVER_TIMEOUT = 5
+
+
+def _server_post(state, command, request, timeout=None):
+    """Return the status and JSON response of 'command' sent to the server
+    at the address in 'state'."""
+    connection = http.client.HTTPConnection(
+        state["host"], state["port"], timeout=timeout
+    )
+    try:
+        connection.request(
+            "POST",
+            f"/{command}",
+            body=json.dumps(request),
+            headers={
+                "Content-Type": "application/json",
+                "X-Hspfbintoolbox-Token": state["token"],
+            },
+        )
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def _server_request(command, request):
+    """Forward a request to the running server.
+
+    Returns None if there isn't a server running, if it does not answer a
+    ping within _SERVER_TIMEOUT seconds, or if the environment variable
+    HSPFBINTOOLBOX_NO_SERVER is set.  The request itself is waited for
+    however long it takes, since the server may be reading a large file.
+    """
+    if os.environ.get("HSPFBINTOOLBOX_NO_SERVER"):
+        return None
+    try:
+        state = _read_server_state(_server_state_file())
+        status, _ = _server_post(state, "ping", {}, timeout=_SERVER_TIMEOUT)
+        if status != 200:
+            return None
+        status, result = _server_post(state, command, request)
+    except (OSError, ValueError, KeyError):
+        # no server, an old or untrusted state file, or a ping timeout,
+        # which is an OSError
+        return None
+    if status != 200:
+        raise ValueError(result.get("error", f"Server returned status {status}."))
+    return result
+
+
+@validate_call
+def serve(port: int = 0, host: str = "127.0.0.1", stop: bool = False):
+    """Starts a local server that keeps HSPF binary files open.
+
+    While the server is running the 'extract' and 'catalog' commands
+    forward their requests to it.  The server keeps each file that has been
+    requested open, with the record arrays and headers already parsed, so
+    repeated requests do not read the file again.  The address of the server
+    is kept in a file only the user can read, in $XDG_RUNTIME_DIR or
+    ~/.cache/hspfbintoolbox, or in the file named by the environment
+    variable HSPFBINTOOLBOX_SERVER_FILE.  Set the
+    environment variable HSPFBINTOOLBOX_NO_SERVER to have the commands read
+    the file directly.
+
+    Parameters
+    ----------
+    port: int
+        [optional, default is 0]
+
+        The port to listen on.  The default of 0 picks any free port.
+
+    host: str
+        [optional, default is "127.0.0.1"]
+
+        The address to listen on.
+
+    stop: bool
+        [optional, default is False]
+
+        Stop the running server instead of starting a new one."""
+    if stop:
+        _server_request("shutdown", {})
+        return
+    server = _Server((host, port), secrets.token_hex(16))
+    state_file = _server_state_file()
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), 0o700, exist_ok=True)
+    # a new file, so that one made by someone else or a link isn't written
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(state_file)
+    fd = os.open(state_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as fpo:
+        json.dump(
+            {
+                "host": server.server_address[0],
+                "port": server.server_address[1],
+                "token": server.token,
+                "pid": os.getpid(),
+            },
+            fpo,
+        )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        with contextlib.suppress(OSError, ValueError):
+            with open(state_file) as fpi:
+                mine = json.load(fpi)["token"] == server.token
+            if mine:
+                os.remove(state_file)
+
+
+@program.command()
+def about():
+    """Display version number and system information."""
+    tsutils.about(__name__)
+
+
+def main():
+    if not os.path.exists("debug_hspfbintoolbox"):
+        sys.tracebacklimit = 0
+
+    import cltoolbox
+
+    from .toolbox_utils.src.toolbox_utils import tsutils
+
+    @cltoolbox.command("about", formatter_class=RSTHelpFormatter)
+    @tsutils.copy_doc(about)
+    def about_cli():
+        """docstring replaced by tsutils.copy_doc"""
+        import pprint
+
+        pprint.pprint(tsutils.about(__name__))
+
+    @cltoolbox.command("extract", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
     @tsutils.copy_doc(extract)
     def _extract_cli(
         hbnfilename,
@@ -553,18 +4653,55 @@ def main():
         start_date=None,
         end_date=None,
         sort_columns=False,
+        label_file=None,
+        memory_budget=None,
+        tail=None,
+        weights_file=None,
+        expr=None,
         *labels,
     ):
-        tsutils.printiso(
-            extract(
+        labels = list(labels) + _read_label_file(label_file)
+        result = None
+        if (
+            memory_budget is None
+            and tail is None
+            and weights_file is None
+            and expr is None
+        ):
+            # a budgeted extract would be held in memory by the server
+            result = _server_request(
+                "extract",
+                {
+                    "hbnfilename": os.path.abspath(hbnfilename),
+                    "interval": interval,
+                    "labels": labels,
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "sort_columns": sort_columns,
+                },
+            )
+        if result is None:
+            result = extract(
                 hbnfilename,
                 interval,
                 *labels,
                 start_date=start_date,
                 end_date=end_date,
                 sort_columns=sort_columns,
+                memory_budget=memory_budget,
+                last_n=tail,
+                weights_file=weights_file,
+                expr=expr,
             )
-        )
+        else:
+            sys.stderr.write(result["warnings"])
+            result = pd.DataFrame(
+                result["data"],
+                index=pd.PeriodIndex(result["index"], freq=result["freq"]),
+                columns=result["columns"],
+            )
+            result.index.name = "Datetime"
+        tsutils.printiso(result)
 
     @cltoolbox.command("catalog", formatter_class=RSTHelpFormatter)
     @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
@@ -572,10 +4709,188 @@ def main():
     def _catalog_cli(hbnfilename, tablefmt="simple", header="default"):
         if header == "default":
             header = ["LUE", "LC", "GROUP", "VAR", "TC", "START", "END", "TC"]
+        result = _server_request(
+            "catalog", {"hbnfilename": os.path.abspath(hbnfilename)}
+        )
+        if tablefmt in _TABLE_FORMATS and isinstance(header, list):
+            # written a column at a time rather than with tabulate
+            if result is None:
+                frame = catalog(hbnfilename, as_frame=True)
+                columns = [
+                    (frame[i].to_numpy(), i in ("ID", "LEVEL")) for i in frame.columns
+                ]
+            else:
+                columns = [
+                    (values, i in (1, 4))
+                    for i, values in enumerate(zip(*result))
+                    if i != 7
+                ]
+            _write_table(columns, header, tablefmt)
+            return
+        if result is None:
+            result = catalog(hbnfilename)
+        else:
+            result = [
+                tuple(row[:5])
+                + (pd.Period(row[5], freq=row[7]), pd.Period(row[6], freq=row[7]))
+                + (row[8],)
+                for row in result
+            ]
+        tsutils.printiso(result, tablefmt=tablefmt, headers=header, showindex=False)
+
+    @cltoolbox.command("diff", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(diff)
+    def _diff_cli(
+        hbnfilename,
+        candidate_hbnfilename,
+        tolerance=0.0,
+        stop_on_first=False,
+        tablefmt="csv",
+    ):
+        tsutils.printiso(
+            diff(
+                hbnfilename,
+                candidate_hbnfilename,
+                tolerance=tolerance,
+                stop_on_first=stop_on_first,
+            ),
+            tablefmt=tablefmt,
+            showindex=False,
+        )
+
+    @cltoolbox.command("ensemble", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(ensemble)
+    def _ensemble_cli(
+        hbnfilenames,
+        interval,
+        statistics="mean,std,min,max",
+        percentiles="5,50,95",
+        start_date=None,
+        end_date=None,
+        label_file=None,
+        tablefmt="csv",
+        *labels,
+    ):
+        tsutils.printiso(
+            ensemble(
+                hbnfilenames,
+                interval,
+                *labels,
+                statistics=tsutils.make_list(statistics) or [],
+                percentiles=tsutils.make_list(percentiles) or [],
+                start_date=start_date,
+                end_date=end_date,
+                label_file=label_file,
+            ),
+            tablefmt=tablefmt,
+        )
+
+    @cltoolbox.command("nday", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(nday)
+    def _nday_cli(
+        hbnfilename,
+        window=7,
+        interval="daily",
+        statistics="min",
+        start_month=1,
+        label_file=None,
+        tablefmt="csv",
+        *labels,
+    ):
+        tsutils.printiso(
+            nday(
+                hbnfilename,
+                *labels,
+                window=window,
+                interval=interval,
+                statistics=tsutils.make_list(statistics),
+                start_month=start_month,
+                label_file=label_file,
+            ),
+            tablefmt=tablefmt,
+        )
+
+    @cltoolbox.command("validate", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(validate)
+    def _validate_cli(hbnfilename, tablefmt="simple"):
+        issues = validate(hbnfilename)
+        if len(issues):
+            tsutils.printiso(issues, tablefmt=tablefmt, showindex=False)
+            sys.exit(1)
+
+    @cltoolbox.command("zonemap", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(zonemap)
+    def _zonemap_cli(hbnfilename, chunk_size=_ZONE_CHUNK_SIZE, tablefmt="csv"):
+        tsutils.printiso(
+            zonemap(hbnfilename, chunk_size=chunk_size),
+            tablefmt=tablefmt,
+            showindex=False,
+        )
+
+    @cltoolbox.command("query", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(query)
+    def _query_cli(
+        hbnfilename,
+        predicate,
+        interval=None,
+        label_file=None,
+        tablefmt="csv",
+        *labels,
+    ):
+        tsutils.printiso(
+            query(
+                hbnfilename,
+                predicate,
+                *labels,
+                interval=interval,
+                label_file=label_file,
+            ),
+            tablefmt=tablefmt,
+            showindex=False,
+        )
+
+    @cltoolbox.command("index-archive", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(index_archive)
+    def _index_archive_cli(
+        directory, database=None, pattern="*.hbn", workers=None, tablefmt="csv"
+    ):
         tsutils.printiso(
-            catalog(hbnfilename), tablefmt=tablefmt, headers=header, showindex=False
+            index_archive(
+                directory, database=database, pattern=pattern, workers=workers
+            ),
+            tablefmt=tablefmt,
+            showindex=False,
         )
 
+    @cltoolbox.command("search", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(search)
+    def _search_cli(
+        database,
+        interval=None,
+        label_file=None,
+        tablefmt="csv",
+        *labels,
+    ):
+        tsutils.printiso(
+            search(database, *labels, interval=interval, label_file=label_file),
+            tablefmt=tablefmt,
+            showindex=False,
+        )
+
+    @cltoolbox.command("serve", formatter_class=RSTHelpFormatter)
+    @tsutils.doc({**tsutils.docstrings, **_LOCAL_DOCSTRINGS})
+    @tsutils.copy_doc(serve)
+    def _serve_cli(port=0, host="127.0.0.1", stop=False):
+        serve(port=port, host=host, stop=stop)
+
     cltoolbox.main()
 
 
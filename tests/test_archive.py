@@ -0,0 +1,111 @@
+"""
+index_archive and search
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.runs = os.path.join(self.tmpdir.name, "runs")
+        os.makedirs(os.path.join(self.runs, "calibration"))
+        for name in ("data_multi.hbn", "data_yearly.hbn"):
+            shutil.copy(f"tests/{name}", os.path.join(self.runs, name))
+        shutil.copy(
+            "tests/data_daily.hbn", os.path.join(self.runs, "calibration", "run1.hbn")
+        )
+        self.database = os.path.join(self.tmpdir.name, "index.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, *names):
+        return os.path.join(os.path.realpath(self.runs), *names)
+
+    def test_index_archive(self):
+        out = hspfbintoolbox.index_archive(self.runs, database=self.database, workers=1)
+        self.assertEqual(
+            list(zip(out["PATH"], out["STATUS"], out["SERIES"])),
+            [
+                (self.path("calibration", "run1.hbn"), "added", 7),
+                (self.path("data_multi.hbn"), "added", 30),
+                (self.path("data_yearly.hbn"), "added", 2160),
+            ],
+        )
+        # nothing changed
+        out = hspfbintoolbox.index_archive(self.runs, database=self.database)
+        self.assertEqual(len(out), 0)
+
+        os.remove(self.path("data_yearly.hbn"))
+        shutil.copy("tests/data_collide.hbn", self.path("calibration", "run1.hbn"))
+        with open(self.path("notes.hbn"), "w") as fpo:
+            fpo.write("not a binary file")
+        out = hspfbintoolbox.index_archive(self.runs, database=self.database)
+        self.assertEqual(
+            list(zip(out["PATH"], out["STATUS"], out["SERIES"])),
+            [
+                (self.path("data_yearly.hbn"), "removed", 0),
+                (self.path("calibration", "run1.hbn"), "updated", 27),
+                (self.path("notes.hbn"), "failed", 0),
+            ],
+        )
+
+    def test_search(self):
+        hspfbintoolbox.index_archive(self.runs, database=self.database)
+        out = hspfbintoolbox.search(self.database, "RCHRES,,HYDR,RO", interval="daily")
+        self.assertEqual(
+            list(zip(out["PATH"], out["ID"], out["START"], out["END"])),
+            [
+                (self.path("calibration", "run1.hbn"), 1, "1999-01-01", "2001-12-31"),
+                (self.path("calibration", "run1.hbn"), 2, "1999-01-01", "2001-12-31"),
+                (self.path("data_multi.hbn"), 1, "1999-01-01", "2000-12-31"),
+            ],
+        )
+        # the same rows as the catalog of each file
+        out = hspfbintoolbox.search(self.database)
+        for path in ("data_multi.hbn", "data_yearly.hbn"):
+            rows = out[out["PATH"] == self.path(path)]
+            self.assertEqual(
+                [
+                    (optype, lue, group, variable, hspfbintoolbox.interval2codemap[i])
+                    for optype, lue, group, variable, i in zip(
+                        rows["OPERATIONTYPE"],
+                        rows["ID"],
+                        rows["GROUP"],
+                        rows["VARIABLE"],
+                        rows["INTERVAL"],
+                    )
+                ],
+                [i[:5] for i in hspfbintoolbox.catalog(self.path(path))],
+            )
+        out = hspfbintoolbox.search(self.database, "PERLND,904:905,,re:AGW.")
+        self.assertEqual(set(out["VARIABLE"]), {"AGWI", "AGWO", "AGWS"})
+        self.assertEqual(set(out["ID"]), {904, 905})
+
+    def test_search_no_database(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox.search(self.database, ",,,")
+
+    def test_search_cli(self):
+        hspfbintoolbox.index_archive(self.runs, database=self.database)
+        args = f"hspfbintoolbox search {self.database} RCHRES,1,,VOL"
+        out = subprocess.Popen(
+            shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+        ).communicate()[0]
+        lines = out.splitlines()
+        self.assertEqual(
+            lines[0], b"PATH,OPERATIONTYPE,ID,GROUP,VARIABLE,INTERVAL,START,END"
+        )
+        # the header, the daily RCHRES 1 VOL of run1, and the three of data_multi
+        self.assertEqual(len(lines), 5)
@@ -0,0 +1,114 @@
+"""
+AsyncHbnFile
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from unittest import TestCase
+
+from pandas.testing import assert_frame_equal
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestAsyncHbnFile(TestCase):
+    def test_extract(self):
+        async def run():
+            async with hspfbintoolbox.AsyncHbnFile("tests/data_yearly.hbn") as hbn:
+                return await hbn.extract("yearly", ",905,,AGWS")
+
+        assert_frame_equal(
+            asyncio.run(run()),
+            hspfbintoolbox.extract("tests/data_yearly.hbn", "yearly", ",905,,AGWS"),
+        )
+
+    def test_concurrent_share_hbnfile(self):
+        async def one(label):
+            async with hspfbintoolbox.AsyncHbnFile("tests/data_multi.hbn") as hbn:
+                return hbn._hbn, await hbn.extract("monthly", label)
+
+        async def run():
+            return await asyncio.gather(
+                one("PERLND,101,,"), one("PERLND,102,,"), one("RCHRES,1,,")
+            )
+
+        results = asyncio.run(run())
+        self.assertTrue(all(hbn is results[0][0] for hbn, _ in results))
+        for label, (_, result) in zip(
+            ["PERLND,101,,", "PERLND,102,,", "RCHRES,1,,"], results
+        ):
+            assert_frame_equal(
+                result,
+                hspfbintoolbox.extract("tests/data_multi.hbn", "monthly", label),
+            )
+        self.assertEqual(hspfbintoolbox._hbnfile_cache, {})
+
+    def test_iter_records(self):
+        async def run():
+            count = 0
+            async with hspfbintoolbox.AsyncHbnFile("tests/data_yearly.hbn") as hbn:
+                async for chunk in hbn.iter_records(chunk_size=1000):
+                    self.assertLessEqual(len(chunk), 1000)
+                    count += len(chunk)
+            return count
+
+        self.assertEqual(asyncio.run(run()), 6222)
+
+    def test_cancel(self):
+        # hold the decoding in the first block until the task is cancelled,
+        # then check that it stopped at the next block
+        match_labelsets = hspfbintoolbox._match_labelsets
+        get_data = hspfbintoolbox._get_data
+        started = threading.Event()
+        release = threading.Event()
+        finished = threading.Event()
+        matched = []
+        outcome = []
+
+        def held_match_labelsets(labelsets, key):
+            matched.append(key)
+            started.set()
+            release.wait(10)
+            return match_labelsets(labelsets, key)
+
+        def recorded_get_data(*args, **kwds):
+            try:
+                return get_data(*args, **kwds)
+            except BaseException as err:
+                outcome.append(err)
+                raise
+            finally:
+                finished.set()
+
+        async def run():
+            async with hspfbintoolbox.AsyncHbnFile("tests/data_yearly.hbn") as hbn:
+                task = asyncio.ensure_future(hbn.extract("yearly", ",,,"))
+                await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+                task.cancel()
+                release.set()
+                # the file is used until the decoding stops
+                await asyncio.get_running_loop().run_in_executor(
+                    None, finished.wait, 10
+                )
+                await task
+
+        try:
+            hspfbintoolbox._match_labelsets = held_match_labelsets
+            hspfbintoolbox._get_data = recorded_get_data
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(run())
+        finally:
+            hspfbintoolbox._match_labelsets = match_labelsets
+            hspfbintoolbox._get_data = get_data
+            release.set()
+        self.assertEqual(len(outcome), 1)
+        self.assertIsInstance(outcome[0], concurrent.futures.CancelledError)
+        with hspfbintoolbox.HbnFile("tests/data_yearly.hbn") as hbn:
+            blocks = hbn.blocks()
+            first = next(iter(blocks))
+            self.assertEqual(len(matched), int(hbn.numvals[blocks[first][0]]))
+            self.assertLess(len(matched), len(hspfbintoolbox.catalog(hbn.filename)))
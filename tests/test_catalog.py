@@ -2238,3 +2238,52 @@ PERLND, 905,PWATER ,UZS  ,   5,1950   ,2000 ,yearly
             args, stdout=subprocess.PIPE, stdin=subprocess.PIPE
         ).communicate()[0]
         self.assertEqual(out, self.catalog)
+
+    def test_catalog_as_frame_api(self):
+        out = hspfbintoolbox.catalog("tests/data_yearly.hbn", as_frame=True)
+        self.assertEqual(
+            list(out.columns),
+            [
+                "OPERATIONTYPE",
+                "ID",
+                "GROUP",
+                "VARIABLE",
+                "LEVEL",
+                "START",
+                "END",
+                "INTERVAL",
+            ],
+        )
+        self.assertEqual(out["VARIABLE"].dtype, "category")
+        self.assertEqual(
+            list(
+                zip(
+                    out["OPERATIONTYPE"],
+                    out["ID"],
+                    out["GROUP"],
+                    out["VARIABLE"],
+                    out["LEVEL"],
+                )
+            ),
+            self.ncatalog,
+        )
+        self.assertEqual(set(out["START"]), {"1950"})
+
+    def test_catalog_formats_cli(self):
+        # the same layout as tsutils.printiso for every format written directly
+        result = hspfbintoolbox.catalog("tests/data_multi.hbn")
+        header = ["LUE", "LC", "GROUP", "VAR", "TC", "START", "END", "TC"]
+        for tablefmt in hspfbintoolbox._TABLE_FORMATS:
+            args = f"hspfbintoolbox catalog --tablefmt {tablefmt} tests/data_multi.hbn"
+            out = subprocess.Popen(
+                shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+            ).communicate()[0]
+            expected = capture(
+                hspfbintoolbox.tsutils.printiso,
+                result,
+                tablefmt=tablefmt,
+                headers=header,
+                showindex=False,
+            )
+            sys.stdout = sys.__stdout__
+            self.assertEqual(out, expected)
@@ -0,0 +1,94 @@
+"""
+diff
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import datetime
+import os
+import shlex
+import shutil
+import struct
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from pandas.testing import assert_frame_equal
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestDiff(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.candidate = os.path.join(self.tmpdir, "candidate.hbn")
+        shutil.copyfile("tests/data_yearly.hbn", self.candidate)
+        # The second record of the file is the 1950 data record for PERLND
+        # 411 PWATER.  Change the first value of the 1951 record after it.
+        with open(self.candidate, "r+b") as fp:
+            fp.seek(411 + 4 + 24 + 28)
+            (val,) = struct.unpack("f", fp.read(4))
+            fp.seek(-4, 1)
+            fp.write(struct.pack("f", val + 2.0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_diff_same_api(self):
+        out = hspfbintoolbox.diff("tests/data_yearly.hbn", "tests/data_yearly.hbn")
+        self.assertEqual(len(out), len(hspfbintoolbox.catalog("tests/data_yearly.hbn")))
+        self.assertTrue((out["MAX_ABS_DIFF"] == 0).all())
+        self.assertTrue((out["MISSING"] == 0).all())
+        self.assertTrue(out["FIRST_DIFF_DATE"].isna().all())
+
+    def test_diff_changed_api(self):
+        out = hspfbintoolbox.diff("tests/data_yearly.hbn", self.candidate)
+        changed = out[out["MAX_ABS_DIFF"] > 0]
+        self.assertEqual(len(changed), 1)
+        changed = changed.iloc[0]
+        self.assertEqual(changed["OPERATIONTYPE"], "PERLND")
+        self.assertEqual(changed["ID"], 411)
+        self.assertEqual(changed["COUNT"], 51)
+        self.assertAlmostEqual(changed["MAX_ABS_DIFF"], 2.0, places=4)
+        self.assertEqual(changed["FIRST_DIFF_DATE"], datetime.datetime(1951, 12, 31))
+
+    def test_diff_tolerance_api(self):
+        out = hspfbintoolbox.diff(
+            "tests/data_yearly.hbn", self.candidate, tolerance=2.5
+        )
+        self.assertTrue(out["FIRST_DIFF_DATE"].isna().all())
+
+    def test_diff_stop_on_first_api(self):
+        out = hspfbintoolbox.diff(
+            "tests/data_yearly.hbn", self.candidate, stop_on_first=True
+        )
+        self.assertEqual(out["COUNT"].max(), 2)
+
+    def test_diff_chunks_api(self):
+        expected = hspfbintoolbox.diff("tests/data_multi.hbn", "tests/data_daily.hbn")
+        segments = hspfbintoolbox._diff_segments
+        scan = hspfbintoolbox.HbnFile._scan
+
+        def fail(hbn):
+            raise AssertionError("the record index was built")
+
+        try:
+            # records are held across chunks until matched in the other file
+            hspfbintoolbox._diff_segments = lambda hbn: segments(hbn, chunk=97)
+            hspfbintoolbox.HbnFile._scan = fail
+            out = hspfbintoolbox.diff("tests/data_multi.hbn", "tests/data_daily.hbn")
+        finally:
+            hspfbintoolbox._diff_segments = segments
+            hspfbintoolbox.HbnFile._scan = scan
+        assert_frame_equal(out, expected)
+        self.assertGreater(out["MISSING"].sum(), 0)
+
+    def test_diff_cli(self):
+        args = f"hspfbintoolbox diff tests/data_yearly.hbn {self.candidate}"
+        out = subprocess.Popen(
+            shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+        ).communicate()[0]
+        lines = out.decode().splitlines()
+        self.assertTrue(lines[0].startswith("OPERATIONTYPE,ID,GROUP,VARIABLE"))
+        self.assertEqual(sum(",1951-12-31" in line for line in lines), 1)
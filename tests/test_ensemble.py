@@ -0,0 +1,116 @@
+"""
+ensemble
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import os
+import shlex
+import subprocess
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestEnsemble(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filenames = [
+            os.path.join(self.tmpdir.name, f"run{i}.hbn") for i in range(3)
+        ]
+        with open("tests/data_multi.hbn", "rb") as fpi:
+            data = bytearray(fpi.read())
+        with hspfbintoolbox.HbnFile("tests/data_multi.hbn") as hbn:
+            block = (b"RCHRES", 1, b"HYDR", 3)
+            column = hbn.vnames[block[:3]].index("RO")
+            starts = hbn.offset[hbn.blocks()[block]] + 56 + 4 * column
+        values = np.array([np.frombuffer(data, "<f4", 1, i)[0] for i in starts])
+        # scale the daily RO of RCHRES 1 in each run
+        for scale, filename in zip((1, 2, 4), self.filenames):
+            for start, value in zip(starts.tolist(), values):
+                data[start : start + 4] = np.float32(value * scale).tobytes()
+            with open(filename, "wb") as fpo:
+                fpo.write(data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ensemble(self):
+        result = hspfbintoolbox.ensemble(
+            self.filenames, "daily", ",1,,RO", percentiles=[0, 50, 75]
+        )
+        daily = hspfbintoolbox.extract("tests/data_multi.hbn", "daily", ",1,,RO")
+        self.assertTrue(result.index.equals(daily.index))
+        runs = np.stack([daily.iloc[:, 0].values * i for i in (1, 2, 4)])
+        for name, expected in (
+            ("mean", runs.mean(axis=0)),
+            ("std", runs.std(axis=0, ddof=1)),
+            ("min", runs.min(axis=0)),
+            ("max", runs.max(axis=0)),
+            ("p0", runs.min(axis=0)),
+            ("p50", runs[1]),
+            ("p75", np.percentile(runs, 75, axis=0)),
+        ):
+            np.testing.assert_allclose(
+                result[f"RCHRES_1_RO_{name}"], expected, rtol=1e-5, atol=1e-6
+            )
+
+    def test_ensemble_glob(self):
+        # the other time-series are the same in every run
+        result = hspfbintoolbox.ensemble(
+            os.path.join(self.tmpdir.name, "run*.hbn"),
+            "monthly",
+            "PERLND,,,",
+            statistics=["std"],
+            percentiles=[],
+            start_date="2000-01-01",
+        )
+        monthly = hspfbintoolbox.extract(
+            "tests/data_multi.hbn", "monthly", "PERLND,,,", start_date="2000-01-01"
+        )
+        self.assertEqual(list(result.columns), [f"{i}_std" for i in monthly.columns])
+        self.assertTrue(result.index.equals(monthly.index))
+        self.assertEqual(np.abs(result.values).max(), 0)
+
+    def test_ensemble_single_pass(self):
+        daily = hspfbintoolbox.extract("tests/data_multi.hbn", "daily", ",,,")
+        scan = hspfbintoolbox.HbnFile._scan
+
+        def fail(hbn):
+            raise AssertionError("the record index was built")
+
+        try:
+            # the labels are matched as the files are streamed
+            hspfbintoolbox.HbnFile._scan = fail
+            result = hspfbintoolbox.ensemble(
+                self.filenames, "daily", ",,,", statistics=["max"], percentiles=[]
+            )
+        finally:
+            hspfbintoolbox.HbnFile._scan = scan
+        self.assertEqual(list(result.columns), [f"{i}_max" for i in daily.columns])
+
+    def test_ensemble_not_chronological(self):
+        # the records of each operation are written in chunks of years
+        result = hspfbintoolbox.ensemble(
+            ["tests/data_yearly.hbn"] * 2, "yearly", "PERLND,905,,", percentiles=[50]
+        )
+        yearly = hspfbintoolbox.extract(
+            "tests/data_yearly.hbn", "yearly", "PERLND,905,,"
+        )
+        self.assertTrue(result.index.equals(yearly.index))
+        for column in yearly.columns:
+            np.testing.assert_allclose(result[f"{column}_p50"], yearly[column])
+
+    def test_ensemble_cli(self):
+        pattern = os.path.join(self.tmpdir.name, "run*.hbn")
+        args = f"hspfbintoolbox ensemble '{pattern}' daily ,1,,RO --statistics=mean --percentiles=50"
+        out = subprocess.Popen(
+            shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+        ).communicate()[0]
+        self.assertEqual(
+            out.splitlines()[0], b"Datetime,RCHRES_1_RO_mean,RCHRES_1_RO_p50"
+        )
@@ -5,11 +5,16 @@ catalog
 Tests for `hspfbintoolbox` module.
 """
 
+import contextlib
+import os
 import shlex
 import subprocess
 import sys
+import tempfile
+import tracemalloc
 from unittest import TestCase
 
+import numpy as np
 from pandas.testing import assert_frame_equal
 
 from hspfbintoolbox.toolbox_utils.src.toolbox_utils import tsutils
@@ -200,3 +205,313 @@ class TestDescribe(TestCase):
         )
         otherout.index = otherout.index.to_period()
         assert_frame_equal(out, otherout, check_dtype=False)
+
+    def test_extract_start_end_date_api(self):
+        out = hspfbintoolbox.extract(
+            "tests/data_yearly.hbn",
+            "yearly",
+            ",905,,AGWS",
+            start_date="1960-01-01",
+            end_date="1970-12-31",
+        )
+        otherout = tsutils.asbestfreq(
+            pd.read_csv(self.extract_api, header=0, index_col=0, parse_dates=True)
+        )
+        otherout.index = otherout.index.to_period()
+        otherout = otherout.loc["1960":"1970"]
+        otherout.index.name = "Datetime"
+        assert_frame_equal(out, otherout, check_dtype=False)
+
+    def test_extract_label_file_api(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as fpo:
+            fpo.write("OPERATIONTYPE,ID,GROUP,VARIABLE\n# comment\n\n,901:903,,AGWS\n")
+        try:
+            out = hspfbintoolbox.extract(
+                "tests/data_yearly.hbn", "yearly", ",905,,AGWS", label_file=fpo.name
+            )
+        finally:
+            os.remove(fpo.name)
+        otherout = tsutils.asbestfreq(
+            pd.read_csv(self.extract_range_api, header=0, index_col=0, parse_dates=True)
+        )
+        otherout.index = otherout.index.to_period()
+        assert_frame_equal(out, otherout, check_dtype=False)
+
+    def test_extract_label_file_stdin_cli(self):
+        args = "hspfbintoolbox extract --label_file - tests/data_yearly.hbn yearly"
+        out = subprocess.Popen(
+            shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+        ).communicate(b",901:903+905,,AGWS\n")[0]
+        self.assertEqual(out, self.extract_range)
+
+    def test_extract_many_labels_api(self):
+        labels = [f"PERLND,{i},,AGWS" for i in range(1, 1000)]
+        out = hspfbintoolbox.extract("tests/data_yearly.hbn", "yearly", *labels)
+        self.assertIn("PERLND_905_AGWS", out.columns)
+
+    def test_extract_missing_ids_warning_api(self):
+        stderr = StringIO()
+        with contextlib.redirect_stderr(stderr):
+            hspfbintoolbox.extract(
+                "tests/data_yearly.hbn", "yearly", "PERLND,901:950,,AGWS"
+            )
+        warning = " ".join(stderr.getvalue().replace("\n*", "\n").split())
+        # 906 to 950 are missing, and only the first 20 are listed
+        self.assertIn("IDs [906, 907, 908,", warning)
+        self.assertIn("925] and 25 more", warning)
+
+    def test_extract_same_id_and_group_api(self):
+        # PERLND 101 and IMPLND 101 both have ATEMP and SNOW groups
+        out = hspfbintoolbox.extract(
+            "tests/data_collide.hbn", "monthly", ",101,SNOW,", ",101,ATEMP,"
+        )
+        self.assertEqual(
+            list(out.columns),
+            [
+                "PERLND_101_AIRTMP",
+                "PERLND_101_PACK",
+                "PERLND_101_MELT",
+                "PERLND_101_SNOWF",
+                "IMPLND_101_AIRTMP",
+                "IMPLND_101_PACKF",
+                "IMPLND_101_PACKW",
+            ],
+        )
+        self.assertAlmostEqual(out.loc["2000-01", "PERLND_101_SNOWF"], 2.957, 4)
+        self.assertAlmostEqual(out.loc["2000-01", "IMPLND_101_AIRTMP"], 0.1974, 4)
+        self.assertAlmostEqual(out.loc["2000-01", "IMPLND_101_PACKW"], 1.7836, 4)
+
+    def test_extract_bivl_api(self):
+        # 30 minute records for two days, valued by time step and block, and
+        # dated by the end of each step as HSPF writes them
+        out = hspfbintoolbox.extract("tests/data_bivl.hbn", "bivl", ",,,")
+        index = pd.period_range("1999-01-01 00:30", "1999-01-03 00:00", freq="30min")
+        self.assertEqual(out.index.freqstr, "30min")
+        self.assertTrue(out.index.equals(index))
+        self.assertEqual(out.index.name, "Datetime")
+        steps = np.arange(1, 97, dtype=np.float64)
+        np.testing.assert_array_equal(out["PERLND_101_SURO"], steps)
+        np.testing.assert_array_equal(out["PERLND_101_AGWO"], steps + 0.5)
+        np.testing.assert_array_equal(out["RCHRES_2_VOL"], steps + 2000.25)
+
+        out = hspfbintoolbox.extract(
+            "tests/data_bivl.hbn",
+            "bivl",
+            "RCHRES,1,,RO",
+            start_date="1999-01-02 06:00",
+            end_date="1999-01-02 12:00",
+        )
+        self.assertTrue(out.index.equals(index[59:72]))
+        np.testing.assert_array_equal(out["RCHRES_1_RO"], steps[59:72] + 1000)
+
+    def test_extract_memory_budget_api(self):
+        out = hspfbintoolbox.extract(
+            "tests/data_multi.hbn", "daily", ",,,", memory_budget="1KB"
+        )
+        assert_frame_equal(
+            out, hspfbintoolbox.extract("tests/data_multi.hbn", "daily", ",,,")
+        )
+        # the values are backed by the temporary memory mapped file
+        base = out._mgr.blocks[0].values
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        self.assertIsInstance(base, np.memmap)
+
+    def test_extract_memory_budget_holds_api(self):
+        # the daily records of data_multi.hbn are not evenly spaced, so the
+        # values are gathered rather than read through views
+        build_labelsets = hspfbintoolbox._build_labelsets
+        start = []
+
+        def after_scan(*args):
+            # measure from after the records are found
+            tracemalloc.reset_peak()
+            start.append(tracemalloc.get_traced_memory()[0])
+            return build_labelsets(*args)
+
+        def peak(label):
+            tracemalloc.start()
+            try:
+                hspfbintoolbox.extract(
+                    "tests/data_multi.hbn", "daily", label, memory_budget="1KB"
+                )
+                return tracemalloc.get_traced_memory()[1] - start[-1]
+            finally:
+                tracemalloc.stop()
+
+        try:
+            hspfbintoolbox._build_labelsets = after_scan
+            peak("PERLND,101,,SURO")
+            one = peak("PERLND,101,,SURO")
+            four = peak("PERLND,101,,")
+        finally:
+            hspfbintoolbox._build_labelsets = build_labelsets
+        # less than a single column of the 731 daily float32 values more
+        self.assertLess(four - one, 731 * 4)
+
+    def test_extract_bad_memory_budget_api(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox.extract(
+                "tests/data_multi.hbn", "daily", ",,,", memory_budget="lots"
+            )
+
+    def test_extract_last_n_api(self):
+        for filename, interval in (
+            ("tests/data_multi.hbn", "monthly"),
+            ("tests/data_yearly.hbn", "yearly"),
+        ):
+            assert_frame_equal(
+                hspfbintoolbox.extract(filename, interval, ",,,", last_n=3),
+                hspfbintoolbox.extract(filename, interval, ",,,").iloc[-3:],
+            )
+
+    def test_extract_last_n_bivl_api(self):
+        # the last time step alone does not give the 30 minute step
+        out = hspfbintoolbox.extract("tests/data_bivl.hbn", "bivl", ",,,", last_n=1)
+        self.assertEqual(out.index.freqstr, "30min")
+        assert_frame_equal(
+            out, hspfbintoolbox.extract("tests/data_bivl.hbn", "bivl", ",,,").iloc[-1:]
+        )
+
+    def test_extract_tail_cli(self):
+        args = "hspfbintoolbox extract --tail 2 tests/data_yearly.hbn yearly ,905,,AGWS"
+        out = subprocess.Popen(
+            shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+        ).communicate()[0]
+        lines = self.extract.splitlines()
+        self.assertEqual(out.splitlines(), lines[:1] + lines[-2:])
+
+    def test_extract_start_date_seek_api(self):
+        for filename, interval, start_date in (
+            ("tests/data_daily.hbn", "daily", "2001-03-05"),
+            ("tests/data_multi.hbn", "monthly", "2000-06-15"),
+            ("tests/data_yearly.hbn", "yearly", "1990"),
+        ):
+            with hspfbintoolbox.HbnFile(filename) as hbn:
+                # read the whole file
+                hbn.since = lambda start_date: None
+                expected = hspfbintoolbox._extract(
+                    hbn, interval, (",,,",), start_date=start_date
+                )
+            assert_frame_equal(
+                hspfbintoolbox.extract(
+                    filename, interval, ",,,", start_date=start_date
+                ),
+                expected,
+            )
+
+    def test_extract_start_date_loaded_api(self):
+        with hspfbintoolbox.HbnFile("tests/data_daily.hbn") as hbn:
+            hbn.load()
+            calls = []
+            hbn.since = calls.append
+            out = hspfbintoolbox._extract(
+                hbn, "daily", (",,,",), start_date="2001-03-05"
+            )
+            self.assertEqual(calls, [])
+        assert_frame_equal(
+            out,
+            hspfbintoolbox.extract(
+                "tests/data_daily.hbn", "daily", ",,,", start_date="2001-03-05"
+            ),
+        )
+
+    def test_extract_start_date_bivl_api(self):
+        # only the last time step is from 'start_date'
+        out = hspfbintoolbox.extract(
+            "tests/data_bivl.hbn", "bivl", ",,,", start_date="1999-01-03 00:00"
+        )
+        self.assertEqual(out.index.freqstr, "30min")
+        assert_frame_equal(
+            out, hspfbintoolbox.extract("tests/data_bivl.hbn", "bivl", ",,,").iloc[-1:]
+        )
+
+    def test_extract_weights_file_api(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as fpo:
+            fpo.write(
+                "OPERATIONTYPE,ID,WEIGHT,AGGREGATE\n"
+                "# acres\n"
+                "PERLND,101,10.5,upper\n"
+                "PERLND,102,2,upper\n"
+                "PERLND,102,3,lower\n"
+            )
+        try:
+            out = hspfbintoolbox.extract(
+                "tests/data_multi.hbn",
+                "daily",
+                "PERLND,,,SURO",
+                "PERLND,,,AGWO",
+                weights_file=fpo.name,
+            )
+        finally:
+            os.remove(fpo.name)
+        daily = hspfbintoolbox.extract("tests/data_multi.hbn", "daily", "PERLND,,,")
+        expected = pd.DataFrame(
+            {
+                "upper_SURO": 10.5 * daily["PERLND_101_SURO"]
+                + 2 * daily["PERLND_102_SURO"],
+                "upper_AGWO": 10.5 * daily["PERLND_101_AGWO"]
+                + 2 * daily["PERLND_102_AGWO"],
+                "lower_SURO": 3 * daily["PERLND_102_SURO"],
+                "lower_AGWO": 3 * daily["PERLND_102_AGWO"],
+            }
+        )
+        assert_frame_equal(out, expected[list(out.columns)], check_names=False)
+        self.assertEqual(
+            sorted(out.columns),
+            ["lower_AGWO", "lower_SURO", "upper_AGWO", "upper_SURO"],
+        )
+
+    def test_extract_bad_weights_file_api(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as fpo:
+            fpo.write("PERLND,101,ten,upper\n")
+        try:
+            with self.assertRaises(ValueError):
+                hspfbintoolbox.extract(
+                    "tests/data_multi.hbn", "daily", ",,,", weights_file=fpo.name
+                )
+        finally:
+            os.remove(fpo.name)
+
+    def test_extract_expr_api(self):
+        daily = hspfbintoolbox.extract("tests/data_multi.hbn", "daily", "PERLND,,,")
+        expr = "TOTAL=SURO+IFWO+AGWO; SHARE=where(PERO > 0, SURO / PERO, 0)"
+        numexpr = hspfbintoolbox.numexpr
+        try:
+            for evaluator in (numexpr, None):
+                hspfbintoolbox.numexpr = evaluator
+                out = hspfbintoolbox.extract(
+                    "tests/data_multi.hbn", "daily", "PERLND,,,", expr=expr
+                )
+                self.assertEqual(
+                    list(out.columns),
+                    [
+                        "PERLND_101_TOTAL",
+                        "PERLND_101_SHARE",
+                        "PERLND_102_TOTAL",
+                        "PERLND_102_SHARE",
+                    ],
+                )
+                for lue in (101, 102):
+                    np.testing.assert_allclose(
+                        out[f"PERLND_{lue}_TOTAL"],
+                        daily[f"PERLND_{lue}_SURO"]
+                        + daily[f"PERLND_{lue}_IFWO"]
+                        + daily[f"PERLND_{lue}_AGWO"],
+                        rtol=1e-6,
+                    )
+                    pero = daily[f"PERLND_{lue}_PERO"]
+                    np.testing.assert_allclose(
+                        out[f"PERLND_{lue}_SHARE"],
+                        np.where(pero > 0, daily[f"PERLND_{lue}_SURO"] / pero, 0),
+                        rtol=1e-6,
+                    )
+        finally:
+            hspfbintoolbox.numexpr = numexpr
+
+    def test_extract_bad_expr_api(self):
+        for expr in ("TOTAL=__import__('os')", "TOTAL=SURO.real", "SURO+IFWO", "ONE=1"):
+            with self.assertRaises(ValueError):
+                hspfbintoolbox.extract(
+                    "tests/data_multi.hbn", "daily", "PERLND,,,", expr=expr
+                )
@@ -0,0 +1,40 @@
+"""
+extract_intervals
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+from unittest import TestCase
+
+from pandas.testing import assert_frame_equal
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestExtractIntervals(TestCase):
+    def test_extract_intervals_api(self):
+        out = hspfbintoolbox.extract_intervals(
+            "tests/data_multi.hbn",
+            ["daily", "monthly", "yearly"],
+            "PERLND,101,PWATER,",
+            "RCHRES,1,,RO",
+        )
+        self.assertEqual(list(out.keys()), ["daily", "monthly", "yearly"])
+        for interval, result in out.items():
+            otherout = hspfbintoolbox.extract(
+                "tests/data_multi.hbn",
+                interval,
+                "PERLND,101,PWATER,",
+                "RCHRES,1,,RO",
+            )
+            assert_frame_equal(result, otherout)
+
+    def test_extract_intervals_lengths(self):
+        out = hspfbintoolbox.extract_intervals(
+            "tests/data_multi.hbn", ["yearly", "monthly", "daily"], ",102,,SURO"
+        )
+        self.assertEqual(len(out["yearly"]), 2)
+        self.assertEqual(len(out["monthly"]), 24)
+        self.assertEqual(len(out["daily"]), 731)
+        self.assertEqual(list(out["daily"].columns), ["PERLND_102_SURO"])
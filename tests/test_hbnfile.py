@@ -0,0 +1,229 @@
+"""
+HbnFile
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+from unittest import TestCase, skipIf
+
+import numpy as np
+from pandas.testing import assert_frame_equal
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestHbnFile(TestCase):
+    def test_records(self):
+        with hspfbintoolbox.HbnFile("tests/data_yearly.hbn") as hbn:
+            self.assertEqual(len(hbn.offset), 6344)
+            self.assertEqual((hbn.rectype == 0).sum(), 122)
+            self.assertEqual(hbn.offset[0], 1)
+            self.assertEqual(hbn.optype[0], b"PERLND")
+            self.assertEqual(hbn.lue[0], 411)
+            self.assertEqual(hbn.group[0], b"PWATER")
+            self.assertEqual(hbn.level[1], 5)
+            self.assertEqual(hbn.dates[1], np.datetime64("1950-12-31"))
+            self.assertEqual(
+                len(hbn.values(1)), len(hbn.vnames[(b"PERLND", 411, b"PWATER")])
+            )
+
+    def test_series_keys(self):
+        with hspfbintoolbox.HbnFile("tests/data_collide.hbn") as hbn:
+            names = hbn.vnames[(b"IMPLND", 101, b"SNOW")]
+            self.assertEqual(names, ["PACKF", "PACKW"])
+            keys = hbn.series_keys((b"IMPLND", 101, b"SNOW", 4))
+            self.assertEqual(
+                keys,
+                (
+                    ("IMPLND", 101, "SNOW", "PACKF", 4),
+                    ("IMPLND", 101, "SNOW", "PACKW", 4),
+                ),
+            )
+            # the names are interned and the keys are only built once
+            self.assertIs(keys[0][3], names[0])
+            self.assertIs(keys, hbn.series_keys((b"IMPLND", 101, b"SNOW", 4)))
+
+    @skipIf(hspfbintoolbox.numba is None, "numba is not installed")
+    def test_numba_scanner(self):
+        with contextlib.ExitStack() as stack:
+            pyhbn = stack.enter_context(
+                hspfbintoolbox.HbnFile("tests/data_multi.hbn", use_numba=False)
+            )
+            nbhbn = stack.enter_context(hspfbintoolbox.HbnFile("tests/data_multi.hbn"))
+            for name in ("offset", "length", "rectype", "lue", "level", "dates"):
+                np.testing.assert_array_equal(
+                    getattr(pyhbn, name), getattr(nbhbn, name)
+                )
+            np.testing.assert_array_equal(pyhbn.optype, nbhbn.optype)
+            np.testing.assert_array_equal(pyhbn.group, nbhbn.group)
+
+    def test_column_view(self):
+        with hspfbintoolbox.HbnFile("tests/data_yearly.hbn") as hbn:
+            recnos = hbn.blocks()[(b"PERLND", 905, b"PWATER", 5)]
+            self.assertEqual(len(recnos), 51)
+            # the first three records of the block are next to each other
+            col = hbn.column(recnos[:3], 3)
+            self.assertFalse(col.flags.owndata)
+            self.assertFalse(col.flags.writeable)
+            np.testing.assert_array_equal(col, [hbn.values(i)[3] for i in recnos[:3]])
+            del col
+            np.testing.assert_array_equal(
+                hbn.column(recnos, 3), [hbn.values(i)[3] for i in recnos]
+            )
+
+    def test_column_runs(self):
+        with hspfbintoolbox.HbnFile("tests/data_multi.hbn") as hbn:
+            recnos = hbn.blocks()[(b"RCHRES", 1, b"HYDR", 3)]
+            self.assertEqual(len(recnos), 731)
+            np.testing.assert_array_equal(
+                hbn.column(recnos, 1), [hbn.values(i)[1] for i in recnos]
+            )
+
+    def test_periodic_layout(self):
+        with hspfbintoolbox.HbnFile("tests/data_daily.hbn") as hbn:
+            layout = hbn.layout
+            self.assertIsNotNone(layout)
+            self.assertEqual(layout.ncycles, 1096)
+            self.assertEqual(len(layout.keys), 3)
+            with hspfbintoolbox.HbnFile(
+                "tests/data_daily.hbn", use_layout=False
+            ) as scanned:
+                for name in ("offset", "length", "rectype", "lue", "level", "dates"):
+                    np.testing.assert_array_equal(
+                        getattr(hbn, name), getattr(scanned, name)
+                    )
+                recnos = scanned.blocks()[(b"RCHRES", 2, b"HYDR", 3)]
+                for step in (0, 500, 1095):
+                    self.assertEqual(
+                        hbn.record_offset((b"RCHRES", 2, b"HYDR", 3), step),
+                        scanned.offset[recnos[step]],
+                    )
+
+    def test_broken_layout(self):
+        with open("tests/data_daily.hbn", "rb") as fpi:
+            data = fpi.read()
+        with hspfbintoolbox.HbnFile("tests/data_daily.hbn") as hbn:
+            layout = hbn.layout
+        # swap the first two records, of different lengths, of a cycle that
+        # is not sampled by '_detect_layout'
+        start = layout.start + 100 * layout.cycle_bytes
+        middle, end = (start + int(i) for i in layout.offsets[1:3])
+        data = data[:start] + data[middle:end] + data[start:middle] + data[end:]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "broken.hbn")
+            with open(filename, "wb") as fpo:
+                fpo.write(data)
+            with contextlib.ExitStack() as stack:
+                hbn = stack.enter_context(hspfbintoolbox.HbnFile(filename))
+                scanned = stack.enter_context(
+                    hspfbintoolbox.HbnFile(filename, use_layout=False)
+                )
+                self.assertIsNotNone(hbn.layout)
+                for name in ("offset", "length", "rectype", "lue", "level", "dates"):
+                    np.testing.assert_array_equal(
+                        getattr(hbn, name), getattr(scanned, name)
+                    )
+                self.assertIsNone(hbn.layout)
+                self.assertEqual(hbn.skipped, [])
+                assert_frame_equal(
+                    hspfbintoolbox._extract(hbn, "daily", (",,,",)),
+                    hspfbintoolbox._extract(scanned, "daily", (",,,",)),
+                )
+
+    def test_not_periodic_layout(self):
+        for filename in ("tests/data_yearly.hbn", "tests/data_multi.hbn"):
+            with hspfbintoolbox.HbnFile(filename) as hbn:
+                self.assertIsNone(hbn.layout)
+                self.assertIsNone(hbn.record_offset((b"PERLND", 101, b"PWATER", 3), 0))
+
+
+class TestResync(TestCase):
+    def setUp(self):
+        with open("tests/data_yearly.hbn", "rb") as fpi:
+            self.data = bytearray(fpi.read())
+        with hspfbintoolbox.HbnFile("tests/data_yearly.hbn") as hbn:
+            self.offset = hbn.offset.copy()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "corrupt.hbn")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def scan(self, use_numba=True):
+        with open(self.filename, "wb") as fpo:
+            fpo.write(self.data)
+        stderr = io.StringIO()
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(contextlib.redirect_stderr(stderr))
+            hbn = stack.enter_context(
+                hspfbintoolbox.HbnFile(self.filename, use_numba=use_numba)
+            )
+            return hbn.offset.copy(), hbn.skipped, stderr.getvalue()
+
+    def test_corrupt_records(self):
+        # overwrite the leaders of records 100 and 101
+        start, second, end = (int(i) for i in self.offset[100:103])
+        self.data[start : start + 4] = b"\xff\xff\xff\xff"
+        self.data[second + 4 : second + 8] = b"\x07\0\0\0"
+        for use_numba in (True, False):
+            if use_numba and hspfbintoolbox.numba is None:
+                continue
+            offset, skipped, warning = self.scan(use_numba)
+            self.assertEqual(skipped, [(start, end)])
+            self.assertIn("Warning", warning)
+            np.testing.assert_array_equal(offset, np.delete(self.offset, [100, 101]))
+
+    def test_short_record(self):
+        # a data record length too short for the leader and one value
+        start, end = (int(i) for i in self.offset[-2:])
+        self.assertEqual(self.data[start + 4], 1)
+        self.data[start : start + 4] = bytes([30 << 2 | self.data[start] & 3, 0, 0, 0])
+        for use_numba in (True, False):
+            if use_numba and hspfbintoolbox.numba is None:
+                continue
+            offset, skipped, _ = self.scan(use_numba)
+            self.assertEqual(skipped, [(start, end)])
+            np.testing.assert_array_equal(offset, np.delete(self.offset, -2))
+
+    def test_truncated(self):
+        start = int(self.offset[-1])
+        self.data = self.data[: start + 10]
+        offset, skipped, _ = self.scan()
+        self.assertEqual(skipped, [(start, start + 10)])
+        np.testing.assert_array_equal(offset, self.offset[:-1])
+
+
+class TestTail(TestCase):
+    def test_tail(self):
+        with hspfbintoolbox.HbnFile("tests/data_daily.hbn") as hbn:
+            tail = hbn.tail(2, 3)
+            # the 3 headers and the daily records of 2 days for 3 operations
+            self.assertEqual(list(tail.rectype), [0] * 3 + [1] * 6)
+            np.testing.assert_array_equal(
+                tail.offset[3:], hbn.offset[np.nonzero(hbn.rectype)[0][-6:]]
+            )
+
+    def test_tail_not_chronological(self):
+        # the records of each operation are written in chunks of years
+        with hspfbintoolbox.HbnFile("tests/data_yearly.hbn") as hbn:
+            self.assertIsNone(hbn.tail(3, 5))
+
+
+class TestSeekDate(TestCase):
+    def test_seek_date(self):
+        with hspfbintoolbox.HbnFile("tests/data_daily.hbn") as hbn:
+            # the first record of the day before
+            recno = np.nonzero(hbn.dates == np.datetime64("2001-03-04"))[0][0]
+            self.assertEqual(hbn.seek_date("2001-03-05"), hbn.offset[recno])
+            since = hbn.since("2001-03-05")
+            self.assertEqual(list(since.rectype[:4]), [0, 0, 0, 1])
+            np.testing.assert_array_equal(since.offset[3:], hbn.offset[recno:])
+
+    def test_since_not_chronological(self):
+        with hspfbintoolbox.HbnFile("tests/data_yearly.hbn") as hbn:
+            self.assertIsNone(hbn.since("1990-01-01"))
@@ -0,0 +1,52 @@
+"""
+label patterns
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+from unittest import TestCase
+
+from pandas.testing import assert_frame_equal
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestLabelPatterns(TestCase):
+    def setUp(self):
+        self.expected = hspfbintoolbox.extract(
+            "tests/data_multi.hbn",
+            "monthly",
+            "PERLND,,,SURO",
+            "PERLND,,,IFWO",
+            "PERLND,,,AGWO",
+            "PERLND,,,PERO",
+            "RCHRES,,,RO",
+        )
+
+    def test_glob(self):
+        out = hspfbintoolbox.extract("tests/data_multi.hbn", "monthly", ",,,*O")
+        assert_frame_equal(out, self.expected)
+
+    def test_regex(self):
+        out = hspfbintoolbox.extract("tests/data_multi.hbn", "monthly", ",,,re:.*O")
+        assert_frame_equal(out, self.expected)
+
+    def test_group_glob(self):
+        out = hspfbintoolbox.extract("tests/data_multi.hbn", "monthly", ",,pw*,")
+        self.assertEqual(
+            sorted(out.columns),
+            sorted(
+                f"PERLND_{lue}_{name}"
+                for lue in (101, 102)
+                for name in ("SURO", "IFWO", "AGWO", "PERO")
+            ),
+        )
+
+    def test_optype_glob(self):
+        out = hspfbintoolbox.extract("tests/data_multi.hbn", "monthly", "R*,1,,")
+        self.assertEqual(list(out.columns), ["RCHRES_1_RO", "RCHRES_1_VOL"])
+
+    def test_bad_regex(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox.extract("tests/data_multi.hbn", "monthly", ",,,re:(")
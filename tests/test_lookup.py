@@ -0,0 +1,75 @@
+"""
+lookup
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+from unittest import TestCase
+
+import numpy as np
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestLookup(TestCase):
+    def setUp(self):
+        self.observations = [
+            ("RCHRES,1,HYDR,RO", "daily", "2000-03-05"),
+            ("PERLND,101,,SURO", "monthly", "1999-06-15"),
+            ("RCHRES,1,HYDR,RO", "daily", "1999-01-01"),
+            ("PERLND,101,,SURO", "yearly", "2000"),
+            ("RCHRES,1,HYDR,RO", "daily", "1980-01-01"),
+        ]
+
+    def expected(self, filename):
+        values = []
+        for label, interval, date in self.observations:
+            series = hspfbintoolbox.extract(filename, interval, label).iloc[:, 0]
+            values.append(series.get(date[:7] if interval == "monthly" else date))
+        return np.array(values, dtype=float)
+
+    def test_lookup(self):
+        out = hspfbintoolbox.lookup("tests/data_multi.hbn", self.observations)
+        self.assertEqual(list(out["INTERVAL"]), [i[1] for i in self.observations])
+        self.assertEqual(str(out["DATE"][1]), "1999-06")
+        np.testing.assert_allclose(
+            out["VALUE"], self.expected("tests/data_multi.hbn"), rtol=1e-6
+        )
+        self.assertTrue(np.isnan(out["VALUE"].iloc[-1]))
+
+    def test_lookup_paths(self):
+        observations = self.observations[:1] + self.observations[2:3]
+        for use_layout, indexed in ((True, False), (False, False), (True, True)):
+            with hspfbintoolbox.HbnFile(
+                "tests/data_daily.hbn", use_layout=use_layout
+            ) as hbn:
+                if indexed:
+                    hbn.load()
+                values = hspfbintoolbox._lookup(hbn, observations)["VALUE"]
+                # found from the layout or by bisection without the index
+                self.assertEqual("offset" in hbn.__dict__, indexed)
+            np.testing.assert_allclose(
+                values,
+                [
+                    hspfbintoolbox.extract("tests/data_daily.hbn", "daily", label)
+                    .loc[date]
+                    .iloc[0]
+                    for label, _, date in observations
+                ],
+                rtol=1e-6,
+            )
+
+    def test_not_chronological(self):
+        # falls back to the record index
+        out = hspfbintoolbox.lookup(
+            "tests/data_yearly.hbn",
+            [(",905,,AGWS", "yearly", "1960"), (",905,,AGWS", "yearly", "2000")],
+        )
+        np.testing.assert_allclose(out["VALUE"], [0.860453, 0.0191165], rtol=1e-5)
+
+    def test_bad_label(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox.lookup(
+                "tests/data_multi.hbn", [("PERLND,999,,SURO", "daily", "2000-01-01")]
+            )
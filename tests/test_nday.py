@@ -0,0 +1,84 @@
+"""
+nday
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import shlex
+import subprocess
+from unittest import TestCase
+
+import numpy as np
+from pandas.testing import assert_frame_equal
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestNday(TestCase):
+    def test_nday(self):
+        daily = hspfbintoolbox.extract("tests/data_daily.hbn", "daily", ",,,")
+        means = daily.rolling(7).mean()
+        means.index = means.index.to_timestamp()
+        for start_month in (1, 4):
+            out = hspfbintoolbox.nday(
+                "tests/data_daily.hbn",
+                ",,,",
+                statistics=["min", "max"],
+                start_month=start_month,
+            )
+            year = means.index.year + (
+                (means.index.month >= start_month) if start_month > 1 else 0
+            )
+            self.assertEqual(list(out.index.year), sorted(set(year)))
+            for column in daily.columns:
+                np.testing.assert_allclose(
+                    out[f"{column}_min7"], means[column].groupby(year).min()
+                )
+                np.testing.assert_allclose(
+                    out[f"{column}_max7"], means[column].groupby(year).max()
+                )
+
+    def test_nday_not_chronological(self):
+        expected = hspfbintoolbox.nday("tests/data_multi.hbn", ",,,", window=3)
+        stream_blocks = hspfbintoolbox._stream_blocks
+        try:
+            # the records of each time-series read backwards
+            hspfbintoolbox._stream_blocks = lambda hbn, wanted: reversed(
+                list(stream_blocks(hbn, wanted, chunk=200))
+            )
+            out = hspfbintoolbox.nday("tests/data_multi.hbn", ",,,", window=3)
+        finally:
+            hspfbintoolbox._stream_blocks = stream_blocks
+        assert_frame_equal(out, expected)
+
+    def test_nday_single_pass(self):
+        daily = hspfbintoolbox.extract("tests/data_daily.hbn", "daily", ",,,")
+        scan = hspfbintoolbox.HbnFile._scan
+
+        def fail(hbn):
+            raise AssertionError("the record index was built")
+
+        try:
+            # the labels are matched as the file is streamed
+            hspfbintoolbox.HbnFile._scan = fail
+            out = hspfbintoolbox.nday("tests/data_daily.hbn", ",,,")
+        finally:
+            hspfbintoolbox.HbnFile._scan = scan
+        self.assertEqual(list(out.columns), [f"{i}_min7" for i in daily.columns])
+
+    def test_nday_no_match(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox.nday("tests/data_daily.hbn", "IMPLND,,,")
+
+    def test_nday_bad_window(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox.nday("tests/data_daily.hbn", ",,,", window=0)
+
+    def test_nday_cli(self):
+        args = "hspfbintoolbox nday --window=30 tests/data_multi.hbn ,1,,RO"
+        out = subprocess.Popen(
+            shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+        ).communicate()[0]
+        self.assertEqual(out.splitlines()[0], b"Datetime,RCHRES_1_RO_min30")
+        self.assertEqual(len(out.splitlines()), 3)
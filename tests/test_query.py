@@ -0,0 +1,103 @@
+"""
+query
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+from pandas.testing import assert_frame_equal
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestQuery(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "data_multi.hbn")
+        shutil.copy("tests/data_multi.hbn", self.filename)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_zonemap(self):
+        zones = hspfbintoolbox.zonemap(self.filename, chunk_size=30)
+        self.assertTrue(os.path.exists(f"{self.filename}.zonemap.npz"))
+        daily = hspfbintoolbox.extract(self.filename, "daily", ",1,,RO")
+        first = zones[(zones["ID"] == 1) & (zones["VARIABLE"] == "RO")].iloc[0]
+        self.assertEqual(first["INTERVAL"], "daily")
+        self.assertEqual(first["COUNT"], 30)
+        self.assertAlmostEqual(first["MAXIMUM"], daily.iloc[:30, 0].max(), 5)
+        self.assertAlmostEqual(first["SUM"], daily.iloc[:30, 0].sum(), 3)
+
+    def test_query(self):
+        out = hspfbintoolbox.query(
+            self.filename, ">0.9", "PERLND,101,,", interval="daily"
+        )
+        daily = hspfbintoolbox.extract(self.filename, "daily", "PERLND,101,,")
+        self.assertEqual(list(out["COUNT"]), list((daily > 0.9).sum()))
+        self.assertEqual(
+            str(out["FIRST_DATE"][0]), str(daily.index[daily.iloc[:, 0] > 0.9][0])
+        )
+        # the same with the zone maps
+        hspfbintoolbox.zonemap(self.filename, chunk_size=7)
+        assert_frame_equal(
+            hspfbintoolbox.query(
+                self.filename, ">0.9", "PERLND,101,,", interval="daily"
+            ),
+            out,
+        )
+
+    def test_query_predicates(self):
+        hspfbintoolbox.zonemap(self.filename, chunk_size=7)
+        monthly = hspfbintoolbox.extract(self.filename, "monthly", ",,,")
+        for predicate, test in (
+            (">=1", np.greater_equal),
+            ("<0.01", np.less),
+            ("==0", np.equal),
+            ("!=0", np.not_equal),
+        ):
+            out = hspfbintoolbox.query(self.filename, predicate, interval="monthly")
+            counts = {
+                f"{optype}_{lue}_{variable}": count
+                for optype, lue, variable, count in zip(
+                    out["OPERATIONTYPE"], out["ID"], out["VARIABLE"], out["COUNT"]
+                )
+            }
+            expected = test(monthly.astype(np.float32), float(predicate.lstrip("<>=!")))
+            expected = expected.sum()
+            self.assertEqual(counts, expected[expected > 0].to_dict())
+
+    def test_stale_zonemap(self):
+        hspfbintoolbox.zonemap(self.filename)
+        with open(self.filename, "r+b") as fpo:
+            # make the first RO value of RCHRES 1 large
+            with hspfbintoolbox.HbnFile(self.filename) as hbn:
+                recno = hbn.blocks()[(b"RCHRES", 1, b"HYDR", 3)][0]
+                start = int(hbn.offset[recno]) + 56
+            fpo.seek(start)
+            fpo.write(np.float32(1e6).tobytes())
+        out = hspfbintoolbox.query(self.filename, ">1000")
+        self.assertEqual(list(out["ID"]), [1])
+
+    def test_bad_predicate(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox.query(self.filename, "~1")
+
+    def test_query_cli(self):
+        hspfbintoolbox.zonemap(self.filename)
+        args = f"hspfbintoolbox query {self.filename} '>2' ,1,,"
+        out = subprocess.Popen(
+            shlex.split(args), stdout=subprocess.PIPE, stdin=subprocess.PIPE
+        ).communicate()[0]
+        self.assertEqual(
+            out.splitlines()[0],
+            b"OPERATIONTYPE,ID,GROUP,VARIABLE,INTERVAL,COUNT,FIRST_DATE,LAST_DATE",
+        )
@@ -0,0 +1,149 @@
+"""
+serve
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import json
+import os
+import shlex
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+def run(args, stderr=False, **env):
+    out = subprocess.Popen(
+        shlex.split(args),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.PIPE,
+        env={**os.environ, **env},
+    ).communicate()
+    return out if stderr else out[0]
+
+
+class TestServe(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.tmpdir.name, "server.json")
+        os.environ["HSPFBINTOOLBOX_SERVER_FILE"] = self.state_file
+        self.thread = threading.Thread(target=hspfbintoolbox.serve, daemon=True)
+        self.thread.start()
+        for _ in range(100):
+            if os.path.exists(self.state_file):
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        hspfbintoolbox.serve(stop=True)
+        self.thread.join(10)
+        del os.environ["HSPFBINTOOLBOX_SERVER_FILE"]
+        self.tmpdir.cleanup()
+
+    def test_extract_forwarded(self):
+        args = "hspfbintoolbox extract tests/data_multi.hbn monthly ,101,,SURO ,1,,RO"
+        direct = run(args, HSPFBINTOOLBOX_NO_SERVER="1")
+        self.assertEqual(run(args), direct)
+        path = os.path.realpath("tests/data_multi.hbn")
+        self.assertTrue(any(key[0] == path for key in hspfbintoolbox._hbnfile_cache))
+
+    def test_warnings_forwarded(self):
+        args = "hspfbintoolbox extract tests/data_multi.hbn monthly ,101,,SURO ,999,,RO"
+        direct = run(args, stderr=True, HSPFBINTOOLBOX_NO_SERVER="1")
+        self.assertIn(b"Warning", direct[1])
+        self.assertEqual(run(args, stderr=True), direct)
+
+    def test_catalog_forwarded(self):
+        args = "hspfbintoolbox catalog tests/data_yearly.hbn"
+        self.assertEqual(run(args), run(args, HSPFBINTOOLBOX_NO_SERVER="1"))
+
+    def test_error_forwarded(self):
+        with self.assertRaises(ValueError):
+            hspfbintoolbox._server_request(
+                "extract",
+                {
+                    "hbnfilename": os.path.abspath("tests/data_yearly.hbn"),
+                    "interval": "weekly",
+                    "labels": [",905,,AGWS"],
+                    "start_date": None,
+                    "end_date": None,
+                    "sort_columns": False,
+                },
+            )
+
+    def test_unresponsive_server(self):
+        # a stale state file for a port that accepts but never answers
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.listen()
+            with open(self.state_file) as fpi:
+                state = json.load(fpi)
+            with open(self.state_file, "w") as fpo:
+                json.dump({**state, "port": sock.getsockname()[1]}, fpo)
+            timeout = hspfbintoolbox._SERVER_TIMEOUT
+            try:
+                hspfbintoolbox._SERVER_TIMEOUT = 0.5
+                self.assertIsNone(hspfbintoolbox._server_request("catalog", {}))
+            finally:
+                hspfbintoolbox._SERVER_TIMEOUT = timeout
+                with open(self.state_file, "w") as fpo:
+                    json.dump(state, fpo)
+
+    def test_slow_request(self):
+        # a request that takes longer than the ping timeout is waited for
+        catalog = hspfbintoolbox._catalog
+        timeout = hspfbintoolbox._SERVER_TIMEOUT
+
+        def slow_catalog(*args, **kwds):
+            time.sleep(1)
+            return catalog(*args, **kwds)
+
+        try:
+            hspfbintoolbox._catalog = slow_catalog
+            hspfbintoolbox._SERVER_TIMEOUT = 0.25
+            result = hspfbintoolbox._server_request(
+                "catalog", {"hbnfilename": os.path.abspath("tests/data_yearly.hbn")}
+            )
+        finally:
+            hspfbintoolbox._catalog = catalog
+            hspfbintoolbox._SERVER_TIMEOUT = timeout
+        self.assertIsNotNone(result)
+        self.assertEqual(len(result), len(catalog("tests/data_yearly.hbn")))
+
+    def test_untrusted_state_file(self):
+        if not hasattr(os, "getuid"):
+            self.skipTest("no file owners")
+        request = {"hbnfilename": os.path.abspath("tests/data_yearly.hbn")}
+        self.assertIsNotNone(hspfbintoolbox._server_request("catalog", request))
+        os.chmod(self.state_file, 0o644)
+        try:
+            self.assertIsNone(hspfbintoolbox._server_request("catalog", request))
+        finally:
+            os.chmod(self.state_file, 0o600)
+
+    def test_state_file_location(self):
+        environ = dict(os.environ)
+        try:
+            del os.environ["HSPFBINTOOLBOX_SERVER_FILE"]
+            os.environ["XDG_RUNTIME_DIR"] = self.tmpdir.name
+            self.assertEqual(
+                hspfbintoolbox._server_state_file(),
+                os.path.join(self.tmpdir.name, "hspfbintoolbox-server.json"),
+            )
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_stop(self):
+        hspfbintoolbox.serve(stop=True)
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.state_file))
+        self.assertIsNone(hspfbintoolbox._server_request("catalog", {}))
@@ -0,0 +1,92 @@
+"""
+validate
+----------------------------------
+
+Tests for `hspfbintoolbox` module.
+"""
+
+import os
+import shlex
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from hspfbintoolbox import hspfbintoolbox
+
+
+class TestValidate(TestCase):
+    def setUp(self):
+        with open("tests/data_daily.hbn", "rb") as fpi:
+            self.data = bytearray(fpi.read())
+        with hspfbintoolbox.HbnFile("tests/data_daily.hbn") as hbn:
+            self.offset = hbn.offset.copy()
+            self.length = hbn.length.copy()
+            self.recnos = hbn.blocks()[(b"RCHRES", 2, b"HYDR", 3)]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "bad.hbn")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def validate(self):
+        with open(self.filename, "wb") as fpo:
+            fpo.write(self.data)
+        return hspfbintoolbox.validate(self.filename)
+
+    def test_valid(self):
+        for filename in ("tests/data_yearly.hbn", "tests/data_daily.hbn"):
+            self.assertEqual(len(hspfbintoolbox.validate(filename)), 0)
+
+    def test_valid_cli(self):
+        proc = subprocess.run(
+            shlex.split("hspfbintoolbox validate tests/data_multi.hbn"),
+            stdout=subprocess.PIPE,
+            check=False,
+        )
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(proc.stdout, b"")
+
+    def test_magic(self):
+        self.data[0] = 0
+        issues = self.validate()
+        self.assertEqual(list(issues["CHECK"]), ["magic"])
+        message = issues["MESSAGE"][0]
+        self.assertNotIn("\n", message)
+        self.assertTrue(message.startswith(self.filename), message)
+
+    def test_back_pointer(self):
+        recno = int(self.recnos[10])
+        self.data[int(self.offset[recno] + 4 + self.length[recno])] ^= 0x10
+        issues = self.validate()
+        self.assertIn(
+            (int(self.offset[recno]), "back pointer"),
+            list(zip(issues["OFFSET"], issues["CHECK"])),
+        )
+
+    def test_missing_time_step(self):
+        recno = int(self.recnos[100])
+        start, end = int(self.offset[recno]), int(self.offset[recno + 1])
+        del self.data[start:end]
+        issues = self.validate()
+        self.assertEqual(list(issues["CHECK"]), ["missing"])
+        self.assertIn("RCHRES 2 HYDR is missing 1 time steps", issues["MESSAGE"][0])
+        # the offset of the next record of the time-series
+        self.assertEqual(
+            issues["OFFSET"][0], self.offset[self.recnos[101]] - (end - start)
+        )
+
+    def test_dates_not_increasing_cli(self):
+        # swap the dates of two records
+        first, second = (int(self.offset[i]) + 36 for i in self.recnos[5:7])
+        self.data[first : first + 12], self.data[second : second + 12] = (
+            self.data[second : second + 12],
+            self.data[first : first + 12],
+        )
+        self.validate()
+        proc = subprocess.run(
+            shlex.split(f"hspfbintoolbox validate {self.filename}"),
+            stdout=subprocess.PIPE,
+            check=False,
+        )
+        self.assertEqual(proc.returncode, 1)
+        self.assertIn(b"not increasing", proc.stdout)